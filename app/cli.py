@@ -0,0 +1,234 @@
+import argparse
+import asyncio
+import time
+from typing import get_args
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
+
+from app.database import async_session
+from app.environment import settings, logger, RecommenderEngine
+from app.models import UserRecommendation, UserNeighbor
+from app.recommender import (
+    ALSModel, Recommender, UserLSH, load_rating_matrix, export_recommendations, neighbor_recall, exact_neighbors,
+    batch_size
+)
+
+
+async def train_als(args: argparse.Namespace) -> None:
+    """
+    Обучение ALS-модели по всем оценкам и сохранение ее для API.
+    :param args: Аргументы командной строки.
+    """
+    async with async_session() as db:
+        matrix = await load_rating_matrix(db)
+    model = ALSModel.train(matrix, args.factors, args.iterations, args.regularization)
+    model.save(args.output)
+    logger.info("ALS model saved to %s: %d users, %d books, train RMSE %.4f",
+                args.output, matrix.n_users, matrix.n_books, model.rmse(matrix))
+
+
+async def fill_recommendations(args: argparse.Namespace) -> None:
+    """
+    Расчет рекомендаций для всех пользователей и сохранение их в user_recommendation.
+
+    Пользователи обрабатываются пачками: рекомендации пачки считаются матричными
+    операциями и записываются одним запросом в отдельной транзакции.
+    :param args: Аргументы командной строки.
+    """
+    recommender = Recommender()
+    async with async_session() as db:
+        await recommender.build(db)
+        if settings.RECOMMENDER_ENGINE == "als":
+            recommender.load_als_model()
+
+        user_ids = recommender.matrix.user_ids.tolist()
+        for start in range(0, len(user_ids), args.chunk_size):
+            chunk = user_ids[start:start + args.chunk_size]
+            book_ids = await asyncio.to_thread(recommender.recommend_batch, chunk, args.count)
+            statement = insert(UserRecommendation).values([
+                {"user_id": user_id, "book_ids": books}
+                for user_id, books in zip(chunk, book_ids)
+            ])
+            await db.execute(statement.on_conflict_do_update(
+                index_elements=[UserRecommendation.user_id],
+                set_={"book_ids": statement.excluded.book_ids, "computed_at": func.now()}
+            ))
+            await db.commit()
+            logger.info("Recommendations stored for %d of %d users",
+                        min(start + args.chunk_size, len(user_ids)), len(user_ids))
+
+
+async def fill_neighbors(args: argparse.Namespace) -> None:
+    """
+    Расчет TOP_N_USERS похожих пользователей для всех пользователей и сохранение их в user_neighbor.
+
+    Соседи пачки пользователей ищутся матричными операциями, пачка записывается
+    одним запросом в отдельной транзакции.
+    :param args: Аргументы командной строки.
+    """
+    async with async_session() as db:
+        matrix = await load_rating_matrix(db)
+        size = batch_size(matrix)
+        for start in range(0, matrix.n_users, size):
+            user_indices = np.arange(start, min(start + size, matrix.n_users))
+            rows, neighbors, similarities = await asyncio.to_thread(
+                exact_neighbors, matrix, user_indices, settings.TOP_N_USERS
+            )
+            positive = similarities > 0
+            rows, neighbors, similarities = rows[positive], neighbors[positive], similarities[positive]
+            bounds = np.searchsorted(rows, np.arange(len(user_indices) + 1))
+            statement = insert(UserNeighbor).values([
+                {
+                    "user_id": int(matrix.user_ids[user_idx]),
+                    "neighbor_ids": matrix.user_ids[neighbors[bounds[i]:bounds[i + 1]]].tolist(),
+                    "similarities": similarities[bounds[i]:bounds[i + 1]].tolist()
+                }
+                for i, user_idx in enumerate(user_indices)
+            ])
+            await db.execute(statement.on_conflict_do_update(
+                index_elements=[UserNeighbor.user_id],
+                set_={
+                    "neighbor_ids": statement.excluded.neighbor_ids,
+                    "similarities": statement.excluded.similarities,
+                    "computed_at": func.now()
+                }
+            ))
+            await db.commit()
+            logger.info("Neighbors stored for %d of %d users", user_indices[-1] + 1, matrix.n_users)
+
+
+async def export_all(args: argparse.Namespace) -> None:
+    """
+    Выгрузка рекомендаций всех пользователей в файл .npz для аналитики.
+    :param args: Аргументы командной строки.
+    """
+    recommender = Recommender()
+    async with async_session() as db:
+        await recommender.build(db)
+    if (args.engine or settings.RECOMMENDER_ENGINE) == "als":
+        recommender.load_als_model()
+    count = await asyncio.to_thread(
+        export_recommendations, recommender, args.output, args.count, args.block_size, args.engine
+    )
+    logger.info("%d recommendations exported to %s", count, args.output)
+
+
+async def lsh_recall(args: argparse.Namespace) -> None:
+    """
+    Измерение полноты и скорости приближенного поиска похожих пользователей
+    относительно точного на случайной выборке пользователей.
+    :param args: Аргументы командной строки.
+    """
+    async with async_session() as db:
+        matrix = await load_rating_matrix(db)
+    started = time.perf_counter()
+    index = UserLSH.build(matrix, args.tables, args.bits)
+    logger.info("LSH index built in %.1f s: %d tables x %d bits", time.perf_counter() - started,
+                args.tables, args.bits)
+    sample = np.random.default_rng(0).choice(matrix.n_users, min(args.sample, matrix.n_users), replace=False)
+    for probes in args.probes:
+        recall, exact_seconds, approximate_seconds = neighbor_recall(
+            matrix, index, sample, settings.TOP_N_USERS, probes, args.candidates
+        )
+        logger.info("probes=%d candidates=%d: recall@%d %.3f, exact %.2f ms/user, approximate %.2f ms/user",
+                    probes, args.candidates, settings.TOP_N_USERS, recall,
+                    exact_seconds * 1000 / len(sample), approximate_seconds * 1000 / len(sample))
+
+
+async def benchmark_engines(args: argparse.Namespace) -> None:
+    """
+    Сравнение алгоритмов рекомендаций на одних данных: время построения
+    структур алгоритма и время расчета на случайной выборке пользователей.
+    :param args: Аргументы командной строки.
+    """
+    recommender = Recommender()
+    async with async_session() as db:
+        await recommender.build(db)
+    if "als" in args.engines:
+        recommender.load_als_model()
+    sample = np.random.default_rng(0).choice(
+        recommender.matrix.user_ids, min(args.sample, recommender.matrix.n_users), replace=False
+    ).tolist()
+    for name in args.engines:
+        engine = recommender.engines[name]
+        started = time.perf_counter()
+        view = recommender.view()
+        if not engine.available(view):
+            logger.warning("%s: not available, skipped", name)
+            continue
+        if not engine.ready(view):
+            engine.build(view)
+            engine.install(view)
+        built = time.perf_counter()
+        book_ids = recommender.recommend_batch(sample, args.count, name)
+        finished = time.perf_counter()
+        logger.info("%s: build %.1f s, %.2f ms/user, %.1f recommendations/user", name, built - started,
+                    (finished - built) * 1000 / max(len(sample), 1),
+                    sum(len(books) for books in book_ids) / max(len(sample), 1))
+
+
+async def build_artifact(args: argparse.Namespace) -> None:
+    """
+    Построение модели по базе данных и публикация новой версии артефакта для воркеров API.
+    :param args: Аргументы командной строки.
+    """
+    recommender = Recommender()
+    async with async_session() as db:
+        await recommender.build(db)
+    await recommender.refresh_item_neighbors()
+    recommender.load_als_model()
+    recommender.publish_artifact()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Фоновые задачи сервиса рекомендаций")
+    commands = parser.add_subparsers(required=True)
+
+    als = commands.add_parser("train-als", help="Обучение ALS-модели")
+    als.add_argument("--factors", type=int, default=settings.ALS_FACTORS)
+    als.add_argument("--iterations", type=int, default=settings.ALS_ITERATIONS)
+    als.add_argument("--regularization", type=float, default=settings.ALS_REGULARIZATION)
+    als.add_argument("--output", default=settings.ALS_MODEL_PATH)
+    als.set_defaults(handler=train_als)
+
+    fill = commands.add_parser("fill-recommendations", help="Предвычисление рекомендаций всех пользователей")
+    fill.add_argument("--count", type=int, default=settings.PRECOMPUTED_RECOMMENDATIONS)
+    fill.add_argument("--chunk-size", type=int, default=1000)
+    fill.set_defaults(handler=fill_recommendations)
+
+    neighbors = commands.add_parser("fill-neighbors", help="Предвычисление похожих пользователей")
+    neighbors.set_defaults(handler=fill_neighbors)
+
+    export = commands.add_parser("export-recommendations", help="Выгрузка рекомендаций всех пользователей")
+    export.add_argument("--count", type=int, default=settings.PRECOMPUTED_RECOMMENDATIONS)
+    export.add_argument("--block-size", type=int, default=None)
+    export.add_argument("--output", default="recommendations.npz")
+    export.add_argument("--engine", choices=get_args(RecommenderEngine), default=None)
+    export.set_defaults(handler=export_all)
+
+    lsh = commands.add_parser("lsh-recall", help="Полнота приближенного поиска похожих пользователей")
+    lsh.add_argument("--tables", type=int, default=settings.LSH_TABLES)
+    lsh.add_argument("--bits", type=int, default=settings.LSH_BITS)
+    lsh.add_argument("--probes", type=int, nargs="+", default=[0, settings.LSH_PROBES])
+    lsh.add_argument("--candidates", type=int, default=settings.LSH_CANDIDATES)
+    lsh.add_argument("--sample", type=int, default=1000)
+    lsh.set_defaults(handler=lsh_recall)
+
+    benchmark = commands.add_parser("benchmark-engines", help="Сравнение скорости алгоритмов рекомендаций")
+    benchmark.add_argument("--engines", choices=get_args(RecommenderEngine), nargs="+",
+                           default=["user", "item", "popularity"])
+    benchmark.add_argument("--count", type=int, default=settings.PRECOMPUTED_RECOMMENDATIONS)
+    benchmark.add_argument("--sample", type=int, default=1000)
+    benchmark.set_defaults(handler=benchmark_engines)
+
+    artifact = commands.add_parser("build-artifact", help="Публикация модели для воркеров API")
+    artifact.set_defaults(handler=build_artifact)
+
+    args = parser.parse_args()
+    asyncio.run(args.handler(args))
+
+
+if __name__ == "__main__":
+    main()
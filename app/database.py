@@ -18,4 +18,14 @@ async def get_db() -> AsyncGenerator[AsyncSession, AsyncSession]:
         yield session
 
 
+def get_session_factory() -> async_sessionmaker[AsyncSession]:
+    """
+    Зависимость FastAPI для задач, которые могут пережить запрос
+    и поэтому открывают собственные сессии.
+    :return: Фабрика асинхронных сессий к БД.
+    """
+    return async_session
+
+
 AsyncDB = Annotated[AsyncSession, Depends(get_db)]
+SessionFactory = Annotated[async_sessionmaker[AsyncSession], Depends(get_session_factory)]
@@ -1,4 +1,5 @@
 import logging
+from typing import Literal
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from sqlalchemy import URL
@@ -6,6 +7,8 @@ from sqlalchemy import URL
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
 logger = logging.getLogger(__name__)
 
+RecommenderEngine = Literal["user", "item", "als", "neighbors", "popularity"]
+
 
 class Settings(BaseSettings):
     """
@@ -31,6 +34,37 @@ class Settings(BaseSettings):
     ACCESS_TOKEN_EXPIRE_MINUTES: int
 
     TOP_N_USERS: int = 5
+    USER_NEIGHBORS_INDEX: Literal["exact", "lsh"] = "exact"
+    LSH_TABLES: int = 16
+    LSH_BITS: int = 10
+    LSH_PROBES: int = 4
+    LSH_CANDIDATES: int = 1000
+    RATING_LOADER: Literal["stream", "copy"] = "copy"
+    RECOMMENDER_ENGINE: RecommenderEngine = "user"
+    USER_NEIGHBORS_TTL: int = 86400
+    ITEM_NEIGHBORS: int = 50
+    ITEM_NEIGHBORS_REFRESH_INTERVAL: int = 3600
+    ALS_MODEL_PATH: str = "artifacts/als"
+    ALS_FACTORS: int = 64
+    ALS_ITERATIONS: int = 15
+    ALS_REGULARIZATION: float = 0.1
+    PRECOMPUTED_RECOMMENDATIONS: int = 100
+    PRECOMPUTED_RECOMMENDATIONS_TTL: int = 86400
+    RECOMMENDER_PROCESSES: int = 0
+    RECOMMENDER_JOURNAL_LIMIT: int = 10000
+    RECOMMENDER_ARTIFACT_DIR: str = "artifacts/recommender"
+    RECOMMENDER_ARTIFACT_TTL: int = 86400
+    RECOMMENDER_ARTIFACT_INTERVAL: int = 3600
+    RECOMMENDER_SYNC_INTERVAL: int = 60
+    RATING_CHANGES_OVERLAP: int = 60
+    RECOMMENDER_CATCH_UP_LIMIT: int = 100000
+    POPULARITY_REFRESH_INTERVAL: int = 60
+    RANKED_LIST_SIZE: int = 1000
+    RANKED_LIST_CACHE_SIZE: int = 10000
+    RANKED_LIST_TTL: int = 600
+    RECOMMENDATIONS_LATENCY_BUDGET: float = 1.0
+    RECOMMENDATIONS_CONCURRENCY: int = 4
+    RECOMMENDATIONS_QUEUE: int = 32
 
     model_config = SettingsConfigDict(env_file="env/app.env")
 
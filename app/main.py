@@ -1,8 +1,34 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 
+from app.database import async_session
+from app.environment import settings
+from app.recommender import recommender
 from app.routers import user, author, genre, book, rating
 
-app = FastAPI(title="Book Recommender API", version="1.0.0")
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    if settings.RECOMMENDER_PROCESSES > 0:
+        recommender.start_pool(settings.RECOMMENDER_PROCESSES)
+    recommender.session_factory = async_session
+    async with async_session() as db:
+        await recommender.start(db)
+    if recommender.als_model is None:
+        recommender.load_als_model()
+    background_tasks = [
+        asyncio.create_task(recommender.sync_periodically(async_session)),
+        asyncio.create_task(recommender.refresh_item_neighbors_periodically())
+    ]
+    yield
+    for task in background_tasks:
+        task.cancel()
+    recommender.close()
+
+
+app = FastAPI(title="Book Recommender API", version="1.0.0", lifespan=lifespan)
 
 app.include_router(user.router)
 app.include_router(author.router)
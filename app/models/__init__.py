@@ -4,4 +4,7 @@ from .book import Book
 from .book_genre import BookGenre
 from .genre import Genre
 from .rating import Rating
+from .rating_deletion import RatingDeletion
 from .user import User
+from .user_neighbor import UserNeighbor
+from .user_recommendation import UserRecommendation
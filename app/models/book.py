@@ -41,7 +41,10 @@ class Book(Base):
         secondary="book_genre",
         back_populates="books"
     )
-    ratings: Mapped[list["Rating"]] = relationship(back_populates="book")
+    ratings: Mapped[list["Rating"]] = relationship(
+        back_populates="book",
+        passive_deletes=True
+    )
 
     @classmethod
     async def get_by_id_full(cls, db: AsyncSession, book_id: int) -> Optional["Book"]:
@@ -61,3 +64,23 @@ class Book(Base):
             )
             .where(cls.id == book_id))
         return result.scalar_one_or_none()
+
+    @classmethod
+    async def get_by_ids_full(cls, db: AsyncSession, book_ids: list[int]) -> list["Book"]:
+        """
+        Полное получение книг одним запросом в порядке переданных идентификаторов.
+
+        :param db: Сессия базы данных.
+        :param book_ids: Идентификаторы книг.
+        :return: Объекты книг, несуществующие идентификаторы пропускаются.
+        """
+        result = await db.execute(
+            select(cls)
+            .options(
+                selectinload(cls.author),
+                selectinload(cls.genres),
+                selectinload(cls.ratings)
+            )
+            .where(cls.id.in_(book_ids)))
+        books = {book.id: book for book in result.scalars().all()}
+        return [books[book_id] for book_id in book_ids if book_id in books]
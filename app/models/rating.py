@@ -1,6 +1,7 @@
+from datetime import datetime
 from typing import Optional
 
-from sqlalchemy import Integer, ForeignKey, String, select
+from sqlalchemy import Integer, ForeignKey, String, DateTime, select, func
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from .base import Base
@@ -35,6 +36,13 @@ class Rating(Base):
         nullable=True,
         comment="Отзыв о книге"
     )
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        onupdate=func.now(),
+        index=True,
+        comment="Время последнего изменения рейтинга"
+    )
 
     user: Mapped["User"] = relationship(back_populates="ratings")
     book: Mapped["Book"] = relationship(back_populates="ratings")
@@ -0,0 +1,56 @@
+from datetime import datetime
+
+from sqlalchemy import Integer, DateTime, DDL, event, func
+from sqlalchemy.orm import Mapped, mapped_column
+
+from .base import Base
+from .rating import Rating
+
+
+class RatingDeletion(Base):
+    """
+    Модель журнала удаленных рейтингов.
+
+    Заполняется триггером на удаление из rating, в том числе каскадное
+    при удалении книги или пользователя, чтобы модель рекомендаций могла
+    догнать удаления с момента своего снимка.
+    """
+
+    __tablename__ = "rating_deletion"
+
+    id: Mapped[int] = mapped_column(
+        Integer,
+        primary_key=True,
+        comment="Идентификатор записи"
+    )
+    user_id: Mapped[int] = mapped_column(
+        Integer,
+        comment="Идентификатор пользователя"
+    )
+    book_id: Mapped[int] = mapped_column(
+        Integer,
+        comment="Идентификатор книги"
+    )
+    deleted_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        index=True,
+        comment="Время удаления рейтинга"
+    )
+
+
+RECORD_RATING_DELETION = DDL("""
+CREATE OR REPLACE FUNCTION record_rating_deletion() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO rating_deletion (user_id, book_id) VALUES (OLD.user_id, OLD.book_id);
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql
+""")
+RATING_DELETION_TRIGGER = DDL("""
+CREATE TRIGGER rating_deletion AFTER DELETE ON rating
+FOR EACH ROW EXECUTE FUNCTION record_rating_deletion()
+""")
+
+event.listen(Rating.__table__, "after_create", RECORD_RATING_DELETION)
+event.listen(Rating.__table__, "after_create", RATING_DELETION_TRIGGER)
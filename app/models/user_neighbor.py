@@ -0,0 +1,51 @@
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import ForeignKey, Integer, Float, DateTime, select, func
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Mapped, mapped_column
+
+from .base import Base
+
+
+class UserNeighbor(Base):
+    """Модель предвычисленных похожих пользователей."""
+
+    __tablename__ = "user_neighbor"
+
+    user_id: Mapped[int] = mapped_column(
+        ForeignKey("user.id", onupdate="cascade", ondelete="cascade"),
+        primary_key=True,
+        comment="Идентификатор пользователя"
+    )
+    neighbor_ids: Mapped[list[int]] = mapped_column(
+        ARRAY(Integer),
+        comment="Идентификаторы похожих пользователей в порядке убывания сходства"
+    )
+    similarities: Mapped[list[float]] = mapped_column(
+        ARRAY(Float),
+        comment="Косинусное сходство с похожими пользователями"
+    )
+    computed_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        comment="Время расчета похожих пользователей"
+    )
+
+    @classmethod
+    async def get_fresh(cls, db: AsyncSession, user_id: int, max_age: timedelta) -> Optional["UserNeighbor"]:
+        """
+        Получение похожих пользователей, рассчитанных не раньше max_age назад.
+
+        :param db: Сессия базы данных.
+        :param user_id: Идентификатор пользователя.
+        :param max_age: Срок годности списка.
+        :return: Объект похожих пользователей.
+        """
+        result = await db.execute(
+            select(cls)
+            .where(cls.user_id == user_id)
+            .where(cls.computed_at > func.now() - max_age)
+        )
+        return result.scalar_one_or_none()
@@ -0,0 +1,57 @@
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import ForeignKey, Integer, DateTime, select, delete, func
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Mapped, mapped_column
+
+from .base import Base
+
+
+class UserRecommendation(Base):
+    """Модель предвычисленных рекомендаций пользователя."""
+
+    __tablename__ = "user_recommendation"
+
+    user_id: Mapped[int] = mapped_column(
+        ForeignKey("user.id", onupdate="cascade", ondelete="cascade"),
+        primary_key=True,
+        comment="Идентификатор пользователя"
+    )
+    book_ids: Mapped[list[int]] = mapped_column(
+        ARRAY(Integer),
+        comment="Идентификаторы рекомендованных книг в порядке убывания оценки"
+    )
+    computed_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        comment="Время расчета рекомендаций"
+    )
+
+    @classmethod
+    async def get_fresh(cls, db: AsyncSession, user_id: int, max_age: timedelta) -> Optional["UserRecommendation"]:
+        """
+        Получение рекомендаций пользователя, рассчитанных не раньше max_age назад.
+
+        :param db: Сессия базы данных.
+        :param user_id: Идентификатор пользователя.
+        :param max_age: Срок годности рекомендаций.
+        :return: Объект рекомендаций.
+        """
+        result = await db.execute(
+            select(cls)
+            .where(cls.user_id == user_id)
+            .where(cls.computed_at > func.now() - max_age)
+        )
+        return result.scalar_one_or_none()
+
+    @classmethod
+    async def discard(cls, db: AsyncSession, user_id: int) -> None:
+        """
+        Удаление устаревших после изменения оценок рекомендаций пользователя.
+
+        :param db: Сессия базы данных.
+        :param user_id: Идентификатор пользователя.
+        """
+        await db.execute(delete(cls).where(cls.user_id == user_id))
@@ -0,0 +1,16 @@
+from .matrix import RatingMatrix, PatchedRatingMatrix
+from .similarity import (
+    top_k_indices, top_books, score_books_batch, recommend_books_batch, batch_size, exact_neighbors, neighbor_recall
+)
+from .lsh import UserLSH
+from .engines import Engine, EngineUnavailable, ModelView, ENGINES
+from .admission import AdmissionGate, Saturated
+from .model import Recommender, Snapshot, recommender, get_recommender, CurrentRecommender, recommend_in_process
+from .item_based import ItemNeighbors
+from .als import ALSModel
+from .artifact import Artifact
+from .loader import load_rating_matrix
+from .popularity import PopularityRanking
+from .catalog import BookCatalog, BookFilter
+from .ranking import RankedList, RankedListCache, encode_cursor, decode_cursor
+from .export import export_recommendations
@@ -0,0 +1,95 @@
+import asyncio
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from fastapi import HTTPException, status
+
+
+class Saturated(HTTPException):
+    """Отказ в расчете: все слоты заняты и очередь ожидания заполнена."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many recommendation requests",
+            headers={"Retry-After": str(retry_after)}
+        )
+        self.retry_after = retry_after
+
+
+class AdmissionGate:
+    """
+    Ограничение количества одновременных дорогих расчетов воркера.
+
+    Одновременно выполняется не более limit расчетов, еще не более queue
+    ждут своей очереди, а остальным сразу отказывается с 503 и Retry-After,
+    поэтому всплеск запросов рекомендаций не расходует память воркера
+    и соединения с базой данных, нужные дешевым запросам.
+    Счетчики ожидания и отказов отдаются как метрики, см. metrics().
+    """
+
+    def __init__(self, limit: int, queue: int):
+        self.limit = limit
+        self.queue = queue
+        self.semaphore = asyncio.Semaphore(limit)
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.service_seconds = 0.0
+        self.completed = 0
+
+    @asynccontextmanager
+    async def slot(self, reject: bool = True) -> AsyncIterator[None]:
+        """
+        Занятие слота расчета на время блока with.
+        :param reject: Отказывать при заполненной очереди, иначе ждать в любом случае.
+        :raises Saturated: Если очередь заполнена.
+        """
+        if reject and self.waiting >= self.queue and self.semaphore.locked():
+            self.rejected += 1
+            raise Saturated(self.retry_after())
+        started = time.monotonic()
+        self.waiting += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        admitted = time.monotonic()
+        self.admitted += 1
+        self.wait_seconds += admitted - started
+        self.max_wait_seconds = max(self.max_wait_seconds, admitted - started)
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self.completed += 1
+            self.service_seconds += time.monotonic() - admitted
+            self.semaphore.release()
+
+    def retry_after(self) -> int:
+        """
+        Оценка времени до освобождения места в очереди по среднему времени расчета.
+        :return: Количество секунд, не меньше одной.
+        """
+        service = self.service_seconds / self.completed if self.completed else 1.0
+        return max(1, math.ceil(service * (self.waiting + 1) / max(self.limit, 1)))
+
+    def metrics(self) -> dict:
+        """
+        Текущее состояние и счетчики с запуска воркера.
+        :return: Метрики.
+        """
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "average_wait_seconds": self.wait_seconds / self.admitted if self.admitted else 0.0,
+            "max_wait_seconds": self.max_wait_seconds
+        }
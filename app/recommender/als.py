@@ -0,0 +1,209 @@
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from .matrix import RatingMatrix, SparseRatings, gather_slices, lookup
+from .similarity import top_books
+from .storage import save_arrays, open_arrays
+
+SOLVE_CHUNK_SLOTS = 65536
+
+
+def solve_factors(
+        indptr: np.ndarray,
+        indices: np.ndarray,
+        data: np.ndarray,
+        fixed: np.ndarray,
+        regularization: float
+) -> np.ndarray:
+    """
+    Шаг ALS: факторы строк при фиксированных факторах столбцов.
+
+    Нормальные уравнения (Y_u^T Y_u + λI) x_u = Y_u^T r_u решаются пачками строк
+    близкой длины: факторы оценок каждой строки дополняются нулями до длины
+    самой длинной строки пачки и перемножаются одним пакетным matmul.
+    :param indptr: Указатели строк.
+    :param indices: Индексы столбцов.
+    :param data: Оценки.
+    :param fixed: Факторы столбцов.
+    :param regularization: Коэффициент регуляризации.
+    :return: Факторы строк.
+    """
+    n_rows, n_factors = len(indptr) - 1, fixed.shape[1]
+    result = np.zeros((n_rows, n_factors), dtype=np.float64)
+    ridge = regularization * np.eye(n_factors)
+    order = np.argsort(np.diff(indptr), kind="stable")
+    sorted_lengths = np.diff(indptr)[order]
+    start = 0
+    while start < n_rows:
+        end = min(n_rows, start + max(1, SOLVE_CHUNK_SLOTS // max(sorted_lengths[start], 1)))
+        end = min(end, start + max(1, SOLVE_CHUNK_SLOTS // max(sorted_lengths[end - 1], 1)))
+        rows = order[start:end]
+        positions, lengths = gather_slices(indptr, rows)
+        owners = np.repeat(np.arange(len(rows)), lengths)
+        slots = np.arange(len(positions)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        padded = np.zeros((len(rows), lengths.max(initial=0), n_factors))
+        padded[owners, slots] = fixed[indices[positions]]
+        padded_ratings = np.zeros((len(rows), padded.shape[1], 1))
+        padded_ratings[owners, slots, 0] = data[positions]
+        transposed = padded.transpose(0, 2, 1)
+        result[rows] = np.linalg.solve(transposed @ padded + ridge, transposed @ padded_ratings)[..., 0]
+        start = end
+    return result
+
+
+class ALSModel:
+    """
+    Матричное разложение оценок методом чередующихся наименьших квадратов.
+
+    Оценка книги для пользователя - скалярное произведение их факторов,
+    поэтому рекомендации стоят одного умножения вектора на матрицу факторов книг.
+    """
+
+    ARRAYS = ("user_ids", "book_ids", "user_factors", "book_factors", "regularization")
+
+    def __init__(
+            self,
+            user_ids: np.ndarray,
+            book_ids: np.ndarray,
+            user_factors: np.ndarray,
+            book_factors: np.ndarray,
+            regularization: float
+    ):
+        self.user_ids = user_ids
+        self.book_ids = book_ids
+        self.user_factors = user_factors
+        self.book_factors = book_factors
+        self.regularization = regularization
+
+    @classmethod
+    def train(
+            cls,
+            matrix: RatingMatrix,
+            factors: int,
+            iterations: int,
+            regularization: float,
+            seed: int = 0
+    ) -> "ALSModel":
+        """
+        Обучение модели.
+        :param matrix: Матрица оценок.
+        :param factors: Размерность факторов.
+        :param iterations: Количество итераций.
+        :param regularization: Коэффициент регуляризации.
+        :param seed: Зерно генератора случайных чисел.
+        :return: Обученная модель.
+        """
+        rng = np.random.default_rng(seed)
+        user_factors = rng.normal(scale=0.1, size=(matrix.n_users, factors))
+        book_factors = np.zeros((matrix.n_books, factors))
+        for _ in range(iterations):
+            book_factors = solve_factors(
+                matrix.col_indptr, matrix.col_indices, matrix.col_data, user_factors, regularization
+            )
+            user_factors = solve_factors(
+                matrix.indptr, matrix.indices, matrix.data, book_factors, regularization
+            )
+        return cls(
+            matrix.user_ids.copy(),
+            matrix.book_ids.copy(),
+            user_factors.astype(np.float32),
+            book_factors.astype(np.float32),
+            regularization
+        )
+
+    @classmethod
+    def open(cls, directory: str | Path) -> "ALSModel":
+        """
+        Открытие модели, сохраненной save(), с отображением факторов в память.
+        :param directory: Каталог модели.
+        :return: Модель.
+        """
+        arrays = open_arrays(directory, cls.ARRAYS)
+        arrays["regularization"] = float(arrays["regularization"])
+        return cls(**arrays)
+
+    def save(self, directory: str | Path) -> None:
+        """
+        Сохранение модели в каталог.
+        :param directory: Каталог модели.
+        """
+        save_arrays(directory, {name: np.asarray(getattr(self, name)) for name in self.ARRAYS})
+
+    def rmse(self, matrix: RatingMatrix) -> float:
+        """
+        Среднеквадратичная ошибка модели на оценках матрицы.
+        :param matrix: Матрица оценок с тем же порядком пользователей и книг.
+        :return: Ошибка.
+        """
+        rows = np.repeat(np.arange(matrix.n_users), np.diff(matrix.indptr))
+        predictions = np.einsum(
+            "ij,ij->i",
+            self.user_factors[rows],
+            self.book_factors[matrix.indices]
+        )
+        return float(np.sqrt(np.mean((predictions - matrix.data) ** 2)))
+
+    def user_vectors(self, matrix: SparseRatings, user_indices: np.ndarray) -> np.ndarray:
+        """
+        Факторы пользователей по их текущим оценкам при фиксированных факторах книг.
+        :param matrix: Актуальная матрица оценок.
+        :param user_indices: Индексы строк пользователей.
+        :return: Матрица факторов пользователей.
+        """
+        books, ratings, lengths = matrix.gather_rows(user_indices)
+        positions, known = lookup(self.book_ids, matrix.book_ids[books])
+        owners = np.repeat(np.arange(len(user_indices)), lengths)[known]
+        indptr = np.zeros(len(user_indices) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(owners, minlength=len(user_indices)), out=indptr[1:])
+        return solve_factors(
+            indptr, positions[known], ratings[known], self.book_factors, self.regularization
+        ).astype(np.float32)
+
+    def recommend(self, matrix: SparseRatings, user_id: int, k: int) -> list[int]:
+        """
+        Рекомендации для пользователя по его текущим оценкам.
+        :param matrix: Актуальная матрица оценок.
+        :param user_id: Идентификатор пользователя.
+        :param k: Максимальное количество рекомендаций.
+        :return: Идентификаторы книг в порядке убывания оценки.
+        """
+        user_idx = matrix.user_index(user_id)
+        if user_idx is None:
+            return []
+        return self.recommend_batch(matrix, np.array([user_idx]), k)[0]
+
+    def recommend_batch(
+            self,
+            matrix: SparseRatings,
+            user_indices: np.ndarray,
+            k: int,
+            allowed: Optional[np.ndarray] = None
+    ) -> list[list[int]]:
+        """
+        Рекомендации для пачки пользователей по оценкам score_batch().
+        :param matrix: Актуальная матрица оценок.
+        :param user_indices: Индексы строк пользователей.
+        :param k: Максимальное количество рекомендаций.
+        :param allowed: Маска книг модели, которые можно рекомендовать.
+        :return: Идентификаторы книг в порядке убывания оценки для каждого пользователя.
+        """
+        scores = self.score_batch(matrix, user_indices)
+        if allowed is not None:
+            scores[:, ~allowed] = 0
+        return top_books(scores, self.book_ids, k)
+
+    def score_batch(self, matrix: SparseRatings, user_indices: np.ndarray) -> np.ndarray:
+        """
+        Оценки книг модели для пачки пользователей одним умножением матриц факторов.
+        :param matrix: Актуальная матрица оценок.
+        :param user_indices: Индексы строк пользователей.
+        :return: Оценки размера пачка × книги модели, для оцененных пользователем книг нулевые.
+        """
+        scores = self.user_vectors(matrix, user_indices) @ self.book_factors.T
+        books, _, lengths = matrix.gather_rows(user_indices)
+        positions, known = lookup(self.book_ids, matrix.book_ids[books])
+        owners = np.repeat(np.arange(len(user_indices)), lengths)
+        scores[owners[known], positions[known]] = 0
+        return scores
@@ -0,0 +1,125 @@
+import json
+import os
+import shutil
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+
+from .als import ALSModel
+from .item_based import ItemNeighbors
+from .matrix import RatingMatrix
+
+ARTIFACT_FORMAT = 2
+ARTIFACT_KEEP = 3
+
+
+class Artifact:
+    """
+    Версия модели рекомендаций на диске.
+
+    Каждая версия - отдельный неизменяемый каталог с массивами .npy
+    и описанием manifest.json, а файл CURRENT в корне указывает на
+    действующую версию. Воркеры открывают массивы через numpy.memmap,
+    поэтому все они разделяют одну копию модели через страничный кэш.
+    """
+
+    def __init__(self, directory: Path, manifest: dict):
+        self.directory = directory
+        self.manifest = manifest
+
+    @property
+    def version(self) -> str:
+        return self.manifest["version"]
+
+    @property
+    def high_water_mark(self) -> datetime:
+        """Момент базы данных, изменения после которого в версию могли не попасть."""
+        return datetime.fromisoformat(self.manifest["high_water_mark"])
+
+    @property
+    def age(self) -> float:
+        """Возраст версии в секундах."""
+        return time.time() - self.manifest["created_at"]
+
+    @classmethod
+    def current(cls, root: str | Path) -> Optional["Artifact"]:
+        """
+        Действующая версия модели.
+        :param root: Корневой каталог артефактов.
+        :return: Версия или None, если ее нет или она записана в другом формате.
+        """
+        root = Path(root)
+        try:
+            version = (root / "CURRENT").read_text().strip()
+            manifest = json.loads((root / version / "manifest.json").read_text())
+        except FileNotFoundError:
+            return None
+        if manifest.get("format") != ARTIFACT_FORMAT:
+            return None
+        return cls(root / version, manifest)
+
+    @classmethod
+    def publish(
+            cls,
+            root: str | Path,
+            matrix: RatingMatrix,
+            high_water_mark: datetime,
+            item_neighbors: Optional[ItemNeighbors] = None,
+            als_model: Optional[ALSModel] = None
+    ) -> "Artifact":
+        """
+        Запись новой версии модели и переключение CURRENT на нее.
+
+        Версия пишется во временный каталог и становится видна только после
+        атомарных переименований, поэтому воркеры никогда не открывают
+        недописанную версию. Старые версии, кроме ARTIFACT_KEEP последних,
+        удаляются: открытые воркерами файлы остаются доступны им до закрытия,
+        а снимки для пулов процессов ссылаются на файлы жесткими ссылками.
+        :param root: Корневой каталог артефактов.
+        :param matrix: Матрица оценок.
+        :param high_water_mark: Отметка времени, с которой следует догонять изменения.
+        :param item_neighbors: Окрестности книг.
+        :param als_model: ALS-модель.
+        :return: Новая версия.
+        """
+        root = Path(root)
+        root.mkdir(parents=True, exist_ok=True)
+        version = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f") + f"-{os.getpid()}"
+        staging = root / f".{version}"
+        matrix.save(staging / "matrix")
+        if item_neighbors is not None:
+            item_neighbors.save(staging / "item_neighbors")
+        if als_model is not None:
+            als_model.save(staging / "als")
+        manifest = {
+            "format": ARTIFACT_FORMAT,
+            "version": version,
+            "created_at": time.time(),
+            "high_water_mark": high_water_mark.isoformat(),
+            "users": matrix.n_users,
+            "books": matrix.n_books,
+            "ratings": matrix.nnz,
+            "item_neighbors": item_neighbors is not None,
+            "als": als_model is not None
+        }
+        (staging / "manifest.json").write_text(json.dumps(manifest))
+        os.rename(staging, root / version)
+
+        pointer = root / f".CURRENT-{version}"
+        pointer.write_text(version)
+        os.replace(pointer, root / "CURRENT")
+
+        versions = sorted(path for path in root.iterdir() if path.is_dir() and not path.name.startswith("."))
+        for path in versions[:-ARTIFACT_KEEP]:
+            shutil.rmtree(path, ignore_errors=True)
+        return cls(root / version, manifest)
+
+    def open_matrix(self) -> RatingMatrix:
+        return RatingMatrix.open(self.directory / "matrix")
+
+    def open_item_neighbors(self) -> Optional[ItemNeighbors]:
+        return ItemNeighbors.open(self.directory / "item_neighbors") if self.manifest["item_neighbors"] else None
+
+    def open_als_model(self) -> Optional[ALSModel]:
+        return ALSModel.open(self.directory / "als") if self.manifest["als"] else None
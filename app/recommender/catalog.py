@@ -0,0 +1,123 @@
+import time
+from typing import Optional
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.environment import settings
+from app.models import Book, BookGenre
+from .matrix import lookup
+
+
+class BookCatalog:
+    """
+    Кэш признаков книг для фильтрации рекомендаций.
+
+    Хранит отсортированные идентификаторы всех книг, годы издания и заранее
+    построенные маски жанров над этим индексом, поэтому фильтр - это
+    конъюнкция булевых векторов. Индексы книг у алгоритмов рекомендаций свои,
+    соответствие им вычисляется один раз и хранится до перезагрузки каталога.
+    Сбрасывается при изменении книг в этом воркере, а изменения в других
+    воркерах подхватывает не позже чем через POPULARITY_REFRESH_INTERVAL секунд.
+    """
+
+    def __init__(self):
+        self.book_ids: Optional[np.ndarray] = None
+        self.years: Optional[np.ndarray] = None
+        self.genre_masks: dict[int, np.ndarray] = {}
+        self.loaded_at = 0.0
+        self.alignments: dict[str, tuple[object, int, np.ndarray, np.ndarray]] = {}
+
+    def invalidate(self) -> None:
+        """Пометка каталога устаревшим."""
+        self.book_ids = None
+
+    async def get(self, db: AsyncSession) -> "BookCatalog":
+        """
+        Актуальный каталог, при необходимости загруженный из базы данных.
+        :param db: Сессия базы данных.
+        :return: Каталог.
+        """
+        if self.book_ids is None or time.monotonic() - self.loaded_at > settings.POPULARITY_REFRESH_INTERVAL:
+            books = await db.execute(select(Book.id, Book.publication_year).order_by(Book.id))
+            book_ids, years = np.array(books.all(), dtype=np.int64).reshape(-1, 2).T
+            genres = await db.execute(select(BookGenre.genre_id, BookGenre.book_id))
+            genre_ids, genre_books = np.array(genres.all(), dtype=np.int64).reshape(-1, 2).T
+
+            positions = np.searchsorted(book_ids, genre_books)
+            genre_masks = {}
+            for genre_id in np.unique(genre_ids):
+                mask = np.zeros(len(book_ids), dtype=bool)
+                mask[positions[genre_ids == genre_id]] = True
+                genre_masks[int(genre_id)] = mask
+
+            self.book_ids = book_ids.astype(np.int32)
+            self.years = years.astype(np.int16)
+            self.genre_masks = genre_masks
+            self.alignments = {}
+            self.loaded_at = time.monotonic()
+        return self
+
+    def filter(
+            self,
+            genre_id: Optional[int] = None,
+            year_from: Optional[int] = None,
+            year_to: Optional[int] = None
+    ) -> Optional["BookFilter"]:
+        """
+        Фильтр книг каталога.
+        :param genre_id: Идентификатор жанра.
+        :param year_from: Минимальный год издания.
+        :param year_to: Максимальный год издания.
+        :return: Фильтр или None, если ограничений нет.
+        """
+        if genre_id is None and year_from is None and year_to is None:
+            return None
+        mask = np.ones(len(self.book_ids), dtype=bool)
+        if genre_id is not None:
+            mask &= self.genre_masks.get(genre_id, np.zeros(len(self.book_ids), dtype=bool))
+        if year_from is not None:
+            mask &= self.years >= year_from
+        if year_to is not None:
+            mask &= self.years <= year_to
+        return BookFilter(self.book_ids, mask, self.alignments)
+
+
+class BookFilter:
+    """
+    Маска книг каталога, подходящих под фильтры.
+
+    Хранит ссылки на индекс и кэш соответствий той загрузки каталога,
+    из которой построена, поэтому перезагрузка каталога ее не портит.
+    """
+
+    def __init__(
+            self,
+            book_ids: np.ndarray,
+            mask: np.ndarray,
+            alignments: dict[str, tuple[object, int, np.ndarray, np.ndarray]]
+    ):
+        self.book_ids = book_ids
+        self.mask = mask
+        self.alignments = alignments
+
+    def allowed(self, book_ids: np.ndarray, space: Optional[str] = None, owner: object = None) -> np.ndarray:
+        """
+        Перенос маски на другой индекс книг.
+        :param book_ids: Идентификаторы книг другого индекса.
+        :param space: Имя индекса, под которым соответствие кэшируется.
+        :param owner: Владелец индекса: соответствие верно, пока он тот же и индекс не удлинился.
+        :return: Булев массив над book_ids, книги вне каталога не проходят фильтр.
+        """
+        cached = self.alignments.get(space) if space is not None else None
+        if cached is not None and cached[0] is owner and cached[1] == len(book_ids):
+            positions, found = cached[2], cached[3]
+        else:
+            positions, found = lookup(self.book_ids, book_ids)
+            positions = positions[found]
+            if space is not None:
+                self.alignments[space] = (owner, len(book_ids), positions, found)
+        allowed = np.zeros(len(book_ids), dtype=bool)
+        allowed[found] = self.mask[positions]
+        return allowed
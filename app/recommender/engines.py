@@ -0,0 +1,265 @@
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING, Optional
+
+import numpy as np
+from fastapi import HTTPException, status
+
+from app.environment import settings, logger
+from .als import ALSModel
+from .item_based import ItemNeighbors
+from .lsh import UserLSH
+from .matrix import SparseRatings, PatchedRatingMatrix
+from .similarity import score_books_batch, top_books
+
+if TYPE_CHECKING:
+    from .model import Recommender
+
+
+class EngineUnavailable(HTTPException):
+    """Отказ в расчете: у выбранного алгоритма нет модели, а подменять его другим нельзя."""
+
+    def __init__(self, engine: str):
+        super().__init__(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Recommendation engine {engine} is not available"
+        )
+        self.engine = engine
+
+
+class ModelView:
+    """
+    Согласованный снимок состояния модели для расчета вне цикла событий.
+
+    Матрица (PatchedRatingMatrix.frozen()), индекс похожих пользователей,
+    окрестности книг и ALS-модель снимаются в цикле событий одновременно,
+    поэтому замена модели во время расчета не смешивает старые и новые структуры.
+    """
+
+    def __init__(
+            self,
+            matrix: PatchedRatingMatrix,
+            user_lsh: Optional[UserLSH] = None,
+            item_neighbors: Optional[ItemNeighbors] = None,
+            als_model: Optional[ALSModel] = None
+    ):
+        self.matrix = matrix
+        self.user_lsh = user_lsh
+        self.item_neighbors = item_neighbors
+        self.als_model = als_model
+
+
+class Engine(ABC):
+    """
+    Алгоритм рекомендаций модели воркера.
+
+    build() готовит вспомогательные структуры алгоритма в снимке модели,
+    install() переносит их в модель, update() учитывает изменение матрицы,
+    score() считает плотные оценки книг индекса book_index() для пачки
+    пользователей, а top_k() отбирает лучшие книги.
+    Состояние, общее для нескольких алгоритмов (окрестности книг, ALS-модель),
+    хранит модель. build(), score() и top_k() блокирующие: модель вызывает их
+    вне цикла событий и передает им ModelView, который изменения модели
+    во время расчета не меняют. install() и update() вызываются в цикле событий.
+    """
+
+    def __init__(self, model: "Recommender"):
+        self.model = model
+
+    def available(self, view: ModelView) -> bool:
+        """
+        Может ли алгоритм считать рекомендации, иначе расчет отклоняется (EngineUnavailable).
+        :param view: Снимок модели.
+        """
+        return True
+
+    def ready(self, view: ModelView) -> bool:
+        """
+        Готовы ли структуры алгоритма, иначе перед расчетом нужен build().
+        :param view: Снимок модели.
+        """
+        return True
+
+    def build(self, view: ModelView) -> None:
+        """
+        Построение структур алгоритма в снимке модели.
+        :param view: Снимок модели.
+        """
+
+    def install(self, view: ModelView) -> None:
+        """
+        Перенос построенных build() структур в модель.
+        :param view: Снимок модели, по которому они построены.
+        """
+
+    def update(self, name: str, *args) -> None:
+        """
+        Учет изменения матрицы оценок, уже примененного к ней.
+        :param name: Имя метода PatchedRatingMatrix.
+        :param args: Аргументы метода.
+        """
+
+    def book_index(self, view: ModelView) -> tuple[str, np.ndarray, object]:
+        """
+        Индекс книг, над которым считаются оценки и маски фильтров.
+        :param view: Снимок модели.
+        :return: Имя индекса, идентификаторы книг и владелец индекса, см. BookFilter.allowed().
+        """
+        return "matrix", view.matrix.book_ids, view.matrix.base
+
+    @abstractmethod
+    def score(self, view: ModelView, user_indices: np.ndarray) -> np.ndarray:
+        """
+        Оценки книг для пачки пользователей.
+        :param view: Снимок модели.
+        :param user_indices: Индексы строк пользователей в матрице.
+        :return: Оценки размера пачка × книги индекса, для оцененных пользователем книг нулевые.
+        """
+
+    def top_k(
+            self,
+            view: ModelView,
+            user_indices: np.ndarray,
+            k: int,
+            allowed: Optional[np.ndarray] = None
+    ) -> list[list[int]]:
+        """
+        Рекомендации для пачки пользователей.
+        :param view: Снимок модели.
+        :param user_indices: Индексы строк пользователей в матрице.
+        :param k: Максимальное количество рекомендаций.
+        :param allowed: Маска книг индекса, которые можно рекомендовать.
+        :return: Идентификаторы книг в порядке убывания оценки для каждого пользователя.
+        """
+        scores = self.score(view, user_indices)
+        if allowed is not None:
+            scores[:, ~allowed] = 0
+        return top_books(scores, self.book_index(view)[1], k)
+
+
+class UserCosineEngine(Engine):
+    """
+    Оценки похожих по косинусу пользователей, соседи ищутся точно или по UserLSH.
+    Индекс строит модель вместе с базовой матрицей, build() нужен, только если его нет.
+    """
+
+    def ready(self, view: ModelView) -> bool:
+        return settings.USER_NEIGHBORS_INDEX != "lsh" or view.user_lsh is not None
+
+    def build(self, view: ModelView) -> None:
+        view.user_lsh = self.model.index_users(view.matrix)
+
+    def install(self, view: ModelView) -> None:
+        if self.model.user_lsh is None and self.model.matrix.base is view.matrix.base:
+            self.model.user_lsh = view.user_lsh
+
+    def score(self, view: ModelView, user_indices: np.ndarray) -> np.ndarray:
+        if settings.USER_NEIGHBORS_INDEX == "lsh":
+            return score_books_batch(
+                view.matrix, user_indices, settings.TOP_N_USERS, view.user_lsh,
+                settings.LSH_PROBES, settings.LSH_CANDIDATES
+            )
+        return score_books_batch(view.matrix, user_indices, settings.TOP_N_USERS)
+
+
+class ItemEngine(Engine):
+    """Сумма окрестностей оцененных пользователем книг, см. ItemNeighbors."""
+
+    def ready(self, view: ModelView) -> bool:
+        return view.item_neighbors is not None
+
+    def build(self, view: ModelView) -> None:
+        view.item_neighbors = ItemNeighbors.build(view.matrix.to_matrix(), settings.ITEM_NEIGHBORS)
+
+    def install(self, view: ModelView) -> None:
+        self.model.item_neighbors = view.item_neighbors
+        if self.model.pool is not None:
+            self.model.save_item_neighbors()
+        logger.info("Item neighbors refreshed: %d books", len(view.item_neighbors.book_ids))
+
+    def book_index(self, view: ModelView) -> tuple[str, np.ndarray, object]:
+        return "item", view.item_neighbors.book_ids, view.item_neighbors
+
+    def score(self, view: ModelView, user_indices: np.ndarray) -> np.ndarray:
+        return view.item_neighbors.score_batch(view.matrix, user_indices)
+
+    def top_k(
+            self,
+            view: ModelView,
+            user_indices: np.ndarray,
+            k: int,
+            allowed: Optional[np.ndarray] = None
+    ) -> list[list[int]]:
+        return view.item_neighbors.recommend_batch(view.matrix, user_indices, k, allowed)
+
+
+class ALSEngine(Engine):
+    """
+    Скалярные произведения факторов ALS-модели. Без обученной модели алгоритм
+    недоступен: запросы с ним отклоняются, а не считаются другим алгоритмом.
+    """
+
+    def available(self, view: ModelView) -> bool:
+        return view.als_model is not None
+
+    def book_index(self, view: ModelView) -> tuple[str, np.ndarray, object]:
+        return "als", view.als_model.book_ids, view.als_model
+
+    def score(self, view: ModelView, user_indices: np.ndarray) -> np.ndarray:
+        return view.als_model.score_batch(view.matrix, user_indices)
+
+
+class PopularityEngine(Engine):
+    """
+    Средняя оценка книги по матрице, одинаковая для всех пользователей.
+
+    Самый дешевый алгоритм: средние считаются один раз на изменение матрицы,
+    а оценка пачки - копия вектора средних с обнулением прочитанных книг.
+    """
+
+    def __init__(self, model: "Recommender"):
+        super().__init__(model)
+        self.averages: Optional[tuple[SparseRatings, np.ndarray]] = None
+
+    def build(self, view: ModelView) -> None:
+        self._averages(view.matrix)
+
+    def update(self, name: str, *args) -> None:
+        self.averages = None
+
+    def score(self, view: ModelView, user_indices: np.ndarray) -> np.ndarray:
+        matrix = view.matrix
+        averages = self._averages(matrix)
+        scores = np.repeat(averages[None, :], len(user_indices), axis=0)
+        books, _, lengths = matrix.gather_rows(user_indices)
+        owners = np.repeat(np.arange(len(user_indices)), lengths)
+        known = books < len(averages)
+        scores[owners[known], books[known]] = 0
+        return scores
+
+    def _averages(self, matrix: SparseRatings) -> np.ndarray:
+        """
+        Средние оценки книг матрицы, при необходимости пересчитанные.
+        :param matrix: Матрица оценок.
+        :return: Массив над индексом книг матрицы, для книг без оценок нулевой.
+        """
+        cached = self.averages
+        if cached is not None and cached[0] is matrix:
+            return cached[1]
+        _, values, lengths = matrix.gather_columns(np.arange(matrix.n_books))
+        sums = np.bincount(
+            np.repeat(np.arange(matrix.n_books), lengths),
+            weights=values,
+            minlength=matrix.n_books
+        )
+        averages = (sums / np.maximum(lengths, 1)).astype(np.float32)
+        self.averages = (matrix, averages)
+        return averages
+
+
+ENGINES: dict[str, type[Engine]] = {
+    "user": UserCosineEngine,
+    "neighbors": UserCosineEngine,
+    "item": ItemEngine,
+    "als": ALSEngine,
+    "popularity": PopularityEngine
+}
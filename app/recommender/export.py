@@ -0,0 +1,56 @@
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from app.environment import logger
+from .model import Recommender
+from .similarity import batch_size
+
+
+def export_recommendations(
+        recommender: Recommender,
+        path: str | Path,
+        k: int,
+        block_size: Optional[int] = None,
+        engine: Optional[str] = None
+) -> int:
+    """
+    Расчет рекомендаций всех пользователей модели и запись их в столбцовый файл .npz.
+
+    Пользователи обрабатываются блоками: для блока считается матрица оценок
+    блок × книги и отбираются k лучших книг каждой строки, поэтому память
+    расчета ограничена размером блока. Файл содержит столбцы одинаковой длины
+    user_id (int32), rank (int16, при k больше 32768 - int32) и book_id (int32) -
+    по строке на рекомендацию, например pandas.DataFrame(dict(numpy.load(path))).
+    :param recommender: Построенная модель рекомендаций.
+    :param path: Путь к файлу.
+    :param k: Количество рекомендаций на пользователя.
+    :param block_size: Количество пользователей в блоке, по умолчанию по размеру матрицы.
+    :param engine: Алгоритм рекомендаций, по умолчанию RECOMMENDER_ENGINE.
+    :return: Количество записанных рекомендаций.
+    """
+    user_ids = recommender.matrix.user_ids
+    block_size = block_size or batch_size(recommender.matrix)
+    rank_dtype = np.int16 if k <= np.iinfo(np.int16).max + 1 else np.int32
+    columns = {"user_id": [], "rank": [], "book_id": []}
+    for start in range(0, len(user_ids), block_size):
+        block = user_ids[start:start + block_size].tolist()
+        book_ids = recommender.recommend_batch(block, k, engine)
+        counts = np.array([len(books) for books in book_ids], dtype=np.int64)
+        starts = np.cumsum(counts) - counts
+        columns["user_id"].append(np.repeat(np.array(block, dtype=np.int32), counts))
+        columns["rank"].append((np.arange(counts.sum()) - np.repeat(starts, counts)).astype(rank_dtype))
+        columns["book_id"].append(np.fromiter(
+            (book_id for books in book_ids for book_id in books), dtype=np.int32, count=int(counts.sum())
+        ))
+        logger.info("Recommendations exported for %d of %d users", min(start + block_size, len(user_ids)),
+                    len(user_ids))
+
+    arrays = {
+        name: np.concatenate(parts) if parts else np.zeros(0, dtype=dtype)
+        for (name, parts), dtype in zip(columns.items(), (np.int32, rank_dtype, np.int32))
+    }
+    with open(path, "wb") as file:
+        np.savez_compressed(file, **arrays)
+    return len(arrays["book_id"])
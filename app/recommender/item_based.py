@@ -0,0 +1,176 @@
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from .matrix import RatingMatrix, SparseRatings, lookup
+from .similarity import top_k_indices
+from .storage import save_arrays, open_arrays
+
+
+class ItemNeighbors:
+    """
+    Предвычисленные окрестности наиболее похожих книг.
+
+    Для каждой книги хранится не более k соседей по косинусному сходству
+    столбцов матрицы оценок, поэтому рекомендации для пользователя стоят
+    O(оценок пользователя × k) независимо от количества пользователей.
+    """
+
+    ARRAYS = ("book_ids", "neighbors", "similarities")
+
+    def __init__(self, book_ids: np.ndarray, neighbors: np.ndarray, similarities: np.ndarray):
+        self.book_ids = book_ids
+        self.neighbors = neighbors
+        self.similarities = similarities
+
+    @classmethod
+    def build(cls, matrix: RatingMatrix, k: int) -> "ItemNeighbors":
+        """
+        Расчет окрестностей книг по матрице оценок.
+        :param matrix: Матрица оценок.
+        :param k: Количество соседей каждой книги.
+        :return: Окрестности книг.
+        """
+        column_norms = np.sqrt(np.bincount(
+            np.repeat(np.arange(matrix.n_books), np.diff(matrix.col_indptr)),
+            weights=matrix.col_data.astype(np.float64) ** 2,
+            minlength=matrix.n_books
+        ))
+        neighbors = np.full((matrix.n_books, k), -1, dtype=np.int32)
+        similarities = np.zeros((matrix.n_books, k), dtype=np.float32)
+        for book_idx in range(matrix.n_books):
+            users, ratings = matrix.column(book_idx)
+            books, values, lengths = matrix.gather_rows(users)
+            candidates, inverse = np.unique(books, return_inverse=True)
+            dot_products = np.bincount(
+                inverse,
+                weights=np.repeat(ratings.astype(np.float64), lengths) * values,
+                minlength=len(candidates)
+            )
+            scores = dot_products / (column_norms[candidates] * column_norms[book_idx])
+            scores[candidates == book_idx] = 0
+            top = top_k_indices(scores, k)
+            top = top[scores[top] > 0]
+            neighbors[book_idx, :len(top)] = candidates[top]
+            similarities[book_idx, :len(top)] = scores[top]
+        return cls(matrix.book_ids.copy(), neighbors, similarities)
+
+    @classmethod
+    def open(cls, directory: str | Path) -> "ItemNeighbors":
+        """
+        Открытие окрестностей, сохраненных save(), с отображением массивов в память.
+        :param directory: Каталог окрестностей.
+        :return: Окрестности книг.
+        """
+        return cls(**open_arrays(directory, cls.ARRAYS))
+
+    def save(self, directory: str | Path) -> None:
+        """
+        Сохранение окрестностей в каталог.
+        :param directory: Каталог окрестностей.
+        """
+        save_arrays(directory, {name: getattr(self, name) for name in self.ARRAYS})
+
+    def similar(self, book_id: int, k: int) -> list[int]:
+        """
+        Наиболее похожие книги, то есть чаще всего оцененные теми же пользователями.
+        :param book_id: Идентификатор книги.
+        :param k: Максимальное количество книг.
+        :return: Идентификаторы книг в порядке убывания сходства.
+        """
+        positions, known = lookup(self.book_ids, np.array([book_id]))
+        if not known[0]:
+            return []
+        neighbors = self.neighbors[positions[0], :k]
+        return self.book_ids[neighbors[neighbors >= 0]].tolist()
+
+    def recommend(self, matrix: SparseRatings, user_id: int, k: int) -> list[int]:
+        """
+        Рекомендации для пользователя.
+        :param matrix: Актуальная матрица оценок.
+        :param user_id: Идентификатор пользователя.
+        :param k: Максимальное количество рекомендаций.
+        :return: Идентификаторы книг в порядке убывания оценки.
+        """
+        user_idx = matrix.user_index(user_id)
+        if user_idx is None:
+            return []
+        return self.recommend_row(matrix, user_idx, k)
+
+    def recommend_batch(
+            self,
+            matrix: SparseRatings,
+            user_indices: np.ndarray,
+            k: int,
+            allowed: Optional[np.ndarray] = None
+    ) -> list[list[int]]:
+        """
+        Рекомендации для пачки пользователей.
+
+        Стоимость для каждого пользователя пропорциональна количеству его оценок,
+        поэтому пользователи обрабатываются по отдельности.
+        :param matrix: Актуальная матрица оценок.
+        :param user_indices: Индексы строк пользователей.
+        :param k: Максимальное количество рекомендаций.
+        :param allowed: Маска книг индекса, которые можно рекомендовать.
+        :return: Идентификаторы книг в порядке убывания оценки для каждого пользователя.
+        """
+        return [self.recommend_row(matrix, user_idx, k, allowed) for user_idx in user_indices]
+
+    def score_batch(self, matrix: SparseRatings, user_indices: np.ndarray) -> np.ndarray:
+        """
+        Плотные оценки всех книг индекса для пачки пользователей.
+        :param matrix: Актуальная матрица оценок.
+        :param user_indices: Индексы строк пользователей.
+        :return: Оценки размера пачка × книги индекса.
+        """
+        scores = np.zeros((len(user_indices), len(self.book_ids)), dtype=np.float32)
+        for i, user_idx in enumerate(user_indices):
+            candidates, row_scores = self.score_row(matrix, user_idx)
+            scores[i, candidates] = row_scores
+        return scores
+
+    def recommend_row(
+            self,
+            matrix: SparseRatings,
+            user_idx: int,
+            k: int,
+            allowed: Optional[np.ndarray] = None
+    ) -> list[int]:
+        """
+        Рекомендации для пользователя по оценкам score_row().
+        :param matrix: Актуальная матрица оценок.
+        :param user_idx: Индекс строки пользователя.
+        :param k: Максимальное количество рекомендаций.
+        :param allowed: Маска книг индекса, которые можно рекомендовать.
+        :return: Идентификаторы книг в порядке убывания оценки.
+        """
+        candidates, scores = self.score_row(matrix, user_idx)
+        if allowed is not None:
+            scores[~allowed[candidates]] = 0
+
+        top = top_k_indices(scores, k)
+        top = top[scores[top] > 0]
+        return self.book_ids[candidates[top]].tolist()
+
+    def score_row(self, matrix: SparseRatings, user_idx: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Оценки книг как сумма соседей оцененных пользователем книг, взвешенных оценками.
+        :param matrix: Актуальная матрица оценок.
+        :param user_idx: Индекс строки пользователя.
+        :return: Позиции книг-кандидатов в индексе и их оценки,
+            для оцененных пользователем книг нулевые.
+        """
+        books, ratings = matrix.row(user_idx)
+        rated_ids = matrix.book_ids[books]
+
+        positions, known = lookup(self.book_ids, rated_ids)
+        neighbors = self.neighbors[positions[known]]
+        weights = self.similarities[positions[known]] * ratings[known, None]
+
+        mask = neighbors >= 0
+        candidates, inverse = np.unique(neighbors[mask], return_inverse=True)
+        scores = np.bincount(inverse, weights=weights[mask], minlength=len(candidates))
+        scores[np.isin(self.book_ids[candidates], rated_ids)] = 0
+        return candidates, scores
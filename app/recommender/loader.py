@@ -0,0 +1,201 @@
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.environment import settings
+from app.models import Rating, RatingDeletion
+from .matrix import RatingMatrix, grow
+
+STREAM_BATCH = 50000
+COPY_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+COPY_HEADER_SIZE = len(COPY_SIGNATURE) + 8
+COPY_TRAILER = b"\xff\xff"
+COPY_RECORD = np.dtype([
+    ("fields", ">i2"),
+    ("user_id_size", ">i4"), ("user_id", ">i4"),
+    ("book_id_size", ">i4"), ("book_id", ">i4"),
+    ("rating_size", ">i4"), ("rating", ">i4")
+])
+
+
+class RatingBuffer:
+    """
+    Предвыделенные массивы тройек (пользователь, книга, оценка).
+
+    Оценки дописываются пачками прямо в итоговые массивы компактных типов,
+    поэтому пиковая память - это сами массивы и одна пачка.
+    """
+
+    def __init__(self, capacity: int):
+        self.size = 0
+        self.user_ids = np.zeros(capacity, dtype=np.int32)
+        self.book_ids = np.zeros(capacity, dtype=np.int32)
+        self.ratings = np.zeros(capacity, dtype=np.int8)
+
+    def extend(self, user_ids: np.ndarray, book_ids: np.ndarray, ratings: np.ndarray) -> None:
+        """
+        Добавление пачки оценок, при нехватке места массивы увеличиваются.
+        :param user_ids: Идентификаторы пользователей.
+        :param book_ids: Идентификаторы книг.
+        :param ratings: Оценки.
+        """
+        end = self.size + len(user_ids)
+        self.user_ids = grow(self.user_ids, end)
+        self.book_ids = grow(self.book_ids, end)
+        self.ratings = grow(self.ratings, end)
+        self.user_ids[self.size:end] = user_ids
+        self.book_ids[self.size:end] = book_ids
+        self.ratings[self.size:end] = ratings
+        self.size = end
+
+    def to_matrix(self) -> RatingMatrix:
+        return RatingMatrix.from_triples(
+            self.user_ids[:self.size],
+            self.book_ids[:self.size],
+            self.ratings[:self.size]
+        )
+
+
+class BinaryCopyParser:
+    """
+    Разбор потока COPY ... TO STDOUT (FORMAT binary) из трех столбцов int4.
+
+    Все записи такого потока одного размера, поэтому пришедшие куски
+    разбираются целиком через np.frombuffer, а неполная запись в конце
+    куска дожидается следующего.
+    """
+
+    def __init__(self, buffer: RatingBuffer):
+        self.buffer = buffer
+        self.pending = b""
+        self.header_parsed = False
+
+    async def __call__(self, chunk: bytes) -> None:
+        data = self.pending + chunk
+        if not self.header_parsed:
+            if len(data) < COPY_HEADER_SIZE:
+                self.pending = data
+                return
+            if not data.startswith(COPY_SIGNATURE):
+                raise ValueError("Unexpected COPY signature")
+            header_size = COPY_HEADER_SIZE + int.from_bytes(data[COPY_HEADER_SIZE - 4:COPY_HEADER_SIZE], "big")
+            if len(data) < header_size:
+                self.pending = data
+                return
+            data = data[header_size:]
+            self.header_parsed = True
+
+        count = len(data) // COPY_RECORD.itemsize
+        records = np.frombuffer(data, dtype=COPY_RECORD, count=count)
+        if count > 0 and not (
+                (records["fields"] == 3).all()
+                and (records["user_id_size"] == 4).all()
+                and (records["book_id_size"] == 4).all()
+                and (records["rating_size"] == 4).all()
+        ):
+            raise ValueError("Unexpected COPY record layout")
+        self.buffer.extend(records["user_id"], records["book_id"], records["rating"])
+        self.pending = data[count * COPY_RECORD.itemsize:]
+
+    def finish(self) -> None:
+        """Проверка, что поток закончился завершающей меткой."""
+        if self.pending != COPY_TRAILER:
+            raise ValueError("Incomplete COPY stream")
+
+
+async def load_rating_matrix(db: AsyncSession) -> RatingMatrix:
+    """
+    Загрузка всех оценок из базы данных в матрицу оценок способом из RATING_LOADER.
+    :param db: Сессия базы данных.
+    :return: Матрица оценок.
+    """
+    if settings.RATING_LOADER == "copy":
+        return await copy_rating_matrix(db)
+    return await stream_rating_matrix(db)
+
+
+async def copy_rating_matrix(db: AsyncSession) -> RatingMatrix:
+    """
+    Загрузка всех оценок бинарным COPY через соединение asyncpg.
+
+    Строки не декодируются по одной: байты потока разбираются numpy
+    прямо в предвыделенные массивы.
+    :param db: Сессия базы данных.
+    :return: Матрица оценок.
+    """
+    count = await db.scalar(select(func.count()).select_from(Rating))
+    parser = BinaryCopyParser(RatingBuffer(count))
+    connection = await (await db.connection()).get_raw_connection()
+    await connection.driver_connection.copy_from_query(
+        f"SELECT user_id, book_id, rating FROM {Rating.__tablename__}",
+        output=parser,
+        format="binary"
+    )
+    parser.finish()
+    return parser.buffer.to_matrix()
+
+
+async def stream_rating_matrix(db: AsyncSession) -> RatingMatrix:
+    """
+    Загрузка всех оценок серверным курсором.
+
+    Оценки читаются серверным курсором пачками по STREAM_BATCH строк,
+    так что объекты строк существуют только для одной пачки.
+    :param db: Сессия базы данных.
+    :return: Матрица оценок.
+    """
+    count = await db.scalar(select(func.count()).select_from(Rating))
+    buffer = RatingBuffer(count)
+    result = await db.stream(
+        select(
+            Rating.user_id,
+            Rating.book_id,
+            Rating.rating
+        ).execution_options(yield_per=STREAM_BATCH)
+    )
+    async for rows in result.partitions():
+        user_ids, book_ids, ratings = np.array(rows, dtype=np.int64).reshape(-1, 3).T
+        buffer.extend(user_ids, book_ids, ratings)
+    return buffer.to_matrix()
+
+
+async def load_user_ratings(db: AsyncSession, user_ids: list[int]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Оценки нескольких пользователей, выбираемые по индексу ix_rating_user_id.
+    :param db: Сессия базы данных.
+    :param user_ids: Идентификаторы пользователей.
+    :return: Идентификаторы пользователей, идентификаторы книг и оценки.
+    """
+    rows = await db.execute(
+        select(Rating.user_id, Rating.book_id, Rating.rating)
+        .where(Rating.user_id.in_(user_ids))
+    )
+    user_ids, book_ids, ratings = np.array(rows.all(), dtype=np.int64).reshape(-1, 3).T
+    return user_ids, book_ids, ratings
+
+
+async def load_rating_changes(
+        db: AsyncSession,
+        since: datetime
+) -> tuple[list[tuple[int, int]], list[tuple[int, int, int]]]:
+    """
+    Изменения оценок после отметки времени.
+
+    Удаленная и затем созданная заново оценка попадает в оба списка,
+    поэтому удаления следует применять раньше текущих оценок.
+    :param db: Сессия базы данных.
+    :param since: Отметка времени.
+    :return: Удаленные пары (пользователь, книга) и текущие тройки (пользователь, книга, оценка).
+    """
+    deletions = await db.execute(
+        select(RatingDeletion.user_id, RatingDeletion.book_id)
+        .where(RatingDeletion.deleted_at > since)
+        .order_by(RatingDeletion.id)
+    )
+    changes = await db.execute(
+        select(Rating.user_id, Rating.book_id, Rating.rating)
+        .where(Rating.updated_at > since)
+    )
+    return [tuple(row) for row in deletions.all()], [tuple(row) for row in changes.all()]
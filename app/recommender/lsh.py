@@ -0,0 +1,175 @@
+from pathlib import Path
+
+import numpy as np
+
+from .matrix import SparseRatings
+from .storage import save_arrays, open_arrays
+
+PROJECTION_CELLS = 1 << 22
+
+
+class UserLSH:
+    """
+    Приближенный индекс похожих пользователей на случайных проекциях (SimHash).
+
+    Строка оценок проецируется на tables × bits случайных гиперплоскостей,
+    знаки проекций каждой таблицы образуют ключ корзины. Пользователи с малым
+    углом между векторами оценок чаще попадают в одну корзину, поэтому
+    кандидатами в соседи считаются только пользователи из корзин запроса,
+    и косинусное сходство считается точно лишь для них.
+
+    Ключи всех таблиц хранятся одним отсортированным массивом (номер таблицы
+    в старших битах), корзина - это отрезок этого массива. Индекс строится
+    по индексам строк матрицы и верен, пока к ней только дописываются
+    пользователи и книги (PatchedRatingMatrix): новые книги в проекциях
+    не участвуют, новые пользователи не находятся как соседи до перестроения.
+    """
+
+    ARRAYS = ("planes", "keys", "members")
+
+    def __init__(self, planes: np.ndarray, keys: np.ndarray, members: np.ndarray):
+        self.planes = planes
+        self.keys = keys
+        self.members = members
+
+    @property
+    def tables(self) -> int:
+        return self.planes.shape[1]
+
+    @property
+    def bits(self) -> int:
+        return self.planes.shape[2]
+
+    @classmethod
+    def build(cls, matrix: SparseRatings, tables: int, bits: int, seed: int = 0) -> "UserLSH":
+        """
+        Построение индекса по всем пользователям матрицы.
+        :param matrix: Матрица оценок.
+        :param tables: Количество хеш-таблиц, больше - выше полнота и дольше поиск.
+        :param bits: Количество гиперплоскостей в таблице, больше - мельче корзины.
+        :param seed: Начальное значение генератора гиперплоскостей.
+        :return: Индекс.
+        """
+        rng = np.random.default_rng(seed)
+        planes = rng.standard_normal((matrix.n_books, tables, bits)).astype(np.float32)
+        index = cls(planes, np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int32))
+
+        codes = np.empty((matrix.n_users, tables), dtype=np.int64)
+        size = max(1, PROJECTION_CELLS // max(tables * bits, 1))
+        for start in range(0, matrix.n_users, size):
+            user_indices = np.arange(start, min(start + size, matrix.n_users))
+            codes[start:start + size] = index._codes(index._project(matrix, user_indices))
+
+        codes += np.arange(tables, dtype=np.int64) << bits
+        order = np.argsort(codes, axis=0, kind="stable")
+        index.keys = np.take_along_axis(codes, order, axis=0).T.ravel()
+        index.members = order.T.ravel().astype(np.int32)
+        return index
+
+    @classmethod
+    def open(cls, directory: str | Path) -> "UserLSH":
+        return cls(**open_arrays(directory, cls.ARRAYS))
+
+    def save(self, directory: str | Path) -> None:
+        save_arrays(directory, {name: getattr(self, name) for name in self.ARRAYS})
+
+    def neighbors(
+            self,
+            matrix: SparseRatings,
+            user_indices: np.ndarray,
+            top_n: int,
+            probes: int,
+            candidates: int
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Приближенный поиск наиболее похожих пользователей.
+        :param matrix: Матрица оценок, по которой построен индекс (возможно, с изменениями).
+        :param user_indices: Индексы строк пользователей запроса.
+        :param top_n: Количество соседей каждого пользователя.
+        :param probes: Количество дополнительно просматриваемых корзин в каждой таблице:
+            ключи с инвертированным битом, проекция на который ближе всего к нулю.
+            Больше - выше полнота и дольше поиск.
+        :param candidates: Количество кандидатов каждого пользователя с наибольшим числом
+            совпавших корзин, для которых сходство считается точно.
+        :return: Позиции пользователей в запросе, индексы строк соседей и сходства,
+            для каждого пользователя не более top_n пар в порядке убывания сходства.
+        """
+        n = len(user_indices)
+        projections = self._project(matrix, user_indices)
+        codes = self._codes(projections)
+        probes = min(probes, self.bits)
+        flips = np.argsort(np.abs(projections), axis=2)[..., :probes]
+        probe_codes = np.concatenate([codes[..., None], codes[..., None] ^ (1 << flips)], axis=2)
+        probe_codes += (np.arange(self.tables, dtype=np.int64) << self.bits)[None, :, None]
+
+        left = np.searchsorted(self.keys, probe_codes.ravel(), side="left")
+        lengths = np.searchsorted(self.keys, probe_codes.ravel(), side="right") - left
+        offsets = np.cumsum(lengths) - lengths
+        members = self.members[np.repeat(left - offsets, lengths) + np.arange(lengths.sum())]
+        rows = np.repeat(np.repeat(np.arange(n), self.tables * (probes + 1)), lengths)
+
+        pairs, collisions = np.unique(rows * np.int64(matrix.n_users) + members, return_counts=True)
+        rows, members = pairs // matrix.n_users, pairs % matrix.n_users
+        distinct = members != user_indices[rows]
+        rows, members, collisions = rows[distinct], members[distinct], collisions[distinct]
+        rows, members = self._first_in_rows(rows, members, -collisions, n, candidates)
+
+        books, ratings, row_lengths = matrix.gather_rows(user_indices)
+        queries = np.zeros((n, matrix.n_books), dtype=np.float32)
+        queries[np.repeat(np.arange(n), row_lengths), books] = ratings
+        member_books, member_values, member_lengths = matrix.gather_rows(members)
+        pair_of = np.repeat(np.arange(len(members)), member_lengths)
+        dot_products = np.bincount(
+            pair_of,
+            weights=queries[rows[pair_of], member_books] * member_values,
+            minlength=len(members)
+        )
+        denominators = matrix.norms[user_indices][rows] * matrix.norms[members]
+        similarities = np.divide(
+            dot_products,
+            denominators,
+            out=np.zeros(len(dot_products), dtype=np.float32),
+            where=denominators > 0
+        )
+        return self._first_in_rows(rows, members, -similarities, n, top_n, similarities)
+
+    @staticmethod
+    def _first_in_rows(
+            rows: np.ndarray,
+            members: np.ndarray,
+            keys: np.ndarray,
+            n: int,
+            limit: int,
+            *values: np.ndarray
+    ) -> tuple[np.ndarray, ...]:
+        """
+        Не более limit пар с наименьшими ключами для каждой позиции запроса.
+        :return: Отобранные rows, members и values, упорядоченные по позиции и ключу.
+        """
+        order = np.lexsort((keys, rows))
+        ranks = np.arange(len(order)) - np.searchsorted(rows[order], np.arange(n))[rows[order]]
+        keep = order[ranks < limit]
+        return (rows[keep], members[keep]) + tuple(value[keep] for value in values)
+
+    def _project(self, matrix: SparseRatings, user_indices: np.ndarray) -> np.ndarray:
+        """
+        Проекции строк пользователей на гиперплоскости.
+        :return: Массив n × tables × bits.
+        """
+        books, ratings, lengths = matrix.gather_rows(user_indices)
+        known = books < len(self.planes)
+        contributions = np.zeros((len(books), self.tables, self.bits), dtype=np.float32)
+        contributions[known] = ratings[known, None, None] * self.planes[books[known]]
+        projections = np.zeros((len(user_indices), self.tables, self.bits), dtype=np.float32)
+        starts = np.cumsum(lengths) - lengths
+        nonempty = lengths > 0
+        if nonempty.any():
+            projections[nonempty] = np.add.reduceat(contributions, starts[nonempty], axis=0)
+        return projections
+
+    def _codes(self, projections: np.ndarray) -> np.ndarray:
+        """
+        Ключи корзин по знакам проекций.
+        :return: Массив n × tables.
+        """
+        return (projections > 0).astype(np.int64) @ (np.int64(1) << np.arange(self.bits, dtype=np.int64))
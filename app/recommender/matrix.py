@@ -0,0 +1,517 @@
+import copy
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from .storage import save_arrays, open_arrays
+
+EMPTY_INDICES = np.empty(0, dtype=np.int32)
+EMPTY_RATINGS = np.empty(0, dtype=np.int8)
+
+
+def gather_slices(indptr: np.ndarray, selected: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Позиции элементов выбранных строк (столбцов) сжатого разреженного формата.
+    :param indptr: Массив указателей начала строк.
+    :param selected: Индексы выбранных строк.
+    :return: Позиции элементов во всех выбранных строках подряд и длины строк.
+    """
+    starts = indptr[selected]
+    lengths = indptr[selected + 1] - starts
+    offsets = np.cumsum(lengths) - lengths
+    positions = np.repeat(starts - offsets, lengths) + np.arange(lengths.sum())
+    return positions, lengths
+
+
+def lookup(sorted_ids: np.ndarray, ids: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Поиск позиций идентификаторов в отсортированном массиве.
+    :param sorted_ids: Отсортированный массив идентификаторов.
+    :param ids: Искомые идентификаторы.
+    :return: Позиции и маска найденных идентификаторов.
+    """
+    positions = np.searchsorted(sorted_ids, ids)
+    found = positions < len(sorted_ids)
+    found[found] = sorted_ids[positions[found]] == ids[found]
+    return positions, found
+
+
+def concat_slices(slices: list[tuple[np.ndarray, np.ndarray]]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Объединение нескольких разреженных строк (столбцов) в общие массивы.
+    :param slices: Пары (индексы, значения).
+    :return: Индексы и значения всех строк подряд и длины строк.
+    """
+    lengths = np.array([len(indices) for indices, _ in slices], dtype=np.int64)
+    if len(slices) == 0:
+        return EMPTY_INDICES, EMPTY_RATINGS, lengths
+    return (
+        np.concatenate([indices for indices, _ in slices]),
+        np.concatenate([values for _, values in slices]),
+        lengths
+    )
+
+
+def patch(
+        indices: np.ndarray,
+        values: np.ndarray,
+        key: int,
+        value: Optional[int]
+) -> tuple[np.ndarray, np.ndarray, Optional[int]]:
+    """
+    Копия отсортированной разреженной строки с измененным элементом.
+    :param indices: Отсортированные индексы строки.
+    :param values: Значения строки.
+    :param key: Индекс изменяемого элемента.
+    :param value: Новое значение или None для удаления элемента.
+    :return: Новые индексы и значения, а также предыдущее значение элемента.
+    """
+    position = int(np.searchsorted(indices, key))
+    old = int(values[position]) if position < len(indices) and indices[position] == key else None
+    if value is None:
+        if old is None:
+            return indices, values, old
+        return np.delete(indices, position), np.delete(values, position), old
+    if old is None:
+        return np.insert(indices, position, key), np.insert(values, position, value), old
+    values = values.copy()
+    values[position] = value
+    return indices, values, old
+
+
+def grow(array: np.ndarray, size: int) -> np.ndarray:
+    """
+    Увеличение емкости массива с запасом, чтобы добавление элементов в среднем стоило O(1).
+    :param array: Массив.
+    :param size: Требуемый размер.
+    :return: Исходный массив или его копия большего размера.
+    """
+    if size <= len(array):
+        return array
+    result = np.zeros(max(size, 2 * len(array)), dtype=array.dtype)
+    result[:len(array)] = array
+    return result
+
+
+def compress(
+        major: np.ndarray,
+        minor: np.ndarray,
+        values: np.ndarray,
+        size: int
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Сжатие тройек (строка, столбец, значение) в массивы CSR.
+    :param major: Индексы строк.
+    :param minor: Индексы столбцов.
+    :param values: Значения.
+    :param size: Количество строк.
+    :return: Указатели строк, индексы столбцов и значения.
+    """
+    order = np.lexsort((minor, major))
+    indptr = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(major, minlength=size), out=indptr[1:])
+    return indptr, minor[order].astype(np.int32), values[order].astype(np.int8)
+
+
+class SparseRatings(ABC):
+    """
+    Интерфейс разреженных оценок, общий для неизменяемой и изменяемой матриц.
+
+    Наследники предоставляют доступ к строкам и столбцам через row(),
+    gather_rows() и gather_columns(), а также нормы строк в norms.
+    Оценки хранятся в int8, индексы в int32, нормы и оценки книг в float32,
+    а суммы произведений накапливаются в float64 (np.bincount).
+    """
+
+    user_ids: np.ndarray
+    book_ids: np.ndarray
+    norms: np.ndarray
+
+    @property
+    @abstractmethod
+    def n_users(self) -> int:
+        ...
+
+    @property
+    @abstractmethod
+    def n_books(self) -> int:
+        ...
+
+    @abstractmethod
+    def user_index(self, user_id: int) -> Optional[int]:
+        ...
+
+    @abstractmethod
+    def row(self, user_idx: int) -> tuple[np.ndarray, np.ndarray]:
+        ...
+
+    @abstractmethod
+    def gather_rows(self, user_indices: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Элементы нескольких строк подряд.
+        :param user_indices: Индексы строк пользователей.
+        :return: Индексы книг, оценки и длины строк.
+        """
+
+    @abstractmethod
+    def gather_columns(self, book_indices: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Элементы нескольких столбцов подряд.
+        :param book_indices: Индексы столбцов книг.
+        :return: Индексы пользователей, оценки и длины столбцов.
+        """
+
+
+class RatingMatrix(SparseRatings):
+    """
+    Разреженная матрица оценок пользователь × книга.
+
+    Хранится одновременно по строкам (CSR) и по столбцам (CSC), поэтому
+    память пропорциональна количеству оценок, а не произведению количества
+    пользователей на количество книг.
+    """
+
+    ARRAYS = ("user_ids", "book_ids", "indptr", "indices", "data", "col_indptr", "col_indices", "col_data", "norms")
+
+    def __init__(
+            self,
+            user_ids: np.ndarray,
+            book_ids: np.ndarray,
+            indptr: np.ndarray,
+            indices: np.ndarray,
+            data: np.ndarray,
+            col_indptr: np.ndarray,
+            col_indices: np.ndarray,
+            col_data: np.ndarray,
+            norms: Optional[np.ndarray] = None
+    ):
+        self.user_ids = user_ids
+        self.book_ids = book_ids
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.col_indptr = col_indptr
+        self.col_indices = col_indices
+        self.col_data = col_data
+        if norms is None:
+            norms = np.sqrt(self.squared_norms()).astype(np.float32)
+        self.norms = norms
+
+    def squared_norms(self) -> np.ndarray:
+        """
+        Точные квадраты норм строк - суммы квадратов целых оценок.
+        :return: Массив int64 длины n_users.
+        """
+        return np.bincount(
+            np.repeat(np.arange(len(self.user_ids)), np.diff(self.indptr)),
+            weights=self.data.astype(np.float64) ** 2,
+            minlength=len(self.user_ids)
+        ).astype(np.int64)
+
+    @classmethod
+    def from_triples(
+            cls,
+            user_ids: np.ndarray,
+            book_ids: np.ndarray,
+            ratings: np.ndarray
+    ) -> "RatingMatrix":
+        """
+        Построение матрицы из тройек (пользователь, книга, оценка).
+        :param user_ids: Идентификаторы пользователей.
+        :param book_ids: Идентификаторы книг.
+        :param ratings: Оценки.
+        :return: Матрица оценок.
+        """
+        unique_users, rows = np.unique(user_ids, return_inverse=True)
+        unique_books, cols = np.unique(book_ids, return_inverse=True)
+        indptr, indices, data = compress(rows, cols, ratings, len(unique_users))
+        col_indptr, col_indices, col_data = compress(cols, rows, ratings, len(unique_books))
+        return cls(
+            unique_users.astype(np.int32),
+            unique_books.astype(np.int32),
+            indptr, indices, data,
+            col_indptr, col_indices, col_data
+        )
+
+    @classmethod
+    def open(cls, directory: str | Path) -> "RatingMatrix":
+        """
+        Открытие матрицы, сохраненной save(), с отображением массивов в память.
+        :param directory: Каталог матрицы.
+        :return: Матрица оценок только для чтения.
+        """
+        return cls(**open_arrays(directory, cls.ARRAYS))
+
+    def save(self, directory: str | Path) -> None:
+        """
+        Сохранение массивов матрицы в каталог.
+        :param directory: Каталог матрицы.
+        """
+        save_arrays(directory, {name: getattr(self, name) for name in self.ARRAYS})
+
+    @property
+    def n_users(self) -> int:
+        return len(self.user_ids)
+
+    @property
+    def n_books(self) -> int:
+        return len(self.book_ids)
+
+    @property
+    def nnz(self) -> int:
+        return len(self.data)
+
+    def user_index(self, user_id: int) -> Optional[int]:
+        """
+        Индекс строки пользователя.
+        :param user_id: Идентификатор пользователя.
+        :return: Индекс строки или None, если у пользователя нет оценок.
+        """
+        idx = int(np.searchsorted(self.user_ids, user_id))
+        if idx < self.n_users and self.user_ids[idx] == user_id:
+            return idx
+        return None
+
+    def book_index(self, book_id: int) -> Optional[int]:
+        """
+        Индекс столбца книги.
+        :param book_id: Идентификатор книги.
+        :return: Индекс столбца или None, если у книги нет оценок.
+        """
+        idx = int(np.searchsorted(self.book_ids, book_id))
+        if idx < self.n_books and self.book_ids[idx] == book_id:
+            return idx
+        return None
+
+    def row(self, user_idx: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Оценки пользователя.
+        :param user_idx: Индекс строки пользователя.
+        :return: Индексы книг и оценки.
+        """
+        start, end = self.indptr[user_idx], self.indptr[user_idx + 1]
+        return self.indices[start:end], self.data[start:end]
+
+    def column(self, book_idx: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Оценки книги.
+        :param book_idx: Индекс столбца книги.
+        :return: Индексы пользователей и оценки.
+        """
+        start, end = self.col_indptr[book_idx], self.col_indptr[book_idx + 1]
+        return self.col_indices[start:end], self.col_data[start:end]
+
+    def gather_rows(self, user_indices: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        positions, lengths = gather_slices(self.indptr, user_indices)
+        return self.indices[positions], self.data[positions], lengths
+
+    def gather_columns(self, book_indices: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        positions, lengths = gather_slices(self.col_indptr, book_indices)
+        return self.col_indices[positions], self.col_data[positions], lengths
+
+
+class PatchedRatingMatrix(SparseRatings):
+    """
+    Изменяемая матрица оценок поверх неизменяемой RatingMatrix.
+
+    Измененные строки пользователей и столбцы книг хранятся отдельно от
+    базовых массивов, а квадраты норм строк обновляются на месте, поэтому
+    изменение одной оценки стоит O(оценок пользователя + оценок книги).
+    Расчеты вне цикла событий читают неизменяемое представление frozen().
+    """
+
+    def __init__(self, base: RatingMatrix):
+        self.base = base
+        self.nnz = base.nnz
+        self._n_users = base.n_users
+        self._n_books = base.n_books
+        self._user_ids = base.user_ids.copy()
+        self._book_ids = base.book_ids.copy()
+        self._squared_norms = base.squared_norms()
+        self._norms = base.norms.astype(np.float32)
+        self.new_users: dict[int, int] = {}
+        self.new_books: dict[int, int] = {}
+        self.rows: dict[int, tuple[np.ndarray, np.ndarray]] = {}
+        self.columns: dict[int, tuple[np.ndarray, np.ndarray]] = {}
+        self._view: Optional[PatchedRatingMatrix] = None
+
+    @property
+    def n_users(self) -> int:
+        return self._n_users
+
+    @property
+    def n_books(self) -> int:
+        return self._n_books
+
+    @property
+    def user_ids(self) -> np.ndarray:
+        return self._user_ids[:self._n_users]
+
+    @property
+    def book_ids(self) -> np.ndarray:
+        return self._book_ids[:self._n_books]
+
+    @property
+    def norms(self) -> np.ndarray:
+        return self._norms[:self._n_users]
+
+    def user_index(self, user_id: int) -> Optional[int]:
+        idx = self.base.user_index(user_id)
+        return idx if idx is not None else self.new_users.get(user_id)
+
+    def book_index(self, book_id: int) -> Optional[int]:
+        idx = self.base.book_index(book_id)
+        return idx if idx is not None else self.new_books.get(book_id)
+
+    def row(self, user_idx: int) -> tuple[np.ndarray, np.ndarray]:
+        if user_idx in self.rows:
+            return self.rows[user_idx]
+        if user_idx < self.base.n_users:
+            return self.base.row(user_idx)
+        return EMPTY_INDICES, EMPTY_RATINGS
+
+    def column(self, book_idx: int) -> tuple[np.ndarray, np.ndarray]:
+        if book_idx in self.columns:
+            return self.columns[book_idx]
+        if book_idx < self.base.n_books:
+            return self.base.column(book_idx)
+        return EMPTY_INDICES, EMPTY_RATINGS
+
+    def gather_rows(self, user_indices: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        return concat_slices([self.row(user_idx) for user_idx in user_indices])
+
+    def gather_columns(self, book_indices: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        return concat_slices([self.column(book_idx) for book_idx in book_indices])
+
+    def frozen(self) -> "PatchedRatingMatrix":
+        """
+        Неизменяемое представление текущего состояния матрицы.
+
+        Представление разделяет с матрицей базу и массивы строк и столбцов,
+        которые изменения заменяют, а не меняют на месте, и получает копии
+        словарей изменений. Нормы матрица копирует перед первым изменением
+        после создания представления, поэтому последующие изменения ему
+        не видны. Пока матрица не меняется, возвращается одно и то же
+        представление. Изменять само представление нельзя.
+        :return: Представление.
+        """
+        if self._view is None:
+            view = copy.copy(self)
+            view.new_users = dict(self.new_users)
+            view.new_books = dict(self.new_books)
+            view.rows = dict(self.rows)
+            view.columns = dict(self.columns)
+            view._view = view
+            self._view = view
+        return self._view
+
+    def to_matrix(self) -> RatingMatrix:
+        """
+        Сжатие текущего состояния в неизменяемую матрицу.
+        :return: Матрица оценок.
+        """
+        n_users = self.n_users
+        books, values, lengths = self.gather_rows(np.arange(n_users))
+        return RatingMatrix.from_triples(
+            self._user_ids[np.repeat(np.arange(n_users), lengths)],
+            self._book_ids[books],
+            values
+        )
+
+    def rating(self, user_id: int, book_id: int) -> Optional[int]:
+        """
+        Текущая оценка.
+        :param user_id: Идентификатор пользователя.
+        :param book_id: Идентификатор книги.
+        :return: Оценка или None, если ее нет.
+        """
+        user_idx = self.user_index(user_id)
+        book_idx = self.book_index(book_id)
+        if user_idx is None or book_idx is None:
+            return None
+        books, values = self.row(user_idx)
+        position = int(np.searchsorted(books, book_idx))
+        return int(values[position]) if position < len(books) and books[position] == book_idx else None
+
+    def set_rating(self, user_id: int, book_id: int, rating: int) -> bool:
+        """
+        Добавление или изменение оценки.
+        :param user_id: Идентификатор пользователя.
+        :param book_id: Идентификатор книги.
+        :param rating: Оценка.
+        :return: Изменилась ли матрица.
+        """
+        if self.rating(user_id, book_id) == rating:
+            return False
+        user_idx = self.user_index(user_id)
+        if user_idx is None:
+            user_idx = self._add_user(user_id)
+        book_idx = self.book_index(book_id)
+        if book_idx is None:
+            book_idx = self._add_book(book_id)
+        self._patch(user_idx, book_idx, rating)
+        return True
+
+    def remove_rating(self, user_id: int, book_id: int) -> bool:
+        """
+        Удаление оценки.
+        :param user_id: Идентификатор пользователя.
+        :param book_id: Идентификатор книги.
+        :return: Изменилась ли матрица.
+        """
+        if self.rating(user_id, book_id) is None:
+            return False
+        self._patch(self.user_index(user_id), self.book_index(book_id), None)
+        return True
+
+    def remove_book(self, book_id: int) -> bool:
+        """
+        Удаление всех оценок книги.
+        :param book_id: Идентификатор книги.
+        :return: Изменилась ли матрица.
+        """
+        book_idx = self.book_index(book_id)
+        if book_idx is None:
+            return False
+        users, _ = self.column(book_idx)
+        for user_idx in users:
+            self._patch(int(user_idx), book_idx, None)
+        return len(users) > 0
+
+    def _detach(self) -> None:
+        """Отделение от представления frozen() перед изменением матрицы."""
+        if self._view is not None:
+            self._norms = self._norms.copy()
+            self._view = None
+
+    def _add_user(self, user_id: int) -> int:
+        self._detach()
+        user_idx = self._n_users
+        self._n_users += 1
+        self._user_ids = grow(self._user_ids, self._n_users)
+        self._squared_norms = grow(self._squared_norms, self._n_users)
+        self._norms = grow(self._norms, self._n_users)
+        self._user_ids[user_idx] = user_id
+        self.new_users[user_id] = user_idx
+        return user_idx
+
+    def _add_book(self, book_id: int) -> int:
+        self._detach()
+        book_idx = self._n_books
+        self._n_books += 1
+        self._book_ids = grow(self._book_ids, self._n_books)
+        self._book_ids[book_idx] = book_id
+        self.new_books[book_id] = book_idx
+        return book_idx
+
+    def _patch(self, user_idx: int, book_idx: int, rating: Optional[int]) -> None:
+        self._detach()
+        books, ratings, old = patch(*self.row(user_idx), book_idx, rating)
+        self.rows[user_idx] = (books, ratings)
+        users, values, _ = patch(*self.column(book_idx), user_idx, rating)
+        self.columns[book_idx] = (users, values)
+        self._squared_norms[user_idx] += int(rating or 0) ** 2 - int(old or 0) ** 2
+        self._norms[user_idx] = np.sqrt(self._squared_norms[user_idx])
+        self.nnz += (rating is not None) - (old is not None)
@@ -0,0 +1,881 @@
+import asyncio
+import multiprocessing
+import shutil
+import tempfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Annotated, Awaitable, Callable, Optional, Sequence, TypeVar
+
+import numpy as np
+from fastapi import Depends
+from sqlalchemy import select, delete, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.environment import settings, logger
+from app.models import RatingDeletion, UserNeighbor
+from .admission import AdmissionGate, Saturated
+from .als import ALSModel
+from .artifact import Artifact
+from .catalog import BookCatalog, BookFilter
+from .engines import ENGINES, Engine, EngineUnavailable, ModelView
+from .item_based import ItemNeighbors
+from .loader import load_rating_matrix, load_rating_changes, load_user_ratings
+from .lsh import UserLSH
+from .matrix import SparseRatings, RatingMatrix, PatchedRatingMatrix
+from .popularity import PopularityRanking
+from .ranking import RankedListCache
+from .similarity import recommend_from_neighbor_ratings, batch_size
+from .storage import link_tree
+
+T = TypeVar("T")
+
+
+class Snapshot:
+    """
+    Сохраненное на диск состояние модели для процессов пула.
+
+    Процессам передается только путь к каталогу, массивы они открывают
+    через numpy.memmap, поэтому модель не сериализуется при каждом вызове.
+    Каталог принадлежит воркеру: опубликованные версии артефакта не изменяются,
+    а их файлы попадают в снимок жесткими ссылками, см. link_snapshot().
+    item_neighbors и als_model - имена подкаталогов с окрестностями книг
+    и ALS-моделью воркера, процессы пула используют ровно их.
+    """
+
+    def __init__(self, directory: Path, item_neighbors: Optional[str] = None, als_model: Optional[str] = None):
+        self.directory = directory
+        self.item_neighbors = item_neighbors
+        self.als_model = als_model
+
+
+class Recommender:
+    """
+    Модель рекомендаций, живущая всё время работы воркера.
+
+    Матрица оценок строится из базы данных только при холодном старте,
+    после чего обслуживает запросы из памяти, а изменения оценок вносятся
+    в нее точечно.
+
+    Расчет рекомендаций не выполняется в цикле событий: он уходит в поток,
+    а если запущен пул процессов, то в пул. Поток читает снимок модели
+    (view()), поэтому изменения оценок и замена модели во время расчета
+    ему не мешают. Процессы открывают базовую
+    матрицу из снимка на диске и догоняют изменения по журналу.
+
+    Алгоритмы рекомендаций (engines) подключаются через интерфейс Engine
+    и выбираются по имени: RECOMMENDER_ENGINE или параметром запроса.
+    Дорогие расчеты в обработчиках запросов проходят через gate, а построения
+    модели и структур алгоритмов не дублируются одновременными запросами
+    (single_flight). Если задана session_factory, устаревшая модель обслуживает
+    запросы, пока новая строится в фоне.
+    """
+
+    def __init__(self):
+        self.matrix: Optional[PatchedRatingMatrix] = None
+        self.item_neighbors: Optional[ItemNeighbors] = None
+        self.user_lsh: Optional[UserLSH] = None
+        self.als_model: Optional[ALSModel] = None
+        self.als_path: Optional[Path] = None
+        self.als_loaded_at: Optional[float] = None
+        self.stale = True
+        self.invalidations = 0
+        self.session_factory: Optional[Callable[[], AsyncSession]] = None
+        self.pool: Optional[ProcessPoolExecutor] = None
+        self.snapshot: Optional[Snapshot] = None
+        self.retired_snapshot: Optional[Snapshot] = None
+        self.journal: list[tuple] = []
+        self.item_neighbors_version = 0
+        self.als_model_version = 0
+        self.high_water_mark: Optional[datetime] = None
+        self.popularity = PopularityRanking()
+        self.catalog = BookCatalog()
+        self.ranked_lists = RankedListCache(settings.RANKED_LIST_CACHE_SIZE, settings.RANKED_LIST_TTL)
+        self.version = 0
+        self.engines: dict[str, Engine] = {name: engine(self) for name, engine in ENGINES.items()}
+        self.computations: dict[tuple, asyncio.Task] = {}
+        self.degradations: Counter[str] = Counter()
+        self.gate = AdmissionGate(settings.RECOMMENDATIONS_CONCURRENCY, settings.RECOMMENDATIONS_QUEUE)
+
+    def start_pool(self, processes: int) -> None:
+        """
+        Запуск пула процессов для расчета рекомендаций.
+        :param processes: Количество процессов.
+        """
+        self.pool = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("spawn"))
+        if self.matrix is not None:
+            self.compact()
+
+    def close(self) -> None:
+        """Остановка пула процессов и удаление снимков."""
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+        for snapshot in (self.retired_snapshot, self.snapshot):
+            if snapshot is not None:
+                shutil.rmtree(snapshot.directory, ignore_errors=True)
+        self.snapshot = self.retired_snapshot = None
+
+    async def build(self, db: AsyncSession) -> None:
+        """
+        Построение модели по всем оценкам из базы данных.
+        :param db: Сессия базы данных.
+        """
+        high_water_mark = await self._changes_mark(db)
+        base = await load_rating_matrix(db)
+        snapshot = await asyncio.to_thread(self.write_snapshot, base) if self.pool is not None else None
+        self.reset(base, snapshot, await asyncio.to_thread(self.index_users, base))
+        self.high_water_mark = high_water_mark
+        self.stale = False
+        logger.info("Recommender built: %d users, %d books, %d ratings",
+                    self.matrix.n_users, self.matrix.n_books, self.matrix.nnz)
+
+    def open_artifact(self, artifact: Artifact) -> None:
+        """
+        Открытие модели из версии артефакта без обращения к базе данных.
+        :param artifact: Версия модели на диске.
+        """
+        self.item_neighbors = artifact.open_item_neighbors()
+        if artifact.manifest["als"]:
+            self.als_model, self.als_path = artifact.open_als_model(), artifact.directory / "als"
+            self.als_loaded_at = artifact.manifest["created_at"]
+        snapshot = self.link_snapshot(artifact) if self.pool is not None else None
+        base = artifact.open_matrix()
+        self.reset(base, snapshot, self.index_users(base))
+        self.high_water_mark = artifact.high_water_mark
+        self.stale = False
+        logger.info("Recommender opened from artifact %s: %d users, %d books, %d ratings",
+                    artifact.version, self.matrix.n_users, self.matrix.n_books, self.matrix.nnz)
+
+    def publish_artifact(
+            self,
+            view: Optional[ModelView] = None,
+            high_water_mark: Optional[datetime] = None
+    ) -> Artifact:
+        """
+        Сохранение состояния модели новой версией артефакта.
+        Вне цикла событий - по снимку и отметке, снятым в нем, см. _publish_in_thread().
+        :param view: Снимок модели, по умолчанию текущий.
+        :param high_water_mark: Отметка изменений, которые учтены в снимке, по умолчанию текущая.
+        :return: Версия модели на диске.
+        """
+        view = view or self.view()
+        artifact = Artifact.publish(
+            settings.RECOMMENDER_ARTIFACT_DIR,
+            view.matrix.to_matrix(),
+            high_water_mark or self.high_water_mark,
+            view.item_neighbors,
+            view.als_model
+        )
+        logger.info("Recommender artifact %s published", artifact.version)
+        return artifact
+
+    async def _publish_in_thread(self) -> Artifact:
+        """
+        Публикация версии артефакта без блокировки цикла событий: снимок модели
+        и отметка изменений снимаются вместе, поэтому замена модели во время
+        записи не сочетает старую матрицу с новой отметкой.
+        :return: Версия модели на диске.
+        """
+        return await asyncio.to_thread(self.publish_artifact, self.view(), self.high_water_mark)
+
+    async def start(self, db: AsyncSession) -> None:
+        """
+        Запуск модели воркера: открытие свежей версии артефакта и применение
+        изменений оценок после нее, а если версии нет - построение по базе
+        данных и публикация для остальных воркеров.
+        :param db: Сессия базы данных.
+        """
+        artifact = Artifact.current(settings.RECOMMENDER_ARTIFACT_DIR)
+        if artifact is not None and artifact.age < settings.RECOMMENDER_ARTIFACT_TTL:
+            self.open_artifact(artifact)
+            await self.catch_up(db)
+            return
+        await self.build(db)
+        await self._publish_in_thread()
+
+    async def catch_up(self, db: AsyncSession) -> None:
+        """
+        Применение изменений оценок после high_water_mark, в том числе
+        сделанных другими воркерами. Уже учтенные изменения пропускаются.
+
+        Если изменений больше RECOMMENDER_CATCH_UP_LIMIT, модель помечается
+        устаревшей: перестроение по базе данных дешевле поштучного применения.
+        Устаревшая модель не догоняется, ее заменит перестроение.
+        :param db: Сессия базы данных.
+        """
+        if self.stale:
+            return
+        high_water_mark = await self._changes_mark(db)
+        deletions, changes = await load_rating_changes(db, self.high_water_mark)
+        deletions = [(user_id, book_id) for user_id, book_id in deletions
+                     if self.matrix.rating(user_id, book_id) is not None]
+        changes = [(user_id, book_id, rating) for user_id, book_id, rating in changes
+                   if self.matrix.rating(user_id, book_id) != rating]
+        if len(deletions) + len(changes) > settings.RECOMMENDER_CATCH_UP_LIMIT:
+            logger.info("Recommender is too far behind: %d deleted, %d changed ratings, rebuilding",
+                        len(deletions), len(changes))
+            self.invalidate()
+            return
+        for user_id, book_id in deletions:
+            self.remove_rating(user_id, book_id)
+        for user_id, book_id, rating in changes:
+            self.set_rating(user_id, book_id, rating)
+        self.high_water_mark = high_water_mark
+        if deletions or changes:
+            logger.info("Recommender caught up: %d deleted, %d changed ratings", len(deletions), len(changes))
+
+    @staticmethod
+    async def _changes_mark(db: AsyncSession) -> datetime:
+        """
+        Отметка, после которой следует искать изменения при следующей синхронизации.
+
+        Время изменения - начало транзакции, которая могла зафиксироваться позже
+        чтения, поэтому отметка сдвигается назад на RATING_CHANGES_OVERLAP секунд:
+        повторное применение изменения ничего не меняет.
+        :param db: Сессия базы данных.
+        :return: Отметка времени.
+        """
+        return await db.scalar(select(func.now())) - timedelta(seconds=settings.RATING_CHANGES_OVERLAP)
+
+    async def sync_periodically(self, session_factory: Callable[[], AsyncSession]) -> None:
+        """
+        Фоновая синхронизация с базой данных: применение изменений оценок
+        или перестроение устаревшей модели, загрузка переобученной ALS-модели,
+        публикация новой версии артефакта, если действующая старше
+        RECOMMENDER_ARTIFACT_INTERVAL, и очистка старых записей об удалениях.
+        :param session_factory: Фабрика сессий базы данных.
+        """
+        while True:
+            await asyncio.sleep(settings.RECOMMENDER_SYNC_INTERVAL)
+            try:
+                async with session_factory() as db:
+                    await self.catch_up(db)
+                    await self.refresh(db)
+                    await db.execute(
+                        delete(RatingDeletion)
+                        .where(RatingDeletion.deleted_at < func.now() - timedelta(
+                            seconds=2 * settings.RECOMMENDER_ARTIFACT_TTL
+                        ))
+                    )
+                    await db.commit()
+                self.reload_als_model()
+                artifact = Artifact.current(settings.RECOMMENDER_ARTIFACT_DIR)
+                if artifact is None or artifact.age > settings.RECOMMENDER_ARTIFACT_INTERVAL:
+                    await self._publish_in_thread()
+            except Exception:
+                logger.exception("Recommender sync failed")
+
+    def reset(
+            self,
+            base: RatingMatrix,
+            snapshot: Optional[Snapshot] = None,
+            user_lsh: Optional[UserLSH] = None
+    ) -> None:
+        """
+        Замена матрицы оценок, при запущенном пуле вместе со снимком.
+
+        Предыдущий снимок удаляется только при следующей замене, чтобы
+        уже отправленные в пул вызовы успели его открыть.
+        :param base: Новая базовая матрица.
+        :param snapshot: Снимок base, если уже сохранен.
+        :param user_lsh: Индекс похожих пользователей по base, см. index_users().
+        """
+        self.matrix = PatchedRatingMatrix(base)
+        self.user_lsh = user_lsh
+        self.journal = []
+        self.version += 1
+        if self.pool is None:
+            return
+        snapshot = snapshot or self.write_snapshot(base)
+        if self.retired_snapshot is not None:
+            shutil.rmtree(self.retired_snapshot.directory, ignore_errors=True)
+        self.retired_snapshot, self.snapshot = self.snapshot, snapshot
+
+    def write_snapshot(self, base: RatingMatrix) -> Snapshot:
+        """
+        Сохранение базовой матрицы и окрестностей книг в новый каталог.
+        :param base: Базовая матрица.
+        :return: Снимок.
+        """
+        snapshot = Snapshot(Path(tempfile.mkdtemp(prefix="recommender-")))
+        base.save(snapshot.directory / "matrix")
+        if self.item_neighbors is not None:
+            snapshot.item_neighbors = self._write_item_neighbors(snapshot.directory)
+        if self.als_model is not None:
+            snapshot.als_model = self._write_als_model(snapshot.directory)
+        return snapshot
+
+    def link_snapshot(self, artifact: Artifact) -> Snapshot:
+        """
+        Снимок версии артефакта в собственном каталоге воркера.
+
+        Файлы версии связываются жесткими ссылками, поэтому снимок не занимает
+        места на диске, остается доступен процессам пула после удаления версии
+        при публикации новых, а окрестности книг, пересчитанные воркером,
+        пишутся в снимок, не изменяя опубликованную версию. Каталог скрыт
+        в корне артефактов (имя с точкой), поэтому публикация его не удаляет.
+        :param artifact: Версия модели на диске.
+        :return: Снимок.
+        """
+        snapshot = Snapshot(Path(tempfile.mkdtemp(prefix=".snapshot-", dir=artifact.directory.parent)))
+        link_tree(artifact.directory / "matrix", snapshot.directory / "matrix")
+        if artifact.manifest["item_neighbors"]:
+            link_tree(artifact.directory / "item_neighbors", snapshot.directory / "item_neighbors")
+            snapshot.item_neighbors = "item_neighbors"
+        if self.als_model is not None:
+            snapshot.als_model = self._write_als_model(snapshot.directory)
+        return snapshot
+
+    def save_item_neighbors(self) -> None:
+        """Сохранение текущих окрестностей книг в действующий снимок."""
+        name = self._write_item_neighbors(self.snapshot.directory)
+        self.snapshot = Snapshot(self.snapshot.directory, name, self.snapshot.als_model)
+
+    def _write_als_model(self, directory: Path) -> str:
+        """
+        Сохранение ALS-модели в каталог снимка под новым именем: жесткими ссылками
+        на файлы, из которых она открыта, или записью массивов, если их нет на диске.
+        :param directory: Каталог снимка.
+        :return: Имя подкаталога.
+        """
+        als_model, als_path = self.als_model, self.als_path
+        self.als_model_version += 1
+        name = f"als_{self.als_model_version}"
+        if als_path is not None:
+            link_tree(als_path, directory / name)
+        else:
+            als_model.save(directory / name)
+        if self.als_model is als_model:
+            self.als_path = directory / name
+        return name
+
+    def _write_item_neighbors(self, directory: Path) -> str:
+        """
+        Сохранение окрестностей книг под новым именем, чтобы процессы пула их переоткрыли.
+        :param directory: Каталог снимка.
+        :return: Имя подкаталога.
+        """
+        self.item_neighbors_version += 1
+        name = f"item_neighbors_{self.item_neighbors_version}"
+        self.item_neighbors.save(directory / name)
+        return name
+
+    @staticmethod
+    def index_users(matrix: SparseRatings) -> Optional[UserLSH]:
+        """
+        Построение индекса похожих пользователей, если USER_NEIGHBORS_INDEX=lsh.
+
+        Индекс строится вместе с каждой новой базовой матрицей, до ее замены,
+        поэтому запросы не ждут его построения.
+        :param matrix: Матрица оценок.
+        :return: Индекс или None, если соседи ищутся точно.
+        """
+        if settings.USER_NEIGHBORS_INDEX != "lsh":
+            return None
+        return UserLSH.build(matrix, settings.LSH_TABLES, settings.LSH_BITS)
+
+    def compact(self) -> None:
+        """Сжатие накопленных изменений в новую базовую матрицу и очистка журнала."""
+        base = self.matrix.to_matrix()
+        self.reset(base, user_lsh=self.index_users(base))
+
+    def replay(self, journal: Sequence[tuple]) -> None:
+        """
+        Применение записей журнала изменений к матрице.
+        :param journal: Записи вида (имя метода, аргументы...).
+        """
+        for name, *args in journal:
+            self._apply(name, *args)
+        self.journal.extend(journal)
+
+    def invalidate(self) -> None:
+        """Пометка модели устаревшей, следующий запрос перестроит ее из базы данных."""
+        self.stale = True
+        self.invalidations += 1
+
+    async def refresh(self, db: AsyncSession) -> None:
+        """
+        Перестроение устаревшей модели, не более одного одновременно на воркер.
+
+        Одновременные запросы ожидают одно и то же построение. Если модель уже
+        построена и задана session_factory, построение идет в фоне, а запросы
+        без ожидания обслуживаются прежней моделью (stale-while-revalidate).
+        :param db: Сессия базы данных, используется без session_factory.
+        """
+        if not self.stale:
+            return
+        rebuild = self.single_flight(("build",), lambda: self._rebuild(None if self.session_factory else db))
+        if self.matrix is None or self.session_factory is None:
+            await asyncio.shield(rebuild)
+
+    async def _rebuild(self, db: Optional[AsyncSession] = None) -> None:
+        """
+        Построение модели, после которого она остается устаревшей,
+        если ее пометили устаревшей еще раз во время построения.
+        :param db: Сессия базы данных, без нее открывается своя из session_factory.
+        """
+        invalidations = self.invalidations
+        if db is None:
+            async with self.session_factory() as db:
+                await self.build(db)
+        else:
+            await self.build(db)
+        if self.invalidations != invalidations:
+            self.stale = True
+
+    def set_rating(self, user_id: int, book_id: int, rating: int) -> None:
+        """
+        Учет новой или измененной оценки.
+        :param user_id: Идентификатор пользователя.
+        :param book_id: Идентификатор книги.
+        :param rating: Оценка.
+        """
+        self._record("set_rating", user_id, book_id, rating)
+
+    def remove_rating(self, user_id: int, book_id: int) -> None:
+        """
+        Учет удаленной оценки.
+        :param user_id: Идентификатор пользователя.
+        :param book_id: Идентификатор книги.
+        """
+        self._record("remove_rating", user_id, book_id)
+
+    def remove_book(self, book_id: int) -> None:
+        """
+        Учет удаленной книги вместе с ее оценками.
+        :param book_id: Идентификатор книги.
+        """
+        self._record("remove_book", book_id)
+        self.invalidate_books()
+
+    def invalidate_books(self) -> None:
+        """Сброс кэшей после создания или изменения книги."""
+        self.catalog.invalidate()
+        self.invalidate_popularity()
+
+    def invalidate_popularity(self) -> None:
+        """Сброс ранжирования по популярности и новая версия модели для кэша списков."""
+        self.popularity.invalidate()
+        self.version += 1
+
+    def _record(self, name: str, *args) -> None:
+        """
+        Применение изменения к матрице и, при запущенном пуле, запись его в журнал.
+
+        Изменение, которое матрица уже содержит (например, повторно примененное
+        при синхронизации), не меняет версию модели и не сбрасывает кэши.
+        :param name: Имя метода PatchedRatingMatrix.
+        :param args: Аргументы метода.
+        """
+        if self.matrix is None:
+            self.invalidate_popularity()
+            return
+        if not self._apply(name, *args):
+            return
+        self.invalidate_popularity()
+        if self.pool is not None:
+            self.journal.append((name, *args))
+
+    def _apply(self, name: str, *args) -> bool:
+        """
+        Применение изменения к матрице и уведомление алгоритмов рекомендаций.
+        :param name: Имя метода PatchedRatingMatrix.
+        :param args: Аргументы метода.
+        :return: Изменилась ли матрица.
+        """
+        if not getattr(self.matrix, name)(*args):
+            return False
+        for engine in self.engines.values():
+            engine.update(name, *args)
+        return True
+
+    async def refresh_item_neighbors(self) -> None:
+        """Пересчет окрестностей похожих книг по текущим оценкам в отдельном потоке."""
+        await self.build_engine("item")
+
+    async def build_engine(self, name: str) -> None:
+        """
+        Построение структур алгоритма в отдельном потоке, не более одного
+        одновременно для каждого алгоритма. Построенные структуры переносятся
+        в модель уже в цикле событий.
+        :param name: Алгоритм рекомендаций.
+        """
+        await asyncio.shield(self.single_flight(("engine", name), lambda: self._build_engine(self.engines[name])))
+
+    async def _build_engine(self, engine: Engine) -> None:
+        """Построение структур по снимку модели в потоке и перенос их в модель."""
+        view = self.view()
+        await asyncio.to_thread(engine.build, view)
+        engine.install(view)
+
+    def view(self) -> ModelView:
+        """
+        Снимок модели для расчета вне цикла событий.
+        :return: Неизменяемая матрица вместе с текущими структурами алгоритмов.
+        """
+        return ModelView(self.matrix.frozen(), self.user_lsh, self.item_neighbors, self.als_model)
+
+    async def similar_books(self, db: AsyncSession, book_id: int, k: int) -> list[int]:
+        """
+        Похожие книги из окрестностей книг, при необходимости с их расчетом.
+        Перед ожиданием слота сессия возвращает соединение в пул.
+        :param db: Сессия базы данных.
+        :param book_id: Идентификатор книги.
+        :param k: Максимальное количество книг, не больше ITEM_NEIGHBORS.
+        :return: Идентификаторы книг в порядке убывания сходства.
+        """
+        if self.stale or self.item_neighbors is None:
+            await db.commit()
+            async with self.gate.slot():
+                await self.prepare(db, "item")
+        return self.item_neighbors.similar(book_id, k)
+
+    async def refresh_item_neighbors_periodically(self) -> None:
+        """Фоновое обновление окрестностей похожих книг."""
+        if self.item_neighbors is not None:
+            await asyncio.sleep(settings.ITEM_NEIGHBORS_REFRESH_INTERVAL)
+        while True:
+            if self.matrix is not None:
+                await self.refresh_item_neighbors()
+            await asyncio.sleep(settings.ITEM_NEIGHBORS_REFRESH_INTERVAL)
+
+    def single_flight(self, key: tuple, compute: Callable[[], Awaitable[T]]) -> "asyncio.Task[T]":
+        """
+        Общая задача расчета: пока расчет с ключом key идет, новый не запускается,
+        а возвращается та же задача. Ожидать ее следует через asyncio.shield,
+        чтобы отмена одного ожидающего не отменяла расчет для остальных.
+        :param key: Ключ расчета.
+        :param compute: Расчет, запускаемый, если такого еще нет.
+        :return: Задача расчета.
+        """
+        task = self.computations.get(key)
+        if task is None:
+            task = asyncio.create_task(compute())
+            self.computations[key] = task
+            task.add_done_callback(lambda done: self._computation_done(key, done))
+        return task
+
+    async def within_budget(self, key: tuple, compute: Callable[[], Awaitable[T]], budget: float) -> Optional[T]:
+        """
+        Ожидание расчета не дольше budget секунд.
+
+        Расчет выполняется общей задачей (single_flight), которая по истечении
+        бюджета не отменяется, а доводится до конца в фоне и прогревает кэши.
+        :param key: Ключ расчета.
+        :param compute: Расчет, он не должен использовать сессию запроса.
+        :param budget: Бюджет в секундах.
+        :return: Результат или None, если бюджет исчерпан.
+        """
+        try:
+            return await asyncio.wait_for(asyncio.shield(self.single_flight(key, compute)), budget)
+        except asyncio.TimeoutError:
+            return None
+
+    def _computation_done(self, key: tuple, task: asyncio.Task) -> None:
+        if self.computations.get(key) is task:
+            del self.computations[key]
+        if not task.cancelled() and task.exception() is not None and not isinstance(
+                task.exception(), (Saturated, EngineUnavailable)
+        ):
+            logger.error("Background computation %s failed", key, exc_info=task.exception())
+
+    def degrade(self, reason: str) -> None:
+        """
+        Учет ответа, отданного без расчета из-за исчерпанного бюджета.
+        :param reason: Источник ответа.
+        """
+        self.degradations[reason] += 1
+        logger.warning("Recommendations degraded to %s (%d so far)", reason, self.degradations[reason])
+
+    @staticmethod
+    def als_model_modified_at() -> Optional[float]:
+        """
+        Время последней записи ALS-модели в ALS_MODEL_PATH.
+        :return: Время в секундах эпохи или None, если модели нет.
+        """
+        try:
+            return max((Path(settings.ALS_MODEL_PATH) / f"{name}.npy").stat().st_mtime for name in ALSModel.ARRAYS)
+        except FileNotFoundError:
+            return None
+
+    def reload_als_model(self) -> bool:
+        """
+        Загрузка ALS-модели, переобученной после того, как воркер получил текущую
+        (из ALS_MODEL_PATH или из версии артефакта). Кэши рекомендаций сбрасываются.
+        :return: Загружена ли новая модель.
+        """
+        modified_at = self.als_model_modified_at()
+        if modified_at is None or (self.als_loaded_at is not None and modified_at <= self.als_loaded_at):
+            return False
+        self.load_als_model()
+        self.version += 1
+        return True
+
+    def load_als_model(self) -> None:
+        """Загрузка обученной ALS-модели из ALS_MODEL_PATH, при запущенном пуле - и в действующий снимок."""
+        modified_at = self.als_model_modified_at()
+        try:
+            self.als_model = ALSModel.open(settings.ALS_MODEL_PATH)
+        except FileNotFoundError:
+            logger.warning("ALS model not found at %s, engine als is unavailable", settings.ALS_MODEL_PATH)
+            return
+        self.als_path = Path(settings.ALS_MODEL_PATH)
+        self.als_loaded_at = modified_at
+        if self.snapshot is not None:
+            name = self._write_als_model(self.snapshot.directory)
+            self.snapshot = Snapshot(self.snapshot.directory, self.snapshot.item_neighbors, name)
+        logger.info("ALS model loaded: %d users, %d books, %d factors",
+                    len(self.als_model.user_ids), len(self.als_model.book_ids),
+                    self.als_model.book_factors.shape[1])
+
+    async def recommend(
+            self,
+            db: AsyncSession,
+            user_id: int,
+            k: int,
+            book_filter: Optional[BookFilter] = None,
+            engine: Optional[str] = None
+    ) -> list[int]:
+        """
+        Рекомендации для пользователя, при необходимости с перестроением модели.
+        :param db: Сессия базы данных.
+        :param user_id: Идентификатор пользователя.
+        :param k: Максимальное количество рекомендаций.
+        :param book_filter: Фильтр книг, применяемый до отбора лучших.
+        :param engine: Алгоритм рекомендаций, по умолчанию RECOMMENDER_ENGINE.
+        :return: Идентификаторы книг в порядке убывания оценки.
+        """
+        engine = engine or settings.RECOMMENDER_ENGINE
+        if engine == "neighbors":
+            stored = await UserNeighbor.get_fresh(db, user_id, timedelta(seconds=settings.USER_NEIGHBORS_TTL))
+            if stored is not None:
+                return await self.recommend_from_stored_neighbors(db, stored, k, book_filter)
+        await self.prepare(db, engine)
+        return (await self.recommend_many([user_id], k, book_filter, engine))[0]
+
+    @staticmethod
+    async def recommend_from_stored_neighbors(
+            db: AsyncSession,
+            stored: UserNeighbor,
+            k: int,
+            book_filter: Optional[BookFilter] = None
+    ) -> list[int]:
+        """
+        Рекомендации по сохраненным похожим пользователям.
+
+        Из базы данных читаются только оценки пользователя и его соседей,
+        матрица оценок всех пользователей не нужна.
+        :param db: Сессия базы данных.
+        :param stored: Похожие пользователи.
+        :param k: Максимальное количество рекомендаций.
+        :param book_filter: Фильтр книг.
+        :return: Идентификаторы книг в порядке убывания оценки.
+        """
+        user_ids, book_ids, ratings = await load_user_ratings(db, [stored.user_id, *stored.neighbor_ids])
+        if book_filter is not None:
+            allowed = book_filter.allowed(book_ids)
+            user_ids, book_ids, ratings = user_ids[allowed], book_ids[allowed], ratings[allowed]
+        return recommend_from_neighbor_ratings(
+            stored.user_id,
+            np.array(stored.neighbor_ids, dtype=np.int64),
+            np.array(stored.similarities, dtype=np.float64),
+            user_ids, book_ids, ratings, k
+        )
+
+    async def prepare(self, db: AsyncSession, engine: Optional[str] = None) -> None:
+        """
+        Перестроение устаревшей модели и построение недостающих структур алгоритма, см. refresh().
+        :param db: Сессия базы данных.
+        :param engine: Алгоритм рекомендаций, по умолчанию RECOMMENDER_ENGINE.
+        :raises EngineUnavailable: Если у алгоритма нет модели.
+        """
+        await self.refresh(db)
+        engine = engine or settings.RECOMMENDER_ENGINE
+        view = self.view()
+        if not self.engines[engine].available(view):
+            raise EngineUnavailable(engine)
+        if not self.engines[engine].ready(view):
+            await self.build_engine(engine)
+
+    async def recommend_many(
+            self,
+            user_ids: Sequence[int],
+            k: int,
+            book_filter: Optional[BookFilter] = None,
+            engine: Optional[str] = None
+    ) -> list[list[int]]:
+        """
+        Рекомендации для многих пользователей без блокировки цикла событий:
+        в отдельном потоке или в пуле процессов. Модель должна быть подготовлена.
+        :param user_ids: Идентификаторы пользователей.
+        :param k: Максимальное количество рекомендаций.
+        :param book_filter: Фильтр книг.
+        :param engine: Алгоритм рекомендаций, по умолчанию RECOMMENDER_ENGINE.
+        :return: Идентификаторы книг для каждого пользователя.
+        """
+        engine = engine or settings.RECOMMENDER_ENGINE
+        if self.pool is None:
+            view = self.view()
+            allowed = self.allowed_books(engine, book_filter, view)
+            return await asyncio.to_thread(self.recommend_batch, user_ids, k, engine, allowed, view)
+
+        if len(self.journal) > settings.RECOMMENDER_JOURNAL_LIMIT:
+            await asyncio.shield(self.single_flight(("compact",), self._compact_in_thread))
+        allowed = self.allowed_books(engine, book_filter)
+        return await asyncio.get_running_loop().run_in_executor(
+            self.pool, recommend_in_process, self.snapshot, tuple(self.journal), engine, list(user_ids), k, allowed
+        )
+
+    def allowed_books(
+            self,
+            engine: str,
+            book_filter: Optional[BookFilter],
+            view: Optional[ModelView] = None
+    ) -> Optional[np.ndarray]:
+        """
+        Маска фильтра над индексом книг алгоритма рекомендаций.
+        :param engine: Алгоритм рекомендаций.
+        :param book_filter: Фильтр книг.
+        :param view: Снимок модели, по которому будет идти расчет, по умолчанию текущий.
+        :return: Булев массив или None, если фильтра нет.
+        """
+        if book_filter is None:
+            return None
+        space, book_ids, owner = self.engines[engine].book_index(view or self.view())
+        return book_filter.allowed(book_ids, space, owner)
+
+    async def _compact_in_thread(self) -> None:
+        """
+        Сжатие журнала без блокировки цикла событий.
+        Изменения, пришедшие во время сжатия, переносятся в новый журнал:
+        повторное применение изменения идемпотентно, даже если оно уже попало в снимок.
+        """
+        applied = len(self.journal)
+        base = await asyncio.to_thread(self.matrix.frozen().to_matrix)
+        snapshot = await asyncio.to_thread(self.write_snapshot, base)
+        user_lsh = await asyncio.to_thread(self.index_users, base)
+        pending = self.journal[applied:]
+        self.reset(base, snapshot, user_lsh)
+        self.replay(pending)
+
+    def recommend_batch(
+            self,
+            user_ids: Sequence[int],
+            k: int,
+            engine: Optional[str] = None,
+            allowed: Optional[np.ndarray] = None,
+            view: Optional[ModelView] = None
+    ) -> list[list[int]]:
+        """
+        Рекомендации для многих пользователей пачками матричных операций.
+        Модель должна быть построена.
+        :param user_ids: Идентификаторы пользователей.
+        :param k: Максимальное количество рекомендаций.
+        :param engine: Алгоритм рекомендаций, по умолчанию RECOMMENDER_ENGINE.
+        :param allowed: Маска книг, которые можно рекомендовать, над индексом книг алгоритма.
+        :param view: Снимок модели, по умолчанию текущий. Вне цикла событий - снятый в нем.
+        :return: Идентификаторы книг в порядке убывания оценки для каждого пользователя,
+            пустой список для неизвестных модели пользователей.
+        """
+        engine = engine or settings.RECOMMENDER_ENGINE
+        view = view or self.view()
+        matrix = view.matrix
+        result = [[] for _ in user_ids]
+        known = [
+            (position, user_idx)
+            for position, user_id in enumerate(user_ids)
+            if (user_idx := matrix.user_index(user_id)) is not None
+        ]
+        size = batch_size(matrix)
+        for start in range(0, len(known), size):
+            chunk = known[start:start + size]
+            user_indices = np.array([user_idx for _, user_idx in chunk], dtype=np.int64)
+            rows = self._recommend_rows(view, user_indices, k, engine, allowed)
+            for (position, _), book_ids in zip(chunk, rows):
+                result[position] = book_ids
+        return result
+
+    def _recommend_rows(
+            self,
+            view: ModelView,
+            user_indices: np.ndarray,
+            k: int,
+            engine: str,
+            allowed: Optional[np.ndarray] = None
+    ) -> list[list[int]]:
+        """
+        Рекомендации для пачки строк матрицы.
+        :param view: Снимок модели.
+        :param user_indices: Индексы строк пользователей.
+        :param k: Максимальное количество рекомендаций.
+        :param engine: Алгоритм рекомендаций.
+        :param allowed: Маска книг над индексом книг алгоритма.
+        :return: Идентификаторы книг для каждой строки.
+        """
+        if not self.engines[engine].available(view):
+            raise EngineUnavailable(engine)
+        engine = self.engines[engine]
+        if not engine.ready(view):
+            engine.build(view)
+        return engine.top_k(view, user_indices, k, allowed)
+
+
+_process_recommender: Optional[Recommender] = None
+
+
+def recommend_in_process(
+        snapshot: Snapshot,
+        journal: tuple[tuple, ...],
+        engine: str,
+        user_ids: Sequence[int],
+        k: int,
+        allowed: Optional[np.ndarray] = None
+) -> list[list[int]]:
+    """
+    Расчет рекомендаций в процессе пула.
+
+    Модель процесса открывается из снимка один раз и переоткрывается только
+    при смене снимка, а между вызовами к ней применяются новые записи журнала.
+    Окрестности книг и ALS-модель берутся из снимка, как только он на них
+    указывает, поэтому процесс считает теми же структурами, что и воркер.
+    :param snapshot: Снимок модели.
+    :param journal: Журнал изменений с момента создания снимка.
+    :param engine: Алгоритм рекомендаций.
+    :param user_ids: Идентификаторы пользователей.
+    :param k: Максимальное количество рекомендаций.
+    :param allowed: Маска книг над индексом книг алгоритма.
+    :return: Идентификаторы книг для каждого пользователя.
+    """
+    global _process_recommender
+    current = _process_recommender
+    if current is None or current.snapshot.directory != snapshot.directory:
+        current = Recommender()
+        current.matrix = PatchedRatingMatrix(RatingMatrix.open(snapshot.directory / "matrix"))
+        current.snapshot = Snapshot(snapshot.directory)
+        current.stale = False
+        _process_recommender = current
+    current.replay(journal[len(current.journal):])
+    if snapshot.item_neighbors != current.snapshot.item_neighbors:
+        current.item_neighbors = (
+            ItemNeighbors.open(snapshot.directory / snapshot.item_neighbors) if snapshot.item_neighbors else None
+        )
+    if snapshot.als_model != current.snapshot.als_model:
+        current.als_model = ALSModel.open(snapshot.directory / snapshot.als_model) if snapshot.als_model else None
+    current.snapshot = snapshot
+    return current.recommend_batch(user_ids, k, engine, allowed)
+
+
+recommender = Recommender()
+
+
+def get_recommender() -> Recommender:
+    """
+    Зависимость FastAPI для доступа к модели рекомендаций воркера.
+    :return: Модель рекомендаций.
+    """
+    return recommender
+
+
+CurrentRecommender = Annotated[Recommender, Depends(get_recommender)]
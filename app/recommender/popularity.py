@@ -0,0 +1,43 @@
+import time
+from typing import Optional
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.environment import settings
+from app.models import Book
+
+
+class PopularityRanking:
+    """
+    Кэш ранжирования книг по популярности для пользователей без рекомендаций.
+
+    Хранит идентификаторы всех книг в порядке убывания среднего рейтинга
+    и года издания, поэтому страница популярных книг - это срез списка.
+    Сбрасывается при изменении оценок и книг в этом воркере, а изменения
+    в других воркерах подхватывает не позже чем через POPULARITY_REFRESH_INTERVAL секунд.
+    """
+
+    def __init__(self):
+        self.book_ids: Optional[np.ndarray] = None
+        self.loaded_at = 0.0
+
+    def invalidate(self) -> None:
+        """Пометка ранжирования устаревшим."""
+        self.book_ids = None
+
+    async def get(self, db: AsyncSession) -> np.ndarray:
+        """
+        Актуальное ранжирование, при необходимости загруженное из базы данных.
+        :param db: Сессия базы данных.
+        :return: Идентификаторы книг от самых популярных.
+        """
+        if self.book_ids is None or time.monotonic() - self.loaded_at > settings.POPULARITY_REFRESH_INTERVAL:
+            book_ids = await db.scalars(
+                select(Book.id)
+                .order_by(Book.average_rating.desc(), Book.publication_year.desc(), Book.id)
+            )
+            self.book_ids = np.array(book_ids.all(), dtype=np.int32)
+            self.loaded_at = time.monotonic()
+        return self.book_ids
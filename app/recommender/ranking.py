@@ -0,0 +1,151 @@
+import base64
+import secrets
+import time
+from collections import OrderedDict
+from typing import Optional
+
+
+class RankedList:
+    """
+    Ранжированный список книг пользователя, по которому листаются страницы.
+
+    complete=False означает, что список обрезан при расчете и за его
+    концом могут быть еще рекомендации. params - параметры запроса (фильтры
+    книг, алгоритм рекомендаций), с которыми список рассчитан.
+    Список, сохраненный с latest=False, выдается только по курсору.
+    """
+
+    def __init__(
+            self,
+            list_id: str,
+            user_id: int,
+            version: int,
+            book_ids: list[int],
+            complete: bool,
+            params: tuple = ()
+    ):
+        self.list_id = list_id
+        self.user_id = user_id
+        self.version = version
+        self.book_ids = book_ids
+        self.complete = complete
+        self.params = params
+        self.created_at = time.monotonic()
+
+
+class RankedListCache:
+    """
+    LRU-кэш ранжированных списков.
+
+    Список рассчитывается один раз на версию модели, а следующие страницы
+    берутся срезом из того же списка, поэтому листание по курсору устойчиво
+    к изменениям модели между запросами.
+    """
+
+    def __init__(self, size: int, ttl: int):
+        self.size = size
+        self.ttl = ttl
+        self.lists: OrderedDict[str, RankedList] = OrderedDict()
+        self.latest_ids: dict[tuple[int, tuple], str] = {}
+
+    def get(self, list_id: str, user_id: int, params: tuple = ()) -> Optional[RankedList]:
+        """
+        Список по идентификатору из курсора.
+        :param list_id: Идентификатор списка.
+        :param user_id: Идентификатор пользователя, чужие списки не выдаются.
+        :param params: Параметры запроса, список с другими параметрами не выдается.
+        :return: Список или None, если он вытеснен или устарел.
+        """
+        ranked = self.lists.get(list_id)
+        if ranked is None or ranked.user_id != user_id or ranked.params != params:
+            return None
+        if time.monotonic() - ranked.created_at > self.ttl:
+            self._remove(list_id)
+            return None
+        self.lists.move_to_end(list_id)
+        return ranked
+
+    def latest(self, user_id: int, version: int, params: tuple = ()) -> Optional[RankedList]:
+        """
+        Последний список пользователя с этими параметрами, если он рассчитан на этой версии модели.
+        :param user_id: Идентификатор пользователя.
+        :param version: Версия модели.
+        :param params: Параметры запроса.
+        :return: Список или None.
+        """
+        ranked = self.last(user_id, params)
+        return ranked if ranked is not None and ranked.version == version else None
+
+    def last(self, user_id: int, params: tuple = ()) -> Optional[RankedList]:
+        """
+        Последний список пользователя с этими параметрами, рассчитанный на любой версии модели.
+        :param user_id: Идентификатор пользователя.
+        :param params: Параметры запроса.
+        :return: Список или None.
+        """
+        list_id = self.latest_ids.get((user_id, params))
+        return self.get(list_id, user_id, params) if list_id is not None else None
+
+    def put(
+            self,
+            user_id: int,
+            version: int,
+            book_ids: list[int],
+            complete: bool,
+            params: tuple = (),
+            latest: bool = True
+    ) -> RankedList:
+        """
+        Сохранение нового списка с вытеснением самых давно использованных.
+        :param user_id: Идентификатор пользователя.
+        :param version: Версия модели.
+        :param book_ids: Идентификаторы книг в порядке убывания оценки.
+        :param complete: Содержит ли список все рекомендации.
+        :param params: Параметры запроса.
+        :param latest: Выдавать ли список через latest() и last(), иначе только по курсору.
+        :return: Список.
+        """
+        ranked = RankedList(secrets.token_urlsafe(12), user_id, version, book_ids, complete, params)
+        self.lists[ranked.list_id] = ranked
+        if latest:
+            self.latest_ids[(user_id, params)] = ranked.list_id
+        while len(self.lists) > self.size:
+            self._remove(next(iter(self.lists)))
+        return ranked
+
+    def clear(self) -> None:
+        """Удаление всех списков."""
+        self.lists.clear()
+        self.latest_ids.clear()
+
+    def _remove(self, list_id: str) -> None:
+        ranked = self.lists.pop(list_id)
+        if self.latest_ids.get((ranked.user_id, ranked.params)) == list_id:
+            del self.latest_ids[(ranked.user_id, ranked.params)]
+
+
+def encode_cursor(list_id: str, offset: int) -> str:
+    """
+    Непрозрачный курсор следующей страницы.
+    :param list_id: Идентификатор списка.
+    :param offset: Позиция начала страницы в списке.
+    :return: Курсор.
+    """
+    return base64.urlsafe_b64encode(f"{list_id}:{offset}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[str, int]:
+    """
+    Разбор курсора.
+    :param cursor: Курсор.
+    :return: Идентификатор списка и позиция.
+    :raises ValueError: Если курсор поврежден.
+    """
+    try:
+        list_id, offset = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode().rsplit(":", 1)
+        offset = int(offset)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+    if offset < 0:
+        raise ValueError("Invalid cursor")
+    return list_id, offset
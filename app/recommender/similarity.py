@@ -0,0 +1,237 @@
+import time
+from typing import Optional
+
+import numpy as np
+
+from .lsh import UserLSH
+from .matrix import SparseRatings
+
+BATCH_CELLS = 1 << 22
+
+
+def top_k_indices(values: np.ndarray, k: int) -> np.ndarray:
+    """
+    Индексы k наибольших значений в порядке убывания без полной сортировки массива.
+    Для двумерного массива выбор делается в каждой строке.
+    :param values: Массив значений.
+    :param k: Количество индексов.
+    :return: Массив индексов.
+    """
+    k = min(k, values.shape[-1])
+    if k <= 0:
+        return np.empty(values.shape[:-1] + (0,), dtype=np.intp)
+    indices = np.argpartition(values, -k, axis=-1)[..., -k:]
+    order = np.argsort(np.take_along_axis(values, indices, axis=-1), axis=-1)[..., ::-1]
+    return np.take_along_axis(indices, order, axis=-1)
+
+
+def exact_neighbors(
+        matrix: SparseRatings,
+        user_indices: np.ndarray,
+        top_n: int
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Точный поиск наиболее похожих пользователей для пачки пользователей.
+
+    Сходства пачки со всеми пользователями считаются плотной матрицей
+    размера пачка × n_users.
+    :param matrix: Матрица оценок.
+    :param user_indices: Индексы строк пользователей.
+    :param top_n: Количество соседей каждого пользователя.
+    :return: Позиции пользователей в пачке, индексы строк соседей и сходства,
+        для каждого пользователя top_n пар в порядке убывания сходства.
+    """
+    n = len(user_indices)
+    books, ratings, lengths = matrix.gather_rows(user_indices)
+    owners = np.repeat(np.arange(n), lengths)
+
+    users, values, column_lengths = matrix.gather_columns(books)
+    dot_products = np.bincount(
+        np.repeat(owners, column_lengths) * matrix.n_users + users,
+        weights=np.repeat(ratings.astype(np.float64), column_lengths) * values,
+        minlength=n * matrix.n_users
+    ).reshape(n, matrix.n_users)
+    denominators = np.outer(matrix.norms[user_indices], matrix.norms)
+    similarities = np.divide(
+        dot_products,
+        denominators,
+        out=np.zeros(dot_products.shape, dtype=np.float32),
+        where=denominators > 0
+    )
+    similarities[np.arange(n), user_indices] = -np.inf
+
+    top_users = top_k_indices(similarities, min(top_n, matrix.n_users - 1))
+    return (
+        np.repeat(np.arange(n), top_users.shape[1]),
+        top_users.ravel(),
+        np.take_along_axis(similarities, top_users, axis=1).ravel()
+    )
+
+
+def top_books(scores: np.ndarray, book_ids: np.ndarray, k: int) -> list[list[int]]:
+    """
+    Книги с k наибольшими положительными оценками в каждой строке.
+    :param scores: Оценки книг размера пачка × книги.
+    :param book_ids: Идентификаторы книг столбцов.
+    :param k: Максимальное количество книг.
+    :return: Идентификаторы книг в порядке убывания оценки для каждой строки.
+    """
+    top = top_k_indices(scores, k)
+    return [
+        book_ids[row[scores[i, row] > 0]].tolist()
+        for i, row in enumerate(top)
+    ]
+
+
+def score_books_batch(
+        matrix: SparseRatings,
+        user_indices: np.ndarray,
+        top_n_users: int,
+        index: Optional[UserLSH] = None,
+        probes: int = 0,
+        candidates: int = 0
+) -> np.ndarray:
+    """
+    Оценки книг по оценкам похожих пользователей сразу для пачки пользователей.
+
+    Оценки книг считаются плотной матрицей размера пачка × n_books,
+    а без индекса такой же матрицей пачка × n_users считаются сходства,
+    поэтому размер пачки следует ограничивать, см. batch_size().
+    :param matrix: Матрица оценок.
+    :param user_indices: Индексы строк пользователей.
+    :param top_n_users: Количество учитываемых похожих пользователей.
+    :param index: Приближенный индекс соседей, без него соседи ищутся точно.
+    :param probes: Количество дополнительных корзин индекса, см. UserLSH.neighbors().
+    :param candidates: Количество кандидатов индекса, см. UserLSH.neighbors().
+    :return: Оценки книг матрицы (float32), для оцененных пользователем книг нулевые.
+    """
+    n = len(user_indices)
+    books, _, lengths = matrix.gather_rows(user_indices)
+    owners = np.repeat(np.arange(n), lengths)
+    if index is None:
+        rows, neighbors, similarities = exact_neighbors(matrix, user_indices, top_n_users)
+    else:
+        rows, neighbors, similarities = index.neighbors(matrix, user_indices, top_n_users, probes, candidates)
+
+    neighbor_books, neighbor_values, neighbor_lengths = matrix.gather_rows(neighbors)
+    scores = np.bincount(
+        np.repeat(rows, neighbor_lengths) * matrix.n_books + neighbor_books,
+        weights=np.repeat(np.maximum(similarities, 0), neighbor_lengths) * neighbor_values,
+        minlength=n * matrix.n_books
+    ).reshape(n, matrix.n_books).astype(np.float32)
+    scores[owners, books] = 0
+    return scores
+
+
+def recommend_books_batch(
+        matrix: SparseRatings,
+        user_indices: np.ndarray,
+        top_n_users: int,
+        k: int,
+        index: Optional[UserLSH] = None,
+        probes: int = 0,
+        candidates: int = 0,
+        allowed: Optional[np.ndarray] = None
+) -> list[list[int]]:
+    """
+    Рекомендации на основе оценок похожих пользователей сразу для пачки пользователей.
+    :param matrix: Матрица оценок.
+    :param user_indices: Индексы строк пользователей.
+    :param top_n_users: Количество учитываемых похожих пользователей.
+    :param k: Максимальное количество рекомендаций.
+    :param index: Приближенный индекс соседей, см. score_books_batch().
+    :param probes: Количество дополнительных корзин индекса, см. UserLSH.neighbors().
+    :param candidates: Количество кандидатов индекса, см. UserLSH.neighbors().
+    :param allowed: Маска книг матрицы, которые можно рекомендовать.
+    :return: Идентификаторы книг в порядке убывания оценки для каждого пользователя.
+    """
+    scores = score_books_batch(matrix, user_indices, top_n_users, index, probes, candidates)
+    if allowed is not None:
+        scores[:, ~allowed] = 0
+    return top_books(scores, matrix.book_ids, k)
+
+
+def recommend_from_neighbor_ratings(
+        user_id: int,
+        neighbor_ids: np.ndarray,
+        similarities: np.ndarray,
+        user_ids: np.ndarray,
+        book_ids: np.ndarray,
+        ratings: np.ndarray,
+        k: int
+) -> list[int]:
+    """
+    Рекомендации по оценкам заранее найденных похожих пользователей
+    без матрицы оценок всех пользователей, так же, как recommend_books_batch().
+    :param user_id: Идентификатор пользователя.
+    :param neighbor_ids: Идентификаторы похожих пользователей.
+    :param similarities: Сходства с похожими пользователями.
+    :param user_ids: Идентификаторы пользователей оценок пользователя и его соседей.
+    :param book_ids: Идентификаторы книг оценок.
+    :param ratings: Оценки.
+    :param k: Максимальное количество рекомендаций.
+    :return: Идентификаторы книг в порядке убывания оценки.
+    """
+    books, book_indices = np.unique(book_ids, return_inverse=True)
+    order = np.argsort(neighbor_ids)
+    found = np.isin(user_ids, neighbor_ids) & (user_ids != user_id)
+    weights = np.maximum(similarities, 0)[order[np.searchsorted(neighbor_ids, user_ids[found], sorter=order)]]
+    scores = np.bincount(
+        book_indices[found],
+        weights=weights * ratings[found],
+        minlength=len(books)
+    )
+    scores[book_indices[user_ids == user_id]] = 0
+    top_books = top_k_indices(scores, k)
+    return books[top_books[scores[top_books] > 0]].tolist()
+
+
+def batch_size(matrix: SparseRatings) -> int:
+    """
+    Размер пачки пользователей, при котором плотные промежуточные матрицы
+    занимают не более BATCH_CELLS элементов.
+    :param matrix: Матрица оценок.
+    :return: Количество пользователей в пачке.
+    """
+    return max(1, BATCH_CELLS // max(matrix.n_users, matrix.n_books, 1))
+
+
+def neighbor_recall(
+        matrix: SparseRatings,
+        index: UserLSH,
+        user_indices: np.ndarray,
+        top_n: int,
+        probes: int,
+        candidates: int
+) -> tuple[float, float, float]:
+    """
+    Полнота приближенного поиска соседей относительно точного.
+
+    Учитываются только точные соседи с положительным сходством,
+    остальные не влияют на рекомендации.
+    :param matrix: Матрица оценок.
+    :param index: Приближенный индекс соседей.
+    :param user_indices: Индексы строк проверяемых пользователей.
+    :param top_n: Количество соседей.
+    :param probes: Количество дополнительных корзин индекса.
+    :param candidates: Количество кандидатов индекса.
+    :return: Доля найденных точных соседей, время точного и приближенного поиска в секундах.
+    """
+    exact_seconds = approximate_seconds = 0.0
+    found = total = 0
+    size = batch_size(matrix)
+    for start in range(0, len(user_indices), size):
+        chunk = user_indices[start:start + size]
+        started = time.perf_counter()
+        rows, neighbors, similarities = exact_neighbors(matrix, chunk, top_n)
+        exact_seconds += time.perf_counter() - started
+        started = time.perf_counter()
+        approximate_rows, approximate_neighbors, _ = index.neighbors(matrix, chunk, top_n, probes, candidates)
+        approximate_seconds += time.perf_counter() - started
+
+        positive = similarities > 0
+        expected = rows[positive] * np.int64(matrix.n_users) + neighbors[positive]
+        actual = approximate_rows * np.int64(matrix.n_users) + approximate_neighbors
+        found += int(np.isin(expected, actual).sum())
+        total += len(expected)
+    return (found / total if total else 1.0), exact_seconds, approximate_seconds
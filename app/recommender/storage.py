@@ -0,0 +1,56 @@
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+
+
+def save_arrays(directory: str | Path, arrays: dict[str, np.ndarray]) -> None:
+    """
+    Сохранение массивов в каталог, каждый в отдельный файл .npy.
+    Файл пишется рядом и подменяет прежний переименованием, поэтому
+    открывшие прежний файл через numpy.memmap продолжают читать его.
+    :param directory: Каталог, создается при необходимости.
+    :param arrays: Массивы по именам.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    for name, array in arrays.items():
+        partial = directory / f".{name}.npy"
+        with open(partial, "wb") as file:
+            np.save(file, array)
+        os.replace(partial, directory / f"{name}.npy")
+
+
+def open_arrays(directory: str | Path, names: tuple[str, ...]) -> dict[str, np.ndarray]:
+    """
+    Открытие сохраненных массивов без чтения в память.
+
+    Файлы отображаются в память через numpy.memmap только для чтения,
+    поэтому процессы, открывшие один каталог, разделяют одну физическую
+    копию данных через страничный кэш.
+    :param directory: Каталог с файлами .npy.
+    :param names: Имена массивов.
+    :return: Массивы по именам.
+    """
+    directory = Path(directory)
+    return {name: np.load(directory / f"{name}.npy", mmap_mode="r") for name in names}
+
+
+def link_tree(source: str | Path, destination: str | Path) -> None:
+    """
+    Копия каталога из жестких ссылок на его файлы.
+
+    Ссылки разделяют с исходными файлами данные и страничный кэш и остаются
+    доступны после удаления исходного каталога. Если каталоги на разных
+    файловых системах, файлы копируются.
+    :param source: Исходный каталог.
+    :param destination: Новый каталог, не должен существовать.
+    """
+    def link(src: str, dst: str) -> None:
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copy2(src, dst)
+
+    shutil.copytree(source, destination, copy_function=link)
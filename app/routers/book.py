@@ -6,7 +6,8 @@ from sqlalchemy.orm import selectinload
 
 from app.database import AsyncDB
 from app.models import Book, BookGenre, Author, Genre
-from app.schemas import PrimaryKey
+from app.recommender import CurrentRecommender
+from app.schemas import PrimaryKey, Limit
 from app.schemas.book import BookGet, BookCreate, BookUpdate, BookGetQuery
 from app.security import CurrentAdmin
 
@@ -20,7 +21,8 @@ router = APIRouter(
 async def create_book(
         book_data: Annotated[BookCreate, Body()],
         db: AsyncDB,
-        _: CurrentAdmin
+        _: CurrentAdmin,
+        recommender: CurrentRecommender
 ) -> BookGet:
     author = await Author.get_by_id(db, book_data.author_id)
     if author is None:
@@ -51,6 +53,7 @@ async def create_book(
     book = await Book.get_by_id_full(db, book.id)
     book = BookGet.model_validate(book)
     await db.commit()
+    recommender.invalidate_books()
     return book
 
 
@@ -68,6 +71,24 @@ async def get_book(
     return BookGet.model_validate(book)
 
 
+@router.get("/{book_id}/similar")
+async def get_similar_books(
+        book_id: PrimaryKey,
+        db: AsyncDB,
+        recommender: CurrentRecommender,
+        limit: Limit = 10
+) -> List[BookGet]:
+    book = await Book.get_by_id(db, book_id)
+    if book is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Book not found"
+        )
+    book_ids = await recommender.similar_books(db, book_id, limit)
+    books = await Book.get_by_ids_full(db, book_ids)
+    return [BookGet.model_validate(book) for book in books]
+
+
 @router.get("/")
 async def get_books(
         db: AsyncDB,
@@ -103,7 +124,8 @@ async def update_book(
         book_id: PrimaryKey,
         book_data: Annotated[BookUpdate, Body()],
         db: AsyncDB,
-        _: CurrentAdmin
+        _: CurrentAdmin,
+        recommender: CurrentRecommender
 ) -> BookGet:
     book = await Book.get_by_id(db, book_id)
     if book is None:
@@ -161,6 +183,7 @@ async def update_book(
     book = await Book.get_by_id_full(db, book_id)
     book = BookGet.model_validate(book)
     await db.commit()
+    recommender.invalidate_books()
     return book
 
 
@@ -168,7 +191,8 @@ async def update_book(
 async def delete_book(
         book_id: PrimaryKey,
         db: AsyncDB,
-        _: CurrentAdmin
+        _: CurrentAdmin,
+        recommender: CurrentRecommender
 ):
     book = await Book.get_by_id(db, book_id)
     if book is None:
@@ -178,3 +202,4 @@ async def delete_book(
         )
     await db.delete(book)
     await db.commit()
+    recommender.remove_book(book_id)
@@ -5,7 +5,8 @@ from sqlalchemy import select, update, func
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.database import AsyncDB
-from app.models import Rating, Book
+from app.models import Rating, Book, UserRecommendation
+from app.recommender import CurrentRecommender
 from app.schemas import PrimaryKey, Skip, Limit
 from app.schemas.rating import RatingGet, RatingCreate, RatingUpdate
 from app.security import CurrentUser
@@ -33,7 +34,8 @@ async def update_book_rating(db: AsyncSession, book_id: int):
 async def create_rating(
         rating_data: Annotated[RatingCreate, Body()],
         db: AsyncDB,
-        current_user: CurrentUser
+        current_user: CurrentUser,
+        recommender: CurrentRecommender
 ) -> RatingGet:
     book = await Book.get_by_id(db, rating_data.book_id)
     if book is None:
@@ -57,8 +59,10 @@ async def create_rating(
     await db.flush()
     await db.refresh(rating)
     await update_book_rating(db, rating.book_id)
+    await UserRecommendation.discard(db, current_user.id)
     rating = RatingGet.model_validate(rating)
     await db.commit()
+    recommender.set_rating(current_user.id, rating.book_id, rating.rating)
     return rating
 
 
@@ -98,7 +102,8 @@ async def update_rating(
         rating_id: PrimaryKey,
         rating_data: Annotated[RatingUpdate, Body()],
         db: AsyncDB,
-        current_user: CurrentUser
+        current_user: CurrentUser,
+        recommender: CurrentRecommender
 ) -> RatingGet:
     rating = await Rating.get_by_id(db, rating_id)
     if rating is None:
@@ -128,7 +133,9 @@ async def update_rating(
     rating = rating.scalar_one()
     rating = RatingGet.model_validate(rating)
     await update_book_rating(db, rating.book_id)
+    await UserRecommendation.discard(db, current_user.id)
     await db.commit()
+    recommender.set_rating(current_user.id, rating.book_id, rating.rating)
     return rating
 
 
@@ -136,7 +143,8 @@ async def update_rating(
 async def delete_rating(
         rating_id: PrimaryKey,
         db: AsyncDB,
-        current_user: CurrentUser
+        current_user: CurrentUser,
+        recommender: CurrentRecommender
 ):
     rating = await Rating.get_by_id(db, rating_id)
     if rating is None:
@@ -151,4 +159,6 @@ async def delete_rating(
         )
     await db.delete(rating)
     await update_book_rating(db, rating.book_id)
+    await UserRecommendation.discard(db, current_user.id)
     await db.commit()
+    recommender.remove_rating(rating.user_id, rating.book_id)
@@ -1,19 +1,22 @@
+from datetime import timedelta
 from typing import Annotated
 
-import numpy as np
-from fastapi import APIRouter, Depends, HTTPException, status, Body
+from fastapi import APIRouter, Depends, HTTPException, status, Body, Response
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy import select
-from sqlalchemy.orm import selectinload
 
-from app.database import AsyncDB
+from app.database import AsyncDB, SessionFactory
 from app.environment import settings
-from app.models import Rating, Book
+from app.models import Book, UserRecommendation
 from app.models.user import User
-from app.schemas import Limit, Skip
+from app.recommender import CurrentRecommender, Recommender, RankedList, encode_cursor, decode_cursor, batch_size
+from app.schemas import Limit, Skip, Cursor
 from app.schemas.book import BookGet
+from app.schemas.recommendation import (
+    RecommendationBatch, RecommendationQuery, UserRecommendations, RecommenderMetrics
+)
 from app.schemas.user import UserCreate, Token, UserGet
-from app.security import authenticate_user, create_access_token, get_password_hash, CurrentUser
+from app.security import authenticate_user, create_access_token, get_password_hash, CurrentUser, CurrentAdmin
 
 router = APIRouter(
     tags=["user"]
@@ -74,100 +77,183 @@ async def users_me(
     return UserGet.model_validate(current_user)
 
 
-def cosine_similarity(a: np.ndarray, b: np.ndarray) -> float:
-    """Косинусное сходство между двумя векторами."""
-    dot_product = np.dot(a, b)
-    norm_a = np.linalg.norm(a)
-    norm_b = np.linalg.norm(b)
-    return dot_product / (norm_a * norm_b) if norm_a > 0 and norm_b > 0 else 0
-
+async def get_ranked_list(
+        db: AsyncDB,
+        recommender: CurrentRecommender,
+        user_id: int,
+        needed: int,
+        params: RecommendationQuery
+) -> RankedList:
+    """
+    Расчет ранжированного списка пользователя и сохранение его в кэш.
 
-async def get_fallback_recommendations(db: AsyncDB, skip: int, limit: int) -> list[BookGet]:
-    """Рекомендации без учета схожести пользователей."""
-    books = await db.execute(
-        select(Book)
-        .options(
-            selectinload(Book.author),
-            selectinload(Book.genres),
-            selectinload(Book.ratings)
+    Источник - предвычисленные рекомендации, если их хватает на needed книг
+    или они содержат все рекомендации пользователя, иначе расчет моделью
+    глубиной не меньше RANKED_LIST_SIZE, а если рекомендовать нечего -
+    ранжирование по популярности. Полный предвычисленный список кэшируется
+    незавершенным, поэтому страницы за его концом рассчитываются моделью.
+    Фильтры книг применяются масками каталога до отбора лучших книг.
+    Предвычисленные рекомендации не используются, если заданы фильтры
+    или алгоритм рекомендаций.
+    """
+    version = recommender.version
+    book_filter = (await recommender.catalog.get(db)).filter(params.genre_id, params.year_from, params.year_to)
+    precomputed = None
+    if book_filter is None and params.engine is None:
+        precomputed = await UserRecommendation.get_fresh(
+            db, user_id, timedelta(seconds=settings.PRECOMPUTED_RECOMMENDATIONS_TTL)
         )
-        .order_by(Book.average_rating.desc(), Book.publication_year.desc())
-        .offset(skip)
-        .limit(limit)
-    )
-    books = books.scalars().all()
-    return [BookGet.model_validate(book) for book in books]
+    if precomputed is not None and (
+            needed <= len(precomputed.book_ids)
+            or len(precomputed.book_ids) < settings.PRECOMPUTED_RECOMMENDATIONS
+    ):
+        book_ids = precomputed.book_ids
+        complete = len(book_ids) < settings.PRECOMPUTED_RECOMMENDATIONS
+    else:
+        depth = max(needed, settings.RANKED_LIST_SIZE)
+        book_ids = await recommender.recommend(db, user_id, depth, book_filter, params.engine)
+        complete = len(book_ids) < depth
+    if len(book_ids) == 0:
+        book_ids = await get_popular_books(db, recommender, params)
+        complete = True
+    return recommender.ranked_lists.put(user_id, version, book_ids, complete, params.key())
+
+
+async def get_popular_books(db: AsyncDB, recommender: Recommender, params: RecommendationQuery) -> list[int]:
+    """Книги, подходящие под фильтры, в порядке убывания популярности."""
+    popular = await recommender.popularity.get(db)
+    book_filter = (await recommender.catalog.get(db)).filter(params.genre_id, params.year_from, params.year_to)
+    if book_filter is not None:
+        popular = popular[book_filter.allowed(popular, "popularity", popular)]
+    return popular.tolist()
+
+
+async def get_ranked_list_within_budget(
+        db: AsyncDB,
+        session_factory: SessionFactory,
+        recommender: CurrentRecommender,
+        response: Response,
+        user_id: int,
+        needed: int,
+        params: RecommendationQuery
+) -> RankedList:
+    """
+    Расчет ранжированного списка не дольше RECOMMENDATIONS_LATENCY_BUDGET секунд,
+    включая ожидание слота в recommender.gate (при заполненной очереди - 503).
+
+    Если расчет не уложился в бюджет, он продолжается в фоне и кладет список
+    в кэш, а ответ собирается из последнего списка пользователя с теми же
+    параметрами, рассчитанного на любой версии модели, или из популярных книг.
+    Такой ответ учитывается в Recommender.degradations и помечается
+    заголовком X-Degraded с источником ответа. Список из популярных книг
+    кэшируется только для листания по курсору и не считается результатом
+    расчета на этой версии модели.
+    На время ожидания сессия запроса возвращает соединение в пул, чтобы
+    очередь расчетов не отнимала соединения у остальных запросов.
+    """
+    version = recommender.version
+    budget = settings.RECOMMENDATIONS_LATENCY_BUDGET
+    await db.commit()
+    if budget <= 0:
+        async with recommender.gate.slot():
+            return await get_ranked_list(db, recommender, user_id, needed, params)
+
+    async def compute() -> RankedList:
+        async with recommender.gate.slot(), session_factory() as own_db:
+            return await get_ranked_list(own_db, recommender, user_id, needed, params)
+
+    ranked = await recommender.within_budget((user_id, needed, params.key()), compute, budget)
+    if ranked is not None:
+        return ranked
+    ranked = recommender.ranked_lists.last(user_id, params.key())
+    if ranked is not None:
+        recommender.degrade("cached")
+        response.headers["X-Degraded"] = "cached"
+        return ranked
+    recommender.degrade("popularity")
+    response.headers["X-Degraded"] = "popularity"
+    book_ids = await get_popular_books(db, recommender, params)
+    return recommender.ranked_lists.put(user_id, version, book_ids, True, params.key(), latest=False)
 
 
 @router.get("/recommendations")
 async def recommendations(
         current_user: CurrentUser,
         db: AsyncDB,
+        session_factory: SessionFactory,
+        recommender: CurrentRecommender,
+        response: Response,
+        params: Annotated[RecommendationQuery, Depends()],
         skip: Skip = 0,
-        limit: Limit = 100
+        limit: Limit = 100,
+        cursor: Cursor = None
 ) -> list[BookGet]:
-    ratings = await db.execute(
-        select(
-            Rating.user_id,
-            Rating.book_id,
-            Rating.rating
-        )
-    )
-    ratings = ratings.all()
-    if len(ratings) == 0:
-        return await get_fallback_recommendations(db, skip, limit)
-
-    user_ids = await db.execute(select(User.id))
-    user_ids = user_ids.scalars().all()
-    book_ids = await db.execute(select(Book.id))
-    book_ids = book_ids.scalars().all()
-
-    user_to_idx = {user_id: i for i, user_id in enumerate(user_ids)}
-    book_to_idx = {book_id: i for i, book_id in enumerate(book_ids)}
-    current_user_idx = user_to_idx[current_user.id]
-
-    rating_matrix = np.zeros((len(user_ids), len(book_ids)))
-    for user_id, book_id, rating in ratings:
-        rating_matrix[user_to_idx[user_id], book_to_idx[book_id]] = rating
-
-    similarities = np.zeros(len(user_ids))
-    for i in range(len(user_ids)):
-        if i != current_user_idx:
-            similarities[i] = cosine_similarity(
-                rating_matrix[current_user_idx],
-                rating_matrix[i]
+    ranked = None
+    if cursor is not None:
+        try:
+            list_id, skip = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid cursor"
             )
+        ranked = recommender.ranked_lists.get(list_id, current_user.id, params.key())
+    if ranked is None:
+        ranked = recommender.ranked_lists.latest(current_user.id, recommender.version, params.key())
+    if ranked is None or (not ranked.complete and skip + limit > len(ranked.book_ids)):
+        ranked = await get_ranked_list_within_budget(
+            db, session_factory, recommender, response, current_user.id, skip + limit, params
+        )
+
+    if skip + limit < len(ranked.book_ids) or not ranked.complete:
+        response.headers["X-Next-Cursor"] = encode_cursor(ranked.list_id, skip + limit)
+    books = await Book.get_by_ids_full(db, ranked.book_ids[skip: skip + limit])
+    return [BookGet.model_validate(book) for book in books]
 
-    top_n = min(settings.TOP_N_USERS, len(user_ids) - 1)
-    top_user_indices = np.argsort(similarities)[-top_n:][::-1]
 
-    if len(top_user_indices) == 0:
-        return await get_fallback_recommendations(db, skip, limit)
+@router.post("/recommendations/batch", response_class=StreamingResponse)
+async def recommendations_batch(
+        _: CurrentAdmin,
+        batch: Annotated[RecommendationBatch, Body()],
+        db: AsyncDB,
+        recommender: CurrentRecommender
+) -> StreamingResponse:
+    """
+    Рекомендации для многих пользователей в формате NDJSON: строка
+    {"user_id": ..., "book_ids": [...]} на каждого пользователя в порядке запроса.
 
-    current_user_no_ratings = rating_matrix[current_user_idx] == 0
-    recommended_books = np.zeros(len(book_ids))
-    for user_idx in top_user_indices:
-        if similarities[user_idx] > 0:
-            user_ratings = rating_matrix[user_idx]
-            mask = current_user_no_ratings & (user_ratings > 0)
-            recommended_books[mask] += user_ratings[mask] * similarities[user_idx]
+    Пользователи считаются пачками, каждая пачка - один матричный расчет,
+    и ее строки отправляются клиенту, не дожидаясь остальных.
+    Пользователям без рекомендаций отдаются популярные книги.
+    Каждая пачка занимает слот recommender.gate, при заполненной очереди
+    отказ (503) возможен только до начала ответа.
+    Сессия запроса не держит соединение, пока ждет слоты и отдает ответ.
+    """
+    await db.commit()
+    async with recommender.gate.slot():
+        await recommender.prepare(db, batch.engine)
+    popular = (await recommender.popularity.get(db))[:batch.limit].tolist()
+    await db.commit()
+    size = batch_size(recommender.matrix)
 
-    top_book_indices = np.argsort(recommended_books)[::-1]
-    recommended_book_ids = [book_ids[i] for i in top_book_indices if recommended_books[i] > 0]
+    async def lines():
+        for start in range(0, len(batch.user_ids), size):
+            chunk = batch.user_ids[start:start + size]
+            async with recommender.gate.slot(reject=False):
+                chunk_book_ids = await recommender.recommend_many(chunk, batch.limit, engine=batch.engine)
+            for user_id, book_ids in zip(chunk, chunk_book_ids):
+                yield UserRecommendations(user_id=user_id, book_ids=book_ids or popular).model_dump_json() + "\n"
 
-    if len(recommended_book_ids) == 0:
-        return await get_fallback_recommendations(db, skip, limit)
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
 
-    recommended_book_ids = recommended_book_ids[skip: skip + limit]
 
-    books = await db.execute(
-        select(Book)
-        .options(
-            selectinload(Book.author),
-            selectinload(Book.genres),
-            selectinload(Book.ratings)
-        )
-        .where(Book.id.in_(recommended_book_ids))
-    )
-    books = books.scalars().all()
-    return [BookGet.model_validate(book) for book in books]
+@router.get("/recommendations/metrics")
+async def recommendations_metrics(
+        _: CurrentAdmin,
+        recommender: CurrentRecommender
+) -> RecommenderMetrics:
+    """
+    Метрики расчета рекомендаций воркера с его запуска: занятость слотов
+    и очередь recommender.gate, время ожидания слота, отказы и ответы без расчета.
+    """
+    return RecommenderMetrics(**recommender.gate.metrics(), degradations=recommender.degradations)
@@ -1,7 +1,8 @@
-from typing import Annotated
+from typing import Annotated, Optional
 
 from fastapi import Path, Query
 
 PrimaryKey = Annotated[int, Path(ge=1)]
 Skip = Annotated[int, Query(ge=0)]
 Limit = Annotated[int, Query(ge=1, le=1000)]
+Cursor = Annotated[Optional[str], Query(max_length=200)]
@@ -0,0 +1,49 @@
+from typing import Annotated, Dict, List, Optional
+
+from fastapi import Query
+from pydantic import BaseModel
+
+from app.environment import RecommenderEngine
+
+MAX_BATCH_USERS = 10000
+
+
+class RecommendationBatch(BaseModel):
+    user_ids: Annotated[
+        List[int],
+        Query(min_length=1, max_length=MAX_BATCH_USERS, examples=[[1, 2, 3]])
+    ]
+    limit: Annotated[
+        int,
+        Query(ge=1, le=1000, examples=[10])
+    ] = 100
+    engine: Annotated[
+        Optional[RecommenderEngine],
+        Query(examples=["popularity"])
+    ] = None
+
+
+class RecommendationQuery(BaseModel):
+    genre_id: Optional[Annotated[int, Query(ge=1)]] = None
+    year_from: Optional[Annotated[int, Query(ge=1000)]] = None
+    year_to: Optional[Annotated[int, Query(le=2100)]] = None
+    engine: Optional[RecommenderEngine] = None
+
+    def key(self) -> tuple:
+        """Ключ ранжированного списка в кэше: списки с разными параметрами не смешиваются."""
+        return self.genre_id, self.year_from, self.year_to, self.engine
+
+
+class UserRecommendations(BaseModel):
+    user_id: int
+    book_ids: List[int]
+
+
+class RecommenderMetrics(BaseModel):
+    active: int
+    waiting: int
+    admitted: int
+    rejected: int
+    average_wait_seconds: float
+    max_wait_seconds: float
+    degradations: Dict[str, int]
@@ -1,12 +1,14 @@
+import numpy as np
 import pytest
 from httpx import AsyncClient, ASGITransport
 from sqlalchemy import insert
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 
-from app.database import get_db
+from app.database import get_db, get_session_factory
 from app.environment import settings
 from app.main import app
 from app.models import Base, User
+from app.recommender import Recommender, get_recommender
 from app.security import get_password_hash
 
 
@@ -49,7 +51,14 @@ async def db_session(engine):
 
 
 @pytest.fixture(scope="function")
-async def test_client(db_session):
+def recommender(engine):
+    recommender = Recommender()
+    recommender.session_factory = async_sessionmaker(bind=engine, expire_on_commit=False)
+    return recommender
+
+
+@pytest.fixture(scope="function")
+async def test_client(engine, db_session, recommender):
     async def override_get_db():
         try:
             yield db_session
@@ -57,6 +66,8 @@ async def test_client(db_session):
             pass
 
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_session_factory] = lambda: async_sessionmaker(bind=engine, expire_on_commit=False)
+    app.dependency_overrides[get_recommender] = lambda: recommender
 
     async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
         yield client
@@ -76,3 +87,10 @@ async def admin_token(test_client: AsyncClient) -> str:
 
 def auth_headers(token: str) -> dict:
     return {"Authorization": f"Bearer {token}"}
+
+
+def cosine_similarity(a: np.ndarray, b: np.ndarray) -> float:
+    dot_product = np.dot(a, b)
+    norm_a = np.linalg.norm(a)
+    norm_b = np.linalg.norm(b)
+    return dot_product / (norm_a * norm_b) if norm_a > 0 and norm_b > 0 else 0
@@ -1,8 +1,15 @@
-import numpy as np
+import asyncio
+import json
+import threading
+from datetime import datetime, timedelta, timezone
+
 import pytest
 from httpx import AsyncClient
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.routers.user import cosine_similarity
+from app.environment import settings
+from app.models import UserRecommendation, UserNeighbor
+from app.recommender import Recommender, AdmissionGate, load_rating_matrix
 from tests.conftest import auth_headers
 
 
@@ -44,7 +51,10 @@ async def test_recommendations_no_ratings(test_client: AsyncClient, admin_token:
 
 
 @pytest.mark.asyncio
-async def test_recommendations_with_similar_users(test_client: AsyncClient, admin_token: str):
+@pytest.mark.parametrize("recommender_engine", ["user", "item"])
+async def test_recommendations_with_similar_users(test_client: AsyncClient, admin_token: str, monkeypatch,
+                                                  recommender_engine):
+    monkeypatch.setattr(settings, "RECOMMENDER_ENGINE", recommender_engine)
     author = await test_client.post("/authors/", json={"name": "Test Author"}, headers=auth_headers(admin_token))
     genre = await test_client.post("/genres/", json={"name": "Test Genre"}, headers=auth_headers(admin_token))
 
@@ -207,15 +217,893 @@ async def test_recommendations_pagination(test_client: AsyncClient, admin_token:
 
 
 @pytest.mark.asyncio
-async def test_cosine_similarity():
-    a = np.array([1, 2, 3])
-    assert cosine_similarity(a, a) == pytest.approx(1.0)
+async def test_recommendations_follow_rating_changes(test_client: AsyncClient, admin_token: str):
+    author = await test_client.post("/authors/", json={"name": "Test Author"}, headers=auth_headers(admin_token))
+    genre = await test_client.post("/genres/", json={"name": "Test Genre"}, headers=auth_headers(admin_token))
+
+    books = [
+        await test_client.post("/books/", json={
+            "title": f"Book {i}",
+            "author_id": author.json()["id"],
+            "genre_ids": [genre.json()["id"]],
+            "publication_year": 2000 + i
+        }, headers=auth_headers(admin_token)) for i in range(3)
+    ]
+    book_ids = [b.json()["id"] for b in books]
+
+    tokens = []
+    for i in range(2):
+        await test_client.post("/register", json={
+            "email": f"user{i}@test.com",
+            "username": f"user{i}",
+            "password": "password"
+        })
+        login = await test_client.post("/login", data={
+            "username": f"user{i}@test.com",
+            "password": "password"
+        })
+        tokens.append(login.json()["access_token"])
+
+    for token in tokens:
+        await test_client.post("/ratings/", json={"book_id": book_ids[0], "rating": 5}, headers=auth_headers(token))
+    rating = await test_client.post("/ratings/", json={"book_id": book_ids[1], "rating": 5},
+                                    headers=auth_headers(tokens[0]))
+
+    response = await test_client.get("/recommendations", headers=auth_headers(tokens[1]))
+    assert [b["id"] for b in response.json()] == [book_ids[1]]
+
+    await test_client.post("/ratings/", json={"book_id": book_ids[2], "rating": 5}, headers=auth_headers(tokens[0]))
+    response = await test_client.get("/recommendations", headers=auth_headers(tokens[1]))
+    assert sorted(b["id"] for b in response.json()) == sorted(book_ids[1:])
+
+    await test_client.delete(f"/ratings/{rating.json()['id']}", headers=auth_headers(tokens[0]))
+    response = await test_client.get("/recommendations", headers=auth_headers(tokens[1]))
+    assert [b["id"] for b in response.json()] == [book_ids[2]]
+
+
+@pytest.mark.asyncio
+async def test_precomputed_recommendations(test_client: AsyncClient, db_session: AsyncSession, admin_token: str,
+                                           recommender: Recommender):
+    author = await test_client.post("/authors/", json={"name": "Test Author"}, headers=auth_headers(admin_token))
+    genre = await test_client.post("/genres/", json={"name": "Test Genre"}, headers=auth_headers(admin_token))
+
+    books = [
+        await test_client.post("/books/", json={
+            "title": f"Book {i}",
+            "author_id": author.json()["id"],
+            "genre_ids": [genre.json()["id"]],
+            "publication_year": 2000 + i
+        }, headers=auth_headers(admin_token)) for i in range(3)
+    ]
+    book_ids = [b.json()["id"] for b in books]
+
+    user = await test_client.post("/register", json={
+        "email": "user@test.com",
+        "username": "testuser",
+        "password": "password"
+    })
+    login = await test_client.post("/login", data={
+        "username": "user@test.com",
+        "password": "password"
+    })
+    token = login.json()["access_token"]
+
+    precomputed = UserRecommendation(
+        user_id=user.json()["id"],
+        book_ids=[book_ids[2], book_ids[0]],
+        computed_at=datetime.now(timezone.utc) - timedelta(seconds=settings.PRECOMPUTED_RECOMMENDATIONS_TTL + 60)
+    )
+    db_session.add(precomputed)
+    await db_session.commit()
+    response = await test_client.get("/recommendations", headers=auth_headers(token))
+    assert len(response.json()) == 3
+
+    precomputed.computed_at = datetime.now(timezone.utc)
+    await db_session.commit()
+    recommender.ranked_lists.clear()
+    response = await test_client.get("/recommendations", headers=auth_headers(token))
+    assert sorted(b["id"] for b in response.json()) == sorted([book_ids[0], book_ids[2]])
+
+    await test_client.post("/ratings/", json={"book_id": book_ids[1], "rating": 5}, headers=auth_headers(token))
+    assert await UserRecommendation.get_fresh(db_session, user.json()["id"], timedelta(days=1)) is None
+    response = await test_client.get("/recommendations", headers=auth_headers(token))
+    assert len(response.json()) == 3
+
+
+@pytest.mark.asyncio
+async def test_precomputed_recommendations_full_list(test_client: AsyncClient, db_session: AsyncSession,
+                                                     admin_token: str, recommender: Recommender, monkeypatch):
+    monkeypatch.setattr(settings, "PRECOMPUTED_RECOMMENDATIONS", 2)
+    author = await test_client.post("/authors/", json={"name": "Test Author"}, headers=auth_headers(admin_token))
+    genre = await test_client.post("/genres/", json={"name": "Test Genre"}, headers=auth_headers(admin_token))
+
+    books = [
+        await test_client.post("/books/", json={
+            "title": f"Book {i}",
+            "author_id": author.json()["id"],
+            "genre_ids": [genre.json()["id"]],
+            "publication_year": 2000 + i
+        }, headers=auth_headers(admin_token)) for i in range(4)
+    ]
+    book_ids = [b.json()["id"] for b in books]
+
+    user = await test_client.post("/register", json={
+        "email": "user@test.com",
+        "username": "testuser",
+        "password": "password"
+    })
+    login = await test_client.post("/login", data={
+        "username": "user@test.com",
+        "password": "password"
+    })
+    token = login.json()["access_token"]
+
+    db_session.add(UserRecommendation(user_id=user.json()["id"], book_ids=[book_ids[3], book_ids[1]]))
+    await db_session.commit()
+
+    live_calls = []
+    recommend = recommender.recommend
+
+    async def counted_recommend(*args, **kwargs):
+        live_calls.append(args)
+        return await recommend(*args, **kwargs)
+
+    monkeypatch.setattr(recommender, "recommend", counted_recommend)
+
+    response = await test_client.get("/recommendations?limit=2", headers=auth_headers(token))
+    assert [b["id"] for b in response.json()] == [book_ids[3], book_ids[1]]
+    assert live_calls == []
+
+    response = await test_client.get(
+        f"/recommendations?limit=2&cursor={response.headers['X-Next-Cursor']}", headers=auth_headers(token)
+    )
+    assert [b["id"] for b in response.json()] == [book_ids[1], book_ids[0]]
+    assert len(live_calls) == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("rating_loader", ["stream", "copy"])
+async def test_load_rating_matrix(test_client: AsyncClient, db_session: AsyncSession, admin_token: str, monkeypatch,
+                                  rating_loader):
+    monkeypatch.setattr(settings, "RATING_LOADER", rating_loader)
+    monkeypatch.setattr("app.recommender.loader.STREAM_BATCH", 2)
+    author = await test_client.post("/authors/", json={"name": "Test Author"}, headers=auth_headers(admin_token))
+    genre = await test_client.post("/genres/", json={"name": "Test Genre"}, headers=auth_headers(admin_token))
+
+    books = [
+        await test_client.post("/books/", json={
+            "title": f"Book {i}",
+            "author_id": author.json()["id"],
+            "genre_ids": [genre.json()["id"]],
+            "publication_year": 2000 + i
+        }, headers=auth_headers(admin_token)) for i in range(3)
+    ]
+    book_ids = [b.json()["id"] for b in books]
+
+    expected = {}
+    for i in range(3):
+        user = await test_client.post("/register", json={
+            "email": f"user{i}@test.com",
+            "username": f"user{i}",
+            "password": "password"
+        })
+        login = await test_client.post("/login", data={
+            "username": f"user{i}@test.com",
+            "password": "password"
+        })
+        for book_id in book_ids[i:]:
+            await test_client.post("/ratings/", json={"book_id": book_id, "rating": i + book_id % 5 + 1},
+                                   headers=auth_headers(login.json()["access_token"]))
+            expected[(user.json()["id"], book_id)] = i + book_id % 5 + 1
+
+    matrix = await load_rating_matrix(db_session)
+    assert matrix.nnz == len(expected)
+    for (user_id, book_id), rating in expected.items():
+        books, values = matrix.row(matrix.user_index(user_id))
+        assert values[list(books).index(matrix.book_index(book_id))] == rating
+
+
+@pytest.mark.asyncio
+async def test_recommender_catch_up(test_client: AsyncClient, db_session: AsyncSession, admin_token: str):
+    author = await test_client.post("/authors/", json={"name": "Test Author"}, headers=auth_headers(admin_token))
+    genre = await test_client.post("/genres/", json={"name": "Test Genre"}, headers=auth_headers(admin_token))
+
+    books = [
+        await test_client.post("/books/", json={
+            "title": f"Book {i}",
+            "author_id": author.json()["id"],
+            "genre_ids": [genre.json()["id"]],
+            "publication_year": 2000 + i
+        }, headers=auth_headers(admin_token)) for i in range(4)
+    ]
+    book_ids = [b.json()["id"] for b in books]
+
+    tokens = []
+    for i in range(2):
+        await test_client.post("/register", json={
+            "email": f"user{i}@test.com",
+            "username": f"user{i}",
+            "password": "password"
+        })
+        login = await test_client.post("/login", data={
+            "username": f"user{i}@test.com",
+            "password": "password"
+        })
+        tokens.append(login.json()["access_token"])
+
+    ratings = [
+        await test_client.post("/ratings/", json={"book_id": book_id, "rating": 5}, headers=auth_headers(token))
+        for token in tokens for book_id in book_ids[:3]
+    ]
+
+    other_worker = Recommender()
+    await other_worker.build(db_session)
+    await db_session.commit()
+
+    await test_client.put(f"/ratings/{ratings[0].json()['id']}", json={"rating": 2}, headers=auth_headers(tokens[0]))
+    await test_client.delete(f"/ratings/{ratings[1].json()['id']}", headers=auth_headers(tokens[0]))
+    await test_client.post("/ratings/", json={"book_id": book_ids[3], "rating": 7}, headers=auth_headers(tokens[1]))
+    await test_client.delete(f"/books/{book_ids[2]}", headers=auth_headers(admin_token))
+
+    await other_worker.catch_up(db_session)
+    expected = await load_rating_matrix(db_session)
+    assert other_worker.matrix.nnz == expected.nnz
+    for user_id in expected.user_ids:
+        books, values = expected.row(expected.user_index(user_id))
+        caught_up = dict(zip(*other_worker.matrix.row(other_worker.matrix.user_index(user_id))))
+        assert {other_worker.matrix.book_ids[book]: value for book, value in caught_up.items()} == dict(
+            zip(expected.book_ids[books], values)
+        )
+
+    version = other_worker.version
+    await other_worker.catch_up(db_session)
+    assert other_worker.version == version
+
+
+@pytest.mark.asyncio
+async def test_recommender_rebuilds_when_far_behind(test_client: AsyncClient, db_session: AsyncSession,
+                                                     admin_token: str, recommender: Recommender,
+                                                     tmp_path, monkeypatch):
+    author = await test_client.post("/authors/", json={"name": "Test Author"}, headers=auth_headers(admin_token))
+    genre = await test_client.post("/genres/", json={"name": "Test Genre"}, headers=auth_headers(admin_token))
+    book_ids = [
+        (await test_client.post("/books/", json={
+            "title": f"Book {i}",
+            "author_id": author.json()["id"],
+            "genre_ids": [genre.json()["id"]],
+            "publication_year": 2000 + i
+        }, headers=auth_headers(admin_token))).json()["id"] for i in range(3)
+    ]
+    await test_client.post("/ratings/", json={"book_id": book_ids[0], "rating": 5},
+                           headers=auth_headers(admin_token))
+
+    other_worker = Recommender()
+    other_worker.session_factory = recommender.session_factory
+    await other_worker.build(db_session)
+    await db_session.commit()
+    matrix = other_worker.matrix
+
+    monkeypatch.setattr(settings, "RECOMMENDER_CATCH_UP_LIMIT", 1)
+    monkeypatch.setattr(settings, "RECOMMENDER_SYNC_INTERVAL", 0)
+    monkeypatch.setattr(settings, "RECOMMENDER_ARTIFACT_DIR", str(tmp_path))
+    for book_id in book_ids[1:]:
+        await test_client.post("/ratings/", json={"book_id": book_id, "rating": 7},
+                               headers=auth_headers(admin_token))
+
+    await other_worker.catch_up(db_session)
+    assert other_worker.stale
+    assert other_worker.invalidations == 1
+    assert other_worker.matrix is matrix
+    assert matrix.nnz == 1
+
+    sync = asyncio.create_task(other_worker.sync_periodically(other_worker.session_factory))
+    try:
+        for _ in range(500):
+            if not other_worker.stale:
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        sync.cancel()
+    assert not other_worker.stale
+    assert other_worker.invalidations == 1
+    assert other_worker.matrix.nnz == 3
+
+
+@pytest.mark.asyncio
+async def test_popular_fallback_follows_ratings(test_client: AsyncClient, admin_token: str):
+    author = await test_client.post("/authors/", json={"name": "Test Author"}, headers=auth_headers(admin_token))
+    genre = await test_client.post("/genres/", json={"name": "Test Genre"}, headers=auth_headers(admin_token))
+
+    books = [
+        await test_client.post("/books/", json={
+            "title": f"Book {i}",
+            "author_id": author.json()["id"],
+            "genre_ids": [genre.json()["id"]],
+            "publication_year": 2000 + i
+        }, headers=auth_headers(admin_token)) for i in range(3)
+    ]
+    book_ids = [b.json()["id"] for b in books]
+
+    tokens = []
+    for i in range(2):
+        await test_client.post("/register", json={
+            "email": f"user{i}@test.com",
+            "username": f"user{i}",
+            "password": "password"
+        })
+        login = await test_client.post("/login", data={
+            "username": f"user{i}@test.com",
+            "password": "password"
+        })
+        tokens.append(login.json()["access_token"])
+
+    response = await test_client.get("/recommendations", headers=auth_headers(tokens[1]))
+    assert [b["id"] for b in response.json()] == book_ids[::-1]
+
+    rating = await test_client.post("/ratings/", json={"book_id": book_ids[0], "rating": 2},
+                                    headers=auth_headers(tokens[0]))
+    await test_client.post("/ratings/", json={"book_id": book_ids[1], "rating": 9}, headers=auth_headers(tokens[0]))
+    response = await test_client.get("/recommendations?limit=2", headers=auth_headers(tokens[1]))
+    assert [b["id"] for b in response.json()] == [book_ids[1], book_ids[0]]
+
+    await test_client.put(f"/ratings/{rating.json()['id']}", json={"rating": 10}, headers=auth_headers(tokens[0]))
+    response = await test_client.get("/recommendations?skip=1", headers=auth_headers(tokens[1]))
+    assert [b["id"] for b in response.json()] == [book_ids[1], book_ids[2]]
+
+
+@pytest.mark.asyncio
+async def test_recommendations_cursor(test_client: AsyncClient, admin_token: str):
+    author = await test_client.post("/authors/", json={"name": "Test Author"}, headers=auth_headers(admin_token))
+    genre = await test_client.post("/genres/", json={"name": "Test Genre"}, headers=auth_headers(admin_token))
+
+    books = [
+        await test_client.post("/books/", json={
+            "title": f"Book {i}",
+            "author_id": author.json()["id"],
+            "genre_ids": [genre.json()["id"]],
+            "publication_year": 2000 + i
+        }, headers=auth_headers(admin_token)) for i in range(5)
+    ]
+    book_ids = [b.json()["id"] for b in books]
+
+    await test_client.post("/register", json={
+        "email": "user@test.com",
+        "username": "testuser",
+        "password": "password"
+    })
+    login = await test_client.post("/login", data={
+        "username": "user@test.com",
+        "password": "password"
+    })
+    token = login.json()["access_token"]
+
+    response = await test_client.get("/recommendations?limit=2", headers=auth_headers(token))
+    assert [b["id"] for b in response.json()] == book_ids[:2:-1]
+    cursor = response.headers["X-Next-Cursor"]
+
+    newest = await test_client.post("/books/", json={
+        "title": "Book new",
+        "author_id": author.json()["id"],
+        "genre_ids": [genre.json()["id"]],
+        "publication_year": 2020
+    }, headers=auth_headers(admin_token))
+
+    response = await test_client.get(f"/recommendations?limit=2&cursor={cursor}", headers=auth_headers(token))
+    assert [b["id"] for b in response.json()] == book_ids[2:0:-1]
+    response = await test_client.get(
+        f"/recommendations?limit=2&cursor={response.headers['X-Next-Cursor']}", headers=auth_headers(token)
+    )
+    assert [b["id"] for b in response.json()] == book_ids[:1]
+    assert "X-Next-Cursor" not in response.headers
+
+    response = await test_client.get("/recommendations?limit=1", headers=auth_headers(token))
+    assert [b["id"] for b in response.json()] == [newest.json()["id"]]
+
+    response = await test_client.get("/recommendations?cursor=broken", headers=auth_headers(token))
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_recommendations_batch(test_client: AsyncClient, admin_token: str):
+    author = await test_client.post("/authors/", json={"name": "Test Author"}, headers=auth_headers(admin_token))
+    genre = await test_client.post("/genres/", json={"name": "Test Genre"}, headers=auth_headers(admin_token))
+
+    books = [
+        await test_client.post("/books/", json={
+            "title": f"Book {i}",
+            "author_id": author.json()["id"],
+            "genre_ids": [genre.json()["id"]],
+            "publication_year": 2000 + i
+        }, headers=auth_headers(admin_token)) for i in range(10)
+    ]
+    book_ids = [b.json()["id"] for b in books]
+
+    users = []
+    for i in range(3):
+        await test_client.post("/register", json={
+            "email": f"user{i}@test.com",
+            "username": f"user{i}",
+            "password": "password"
+        })
+        login = await test_client.post("/login", data={
+            "username": f"user{i}@test.com",
+            "password": "password"
+        })
+        users.append(login.json()["access_token"])
+    user_ids = [
+        (await test_client.get("/me", headers=auth_headers(token))).json()["id"] for token in users
+    ]
+
+    for book_id in book_ids[:8]:
+        await test_client.post("/ratings/", json={"book_id": book_id, "rating": 5}, headers=auth_headers(users[0]))
+    for book_id in book_ids[:5]:
+        await test_client.post("/ratings/", json={"book_id": book_id, "rating": 3}, headers=auth_headers(users[1]))
+
+    response = await test_client.post("/recommendations/batch", json={"user_ids": user_ids},
+                                      headers=auth_headers(users[0]))
+    assert response.status_code == 403
+
+    response = await test_client.post("/recommendations/batch", json={"user_ids": user_ids, "limit": 3},
+                                      headers=auth_headers(admin_token))
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["user_id"] for line in lines] == user_ids
+
+    single = await test_client.get("/recommendations?limit=3", headers=auth_headers(users[1]))
+    assert lines[1]["book_ids"] == [b["id"] for b in single.json()]
+    assert set(lines[1]["book_ids"]) <= set(book_ids[5:8])
+    single = await test_client.get("/recommendations?limit=3", headers=auth_headers(users[2]))
+    assert lines[2]["book_ids"] == [b["id"] for b in single.json()]
+
+
+@pytest.mark.asyncio
+async def test_recommendations_from_stored_neighbors(test_client: AsyncClient, db_session: AsyncSession,
+                                                     admin_token: str, recommender: Recommender, monkeypatch):
+    monkeypatch.setattr(settings, "RECOMMENDER_ENGINE", "neighbors")
+    author = await test_client.post("/authors/", json={"name": "Test Author"}, headers=auth_headers(admin_token))
+    genre = await test_client.post("/genres/", json={"name": "Test Genre"}, headers=auth_headers(admin_token))
+
+    books = [
+        await test_client.post("/books/", json={
+            "title": f"Book {i}",
+            "author_id": author.json()["id"],
+            "genre_ids": [genre.json()["id"]],
+            "publication_year": 2000 + i
+        }, headers=auth_headers(admin_token)) for i in range(6)
+    ]
+    book_ids = [b.json()["id"] for b in books]
+
+    users = []
+    for i in range(3):
+        await test_client.post("/register", json={
+            "email": f"user{i}@test.com",
+            "username": f"user{i}",
+            "password": "password"
+        })
+        login = await test_client.post("/login", data={
+            "username": f"user{i}@test.com",
+            "password": "password"
+        })
+        users.append(login.json()["access_token"])
+    user_ids = [
+        (await test_client.get("/me", headers=auth_headers(token))).json()["id"] for token in users
+    ]
+
+    await test_client.post("/ratings/", json={"book_id": book_ids[0], "rating": 5}, headers=auth_headers(users[0]))
+    for book_id, rating in zip(book_ids[:3], [5, 9, 2]):
+        await test_client.post("/ratings/", json={"book_id": book_id, "rating": rating}, headers=auth_headers(users[1]))
+    for book_id, rating in zip(book_ids[3:], [10, 8, 6]):
+        await test_client.post("/ratings/", json={"book_id": book_id, "rating": rating}, headers=auth_headers(users[2]))
+
+    response = await test_client.get("/recommendations", headers=auth_headers(users[0]))
+    assert [b["id"] for b in response.json()] == [book_ids[1], book_ids[2]]
+
+    db_session.add(UserNeighbor(user_id=user_ids[0], neighbor_ids=[user_ids[2]], similarities=[0.5]))
+    await db_session.commit()
+    recommender.stale = True
+    recommender.ranked_lists.clear()
+    response = await test_client.get("/recommendations", headers=auth_headers(users[0]))
+    assert [b["id"] for b in response.json()] == book_ids[3:]
+    assert recommender.stale
+
+
+@pytest.mark.asyncio
+async def test_similar_books(test_client: AsyncClient, admin_token: str):
+    author = await test_client.post("/authors/", json={"name": "Test Author"}, headers=auth_headers(admin_token))
+    genre = await test_client.post("/genres/", json={"name": "Test Genre"}, headers=auth_headers(admin_token))
+
+    books = [
+        await test_client.post("/books/", json={
+            "title": f"Book {i}",
+            "author_id": author.json()["id"],
+            "genre_ids": [genre.json()["id"]],
+            "publication_year": 2000 + i
+        }, headers=auth_headers(admin_token)) for i in range(4)
+    ]
+    book_ids = [b.json()["id"] for b in books]
+
+    users = []
+    for i in range(3):
+        await test_client.post("/register", json={
+            "email": f"user{i}@test.com",
+            "username": f"user{i}",
+            "password": "password"
+        })
+        login = await test_client.post("/login", data={
+            "username": f"user{i}@test.com",
+            "password": "password"
+        })
+        users.append(login.json()["access_token"])
+
+    for token, rated in zip(users, [book_ids[:2], book_ids[:3], [book_ids[0], book_ids[3]]]):
+        for book_id in rated:
+            await test_client.post("/ratings/", json={"book_id": book_id, "rating": 5}, headers=auth_headers(token))
+
+    response = await test_client.get(f"/books/{book_ids[1]}/similar")
+    assert response.status_code == 200
+    assert [b["id"] for b in response.json()] == [book_ids[0], book_ids[2]]
+
+    response = await test_client.get(f"/books/{book_ids[1]}/similar?limit=1")
+    assert [b["id"] for b in response.json()] == [book_ids[0]]
+
+    response = await test_client.get(f"/books/{book_ids[3] + 100}/similar")
+    assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_recommendations_filters(test_client: AsyncClient, admin_token: str):
+    author = await test_client.post("/authors/", json={"name": "Test Author"}, headers=auth_headers(admin_token))
+    genres = [
+        await test_client.post("/genres/", json={"name": name}, headers=auth_headers(admin_token))
+        for name in ["Fantasy", "Detective"]
+    ]
+    genre_ids = [g.json()["id"] for g in genres]
+
+    books = [
+        await test_client.post("/books/", json={
+            "title": f"Book {i}",
+            "author_id": author.json()["id"],
+            "genre_ids": [genre_ids[i // 3]],
+            "publication_year": 2000 + i
+        }, headers=auth_headers(admin_token)) for i in range(6)
+    ]
+    book_ids = [b.json()["id"] for b in books]
+
+    users = []
+    for i in range(3):
+        await test_client.post("/register", json={
+            "email": f"user{i}@test.com",
+            "username": f"user{i}",
+            "password": "password"
+        })
+        login = await test_client.post("/login", data={
+            "username": f"user{i}@test.com",
+            "password": "password"
+        })
+        users.append(login.json()["access_token"])
+
+    for token, rated in zip(users, [{0: 5}, {0: 5, 1: 4, 3: 5, 4: 3}]):
+        for i, rating in rated.items():
+            await test_client.post(
+                "/ratings/", json={"book_id": book_ids[i], "rating": rating}, headers=auth_headers(token)
+            )
+
+    response = await test_client.get("/recommendations", headers=auth_headers(users[0]))
+    assert [b["id"] for b in response.json()] == [book_ids[3], book_ids[1], book_ids[4]]
+
+    response = await test_client.get(f"/recommendations?genre_id={genre_ids[1]}", headers=auth_headers(users[0]))
+    assert [b["id"] for b in response.json()] == [book_ids[3], book_ids[4]]
+
+    response = await test_client.get(
+        f"/recommendations?genre_id={genre_ids[1]}&year_from=2004", headers=auth_headers(users[0])
+    )
+    assert [b["id"] for b in response.json()] == [book_ids[4]]
+
+    response = await test_client.get(
+        f"/recommendations?genre_id={genre_ids[0]}&year_to=2001", headers=auth_headers(users[2])
+    )
+    assert [b["id"] for b in response.json()] == [book_ids[0], book_ids[1]]
+
+    response = await test_client.get(f"/recommendations?genre_id={genre_ids[1] + 100}", headers=auth_headers(users[2]))
+    assert response.json() == []
+
+    response = await test_client.get("/recommendations?year_from=999", headers=auth_headers(users[2]))
+    assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_recommendations_engine(test_client: AsyncClient, admin_token: str):
+    author = await test_client.post("/authors/", json={"name": "Test Author"}, headers=auth_headers(admin_token))
+    genre = await test_client.post("/genres/", json={"name": "Test Genre"}, headers=auth_headers(admin_token))
+
+    books = [
+        await test_client.post("/books/", json={
+            "title": f"Book {i}",
+            "author_id": author.json()["id"],
+            "genre_ids": [genre.json()["id"]],
+            "publication_year": 2000 + i
+        }, headers=auth_headers(admin_token)) for i in range(3)
+    ]
+    book_ids = [b.json()["id"] for b in books]
+
+    users = []
+    for i in range(3):
+        await test_client.post("/register", json={
+            "email": f"user{i}@test.com",
+            "username": f"user{i}",
+            "password": "password"
+        })
+        login = await test_client.post("/login", data={
+            "username": f"user{i}@test.com",
+            "password": "password"
+        })
+        users.append(login.json()["access_token"])
+
+    for token, rated in zip(users, [{0: 5}, {0: 5, 1: 2}, {2: 4}]):
+        for i, rating in rated.items():
+            await test_client.post(
+                "/ratings/", json={"book_id": book_ids[i], "rating": rating}, headers=auth_headers(token)
+            )
+
+    response = await test_client.get("/recommendations", headers=auth_headers(users[0]))
+    assert [b["id"] for b in response.json()] == [book_ids[1]]
+
+    response = await test_client.get("/recommendations?engine=popularity", headers=auth_headers(users[0]))
+    assert [b["id"] for b in response.json()] == [book_ids[2], book_ids[1]]
+
+    response = await test_client.get("/recommendations?engine=unknown", headers=auth_headers(users[0]))
+    assert response.status_code == 422
+
+    response = await test_client.get("/recommendations?engine=als", headers=auth_headers(users[0]))
+    assert response.status_code == 400
+    response = await test_client.post("/recommendations/batch", json={"user_ids": [1], "engine": "als"},
+                                      headers=auth_headers(admin_token))
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_recommendations_latency_budget(test_client: AsyncClient, admin_token: str, recommender: Recommender,
+                                              monkeypatch):
+    author = await test_client.post("/authors/", json={"name": "Test Author"}, headers=auth_headers(admin_token))
+    genre = await test_client.post("/genres/", json={"name": "Test Genre"}, headers=auth_headers(admin_token))
+
+    books = [
+        await test_client.post("/books/", json={
+            "title": f"Book {i}",
+            "author_id": author.json()["id"],
+            "genre_ids": [genre.json()["id"]],
+            "publication_year": 2000 + i
+        }, headers=auth_headers(admin_token)) for i in range(3)
+    ]
+    book_ids = [b.json()["id"] for b in books]
+
+    users = []
+    for i in range(2):
+        await test_client.post("/register", json={
+            "email": f"user{i}@test.com",
+            "username": f"user{i}",
+            "password": "password"
+        })
+        login = await test_client.post("/login", data={
+            "username": f"user{i}@test.com",
+            "password": "password"
+        })
+        users.append(login.json()["access_token"])
+
+    for token, rated in zip(users, [{0: 5}, {0: 5, 1: 4}]):
+        for i, rating in rated.items():
+            await test_client.post(
+                "/ratings/", json={"book_id": book_ids[i], "rating": rating}, headers=auth_headers(token)
+            )
+
+    response = await test_client.get("/recommendations", headers=auth_headers(users[0]))
+    assert [b["id"] for b in response.json()] == [book_ids[1]]
+    assert "X-Degraded" not in response.headers
+
+    await test_client.post("/ratings/", json={"book_id": book_ids[2], "rating": 3}, headers=auth_headers(users[1]))
+    released = asyncio.Event()
+    recommend = recommender.recommend
+
+    async def slow_recommend(*args, **kwargs):
+        await released.wait()
+        return await recommend(*args, **kwargs)
+
+    monkeypatch.setattr(recommender, "recommend", slow_recommend)
+    monkeypatch.setattr(settings, "RECOMMENDATIONS_LATENCY_BUDGET", 0.05)
+
+    response = await test_client.get("/recommendations", headers=auth_headers(users[0]))
+    assert response.headers["X-Degraded"] == "cached"
+    assert [b["id"] for b in response.json()] == [book_ids[1]]
+
+    response = await test_client.get("/recommendations?engine=popularity", headers=auth_headers(users[0]))
+    assert response.headers["X-Degraded"] == "popularity"
+    assert [b["id"] for b in response.json()] == book_ids
+    assert recommender.degradations == {"cached": 1, "popularity": 1}
+
+    released.set()
+    await asyncio.gather(*recommender.computations.values())
+    assert recommender.computations == {}
+
+    response = await test_client.get("/recommendations", headers=auth_headers(users[0]))
+    assert "X-Degraded" not in response.headers
+    assert [b["id"] for b in response.json()] == [book_ids[1], book_ids[2]]
+
+    async def failing_recommend(*args, **kwargs):
+        await asyncio.sleep(0.1)
+        raise RuntimeError("Model unavailable")
+
+    monkeypatch.setattr(recommender, "recommend", failing_recommend)
+    for _ in range(2):
+        response = await test_client.get("/recommendations?year_from=2001&limit=1", headers=auth_headers(users[0]))
+        assert response.headers["X-Degraded"] == "popularity"
+        assert [b["id"] for b in response.json()] == [book_ids[1]]
+        await asyncio.gather(*recommender.computations.values(), return_exceptions=True)
+        response = await test_client.get(
+            f"/recommendations?year_from=2001&limit=1&cursor={response.headers['X-Next-Cursor']}",
+            headers=auth_headers(users[0])
+        )
+        assert [b["id"] for b in response.json()] == [book_ids[2]]
+    assert recommender.degradations == {"cached": 1, "popularity": 3}
+
+
+@pytest.mark.asyncio
+async def test_recommendations_admission(test_client: AsyncClient, admin_token: str, recommender: Recommender):
+    author = await test_client.post("/authors/", json={"name": "Test Author"}, headers=auth_headers(admin_token))
+    genre = await test_client.post("/genres/", json={"name": "Test Genre"}, headers=auth_headers(admin_token))
+    book = await test_client.post("/books/", json={
+        "title": "Book",
+        "author_id": author.json()["id"],
+        "genre_ids": [genre.json()["id"]],
+        "publication_year": 2000
+    }, headers=auth_headers(admin_token))
+
+    recommender.gate = AdmissionGate(limit=1, queue=0)
+    async with recommender.gate.slot():
+        response = await test_client.get("/recommendations", headers=auth_headers(admin_token))
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "1"
+
+        response = await test_client.get(f"/books/{book.json()['id']}/similar")
+        assert response.status_code == 503
+
+        response = await test_client.get("/books/")
+        assert response.status_code == 200
+        response = await test_client.post(
+            "/ratings/", json={"book_id": book.json()["id"], "rating": 5}, headers=auth_headers(admin_token)
+        )
+        assert response.status_code == 201
+
+    response = await test_client.get("/recommendations", headers=auth_headers(admin_token))
+    assert response.status_code == 200
+
+    response = await test_client.get("/recommendations/metrics", headers=auth_headers(admin_token))
+    assert response.status_code == 200
+    assert response.json()["rejected"] == 2
+    assert response.json()["admitted"] == 2
+    assert response.json()["active"] == 0
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("budget", [0, 1.0])
+async def test_recommendations_wait_without_connection(test_client: AsyncClient, db_session: AsyncSession,
+                                                       admin_token: str, recommender: Recommender,
+                                                       monkeypatch, budget):
+    monkeypatch.setattr(settings, "RECOMMENDATIONS_LATENCY_BUDGET", budget)
+    author = await test_client.post("/authors/", json={"name": "Test Author"}, headers=auth_headers(admin_token))
+    genre = await test_client.post("/genres/", json={"name": "Test Genre"}, headers=auth_headers(admin_token))
+    book = await test_client.post("/books/", json={
+        "title": "Book",
+        "author_id": author.json()["id"],
+        "genre_ids": [genre.json()["id"]],
+        "publication_year": 2000
+    }, headers=auth_headers(admin_token))
+    await test_client.post("/ratings/", json={"book_id": book.json()["id"], "rating": 5},
+                           headers=auth_headers(admin_token))
+
+    holding = []
+    slot = recommender.gate.slot
+
+    def recorded_slot(*args, **kwargs):
+        holding.append(db_session.in_transaction())
+        return slot(*args, **kwargs)
+
+    monkeypatch.setattr(recommender.gate, "slot", recorded_slot)
+    response = await test_client.get("/recommendations", headers=auth_headers(admin_token))
+    assert response.status_code == 200
+    response = await test_client.get(f"/books/{book.json()['id']}/similar")
+    assert response.status_code == 200
+    response = await test_client.post("/recommendations/batch", json={"user_ids": [1]},
+                                      headers=auth_headers(admin_token))
+    assert response.status_code == 200
+    assert len(holding) >= 4
+    assert not any(holding)
+
+
+@pytest.mark.asyncio
+async def test_recommender_single_flight_build(test_client: AsyncClient, db_session: AsyncSession,
+                                               admin_token: str, recommender: Recommender, monkeypatch):
+    author = await test_client.post("/authors/", json={"name": "Test Author"}, headers=auth_headers(admin_token))
+    genre = await test_client.post("/genres/", json={"name": "Test Genre"}, headers=auth_headers(admin_token))
+    book = await test_client.post("/books/", json={
+        "title": "Book",
+        "author_id": author.json()["id"],
+        "genre_ids": [genre.json()["id"]],
+        "publication_year": 2000
+    }, headers=auth_headers(admin_token))
+    await test_client.post("/ratings/", json={"book_id": book.json()["id"], "rating": 5},
+                           headers=auth_headers(admin_token))
+
+    builds = 0
+    released = asyncio.Event()
+    build = recommender.build
+
+    async def gated_build(db):
+        nonlocal builds
+        builds += 1
+        await released.wait()
+        await build(db)
+
+    monkeypatch.setattr(recommender, "build", gated_build)
+
+    waiters = [asyncio.create_task(recommender.prepare(db_session)) for _ in range(5)]
+    await asyncio.sleep(0.01)
+    assert builds == 1
+    assert not any(waiter.done() for waiter in waiters)
+    released.set()
+    await asyncio.gather(*waiters)
+    assert builds == 1
+    assert not recommender.stale
+    matrix = recommender.matrix
+
+    released.clear()
+    recommender.invalidate()
+    await asyncio.gather(*(recommender.prepare(db_session) for _ in range(5)))
+    assert builds == 2
+    assert recommender.stale
+    assert recommender.matrix is matrix
+
+    recommender.invalidate()
+    released.set()
+    await asyncio.gather(*recommender.computations.values())
+    assert recommender.matrix is not matrix
+    assert recommender.stale
+
+    await recommender.prepare(db_session)
+    await asyncio.gather(*recommender.computations.values())
+    assert builds == 3
+    assert not recommender.stale
+
+
+@pytest.mark.asyncio
+async def test_recommender_build_writes_snapshot_in_thread(test_client: AsyncClient, db_session: AsyncSession,
+                                                           admin_token: str, recommender: Recommender,
+                                                           monkeypatch):
+    author = await test_client.post("/authors/", json={"name": "Test Author"}, headers=auth_headers(admin_token))
+    genre = await test_client.post("/genres/", json={"name": "Test Genre"}, headers=auth_headers(admin_token))
+    book = await test_client.post("/books/", json={
+        "title": "Book",
+        "author_id": author.json()["id"],
+        "genre_ids": [genre.json()["id"]],
+        "publication_year": 2000
+    }, headers=auth_headers(admin_token))
+    await test_client.post("/ratings/", json={"book_id": book.json()["id"], "rating": 5},
+                           headers=auth_headers(admin_token))
 
-    b = np.array([-2, 1, 0])
-    assert cosine_similarity(a, b) == pytest.approx(0.0)
+    writers = []
+    write_snapshot = recommender.write_snapshot
 
-    c = np.array([-1, -2, -3])
-    assert cosine_similarity(a, c) == pytest.approx(-1.0)
+    def recorded_write_snapshot(base):
+        writers.append(threading.current_thread())
+        return write_snapshot(base)
 
-    d = np.array([1, 1, 1])
-    assert 0 < cosine_similarity(a, d) < 1
+    monkeypatch.setattr(recommender, "write_snapshot", recorded_write_snapshot)
+    recommender.start_pool(1)
+    try:
+        await recommender.build(db_session)
+        assert len(writers) == 1
+        assert writers[0] is not threading.current_thread()
+        assert recommender.snapshot is not None
+        assert (recommender.snapshot.directory / "matrix").is_dir()
+    finally:
+        recommender.close()
@@ -0,0 +1,763 @@
+import asyncio
+import threading
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+
+from app.recommender import (
+    RatingMatrix, PatchedRatingMatrix, ItemNeighbors, ALSModel, Artifact, Recommender,
+    top_k_indices, recommend_books_batch, recommend_in_process, export_recommendations, UserLSH,
+    exact_neighbors, neighbor_recall, BookFilter, AdmissionGate, Saturated, score_books_batch, Engine,
+    EngineUnavailable, batch_size
+)
+from app.recommender.matrix import SparseRatings
+from app.recommender.similarity import recommend_from_neighbor_ratings
+from app.recommender.artifact import ARTIFACT_KEEP
+from app.recommender.loader import BinaryCopyParser, RatingBuffer, COPY_SIGNATURE, COPY_TRAILER
+from tests.conftest import cosine_similarity
+
+user_ids = np.array([10, 10, 10, 20, 20, 30, 30, 30, 40])
+book_ids = np.array([1, 2, 3, 2, 3, 1, 4, 5, 5])
+ratings = np.array([5, 3, 4, 4, 2, 1, 5, 5, 10])
+
+
+def dense(matrix: RatingMatrix) -> np.ndarray:
+    result = np.zeros((matrix.n_users, matrix.n_books))
+    for user_idx in range(matrix.n_users):
+        books, values = matrix.row(user_idx)
+        result[user_idx, books] = values
+    return result
+
+
+def user_similarities(matrix: SparseRatings, user_idx: int) -> np.ndarray:
+    _, neighbors, similarities = exact_neighbors(matrix, np.array([user_idx]), matrix.n_users)
+    result = np.zeros(matrix.n_users, dtype=similarities.dtype)
+    result[neighbors] = similarities
+    return result
+
+
+def recommend_books(matrix: SparseRatings, user_id: int, top_n_users: int, k: int) -> list[int]:
+    user_idx = matrix.user_index(user_id)
+    if user_idx is None:
+        return []
+    return recommend_books_batch(matrix, np.array([user_idx]), top_n_users, k)[0]
+
+
+def test_rating_matrix_from_triples():
+    matrix = RatingMatrix.from_triples(user_ids, book_ids, ratings)
+
+    assert list(matrix.user_ids) == [10, 20, 30, 40]
+    assert list(matrix.book_ids) == [1, 2, 3, 4, 5]
+    assert matrix.nnz == len(ratings)
+    assert matrix.indices.dtype == np.int32
+    assert matrix.data.dtype == np.int8
+
+    expected = np.zeros((4, 5))
+    for user_id, book_id, rating in zip(user_ids, book_ids, ratings):
+        expected[list(matrix.user_ids).index(user_id), book_id - 1] = rating
+    assert np.array_equal(dense(matrix), expected)
+
+    for book_idx in range(matrix.n_books):
+        start, end = matrix.col_indptr[book_idx], matrix.col_indptr[book_idx + 1]
+        column = np.zeros(matrix.n_users)
+        column[matrix.col_indices[start:end]] = matrix.col_data[start:end]
+        assert np.array_equal(column, expected[:, book_idx])
+
+    assert matrix.norms == pytest.approx(np.linalg.norm(expected, axis=1))
+    assert matrix.user_index(30) == 2
+    assert matrix.user_index(25) is None
+
+
+def test_user_similarities():
+    matrix = RatingMatrix.from_triples(user_ids, book_ids, ratings)
+    expected_matrix = dense(matrix)
+
+    for user_idx in range(matrix.n_users):
+        expected = [cosine_similarity(row, expected_matrix[user_idx]) for row in expected_matrix]
+        expected[user_idx] = 0
+        assert user_similarities(matrix, user_idx) == pytest.approx(expected)
+
+
+def test_recommend_books():
+    matrix = RatingMatrix.from_triples(user_ids, book_ids, ratings)
+
+    assert recommend_books(matrix, 20, top_n_users=5, k=10) == [1]
+    assert recommend_books(matrix, 40, top_n_users=5, k=10) == [4, 1]
+    assert recommend_books(matrix, 40, top_n_users=5, k=1) == [4]
+    assert recommend_books(matrix, 99, top_n_users=5, k=10) == []
+
+
+def test_patched_rating_matrix():
+    rng = np.random.default_rng(0)
+    state = {(u, b): r for u, b, r in zip(user_ids.tolist(), book_ids.tolist(), ratings.tolist())}
+    matrix = PatchedRatingMatrix(RatingMatrix.from_triples(user_ids, book_ids, ratings))
+
+    for _ in range(200):
+        user_id, book_id = int(rng.integers(10, 60, endpoint=True)), int(rng.integers(1, 8))
+        if rng.random() < 0.3:
+            matrix.remove_rating(user_id, book_id)
+            state.pop((user_id, book_id), None)
+        else:
+            rating = int(rng.integers(1, 10, endpoint=True))
+            matrix.set_rating(user_id, book_id, rating)
+            state[(user_id, book_id)] = rating
+    matrix.remove_book(3)
+    state = {key: rating for key, rating in state.items() if key[1] != 3}
+
+    assert matrix.nnz == len(state)
+    expected = np.zeros((matrix.n_users, matrix.n_books))
+    for (user_id, book_id), rating in state.items():
+        expected[matrix.user_index(user_id), matrix.book_index(book_id)] = rating
+    assert np.array_equal(dense(matrix), expected)
+    assert matrix.norms == pytest.approx(np.linalg.norm(expected, axis=1))
+
+    rebuilt = RatingMatrix.from_triples(*np.array([(*key, r) for key, r in state.items()]).T)
+    for user_id in rebuilt.user_ids:
+        expected_similarities = user_similarities(rebuilt, rebuilt.user_index(user_id))
+        similarities = user_similarities(matrix, matrix.user_index(user_id))
+        user_order = [matrix.user_index(other) for other in rebuilt.user_ids]
+        assert similarities[user_order] == pytest.approx(expected_similarities)
+        assert (recommend_books(matrix, user_id, top_n_users=3, k=10)
+                == recommend_books(rebuilt, user_id, top_n_users=3, k=10))
+
+
+def test_patched_rating_matrix_frozen():
+    matrix = PatchedRatingMatrix(RatingMatrix.from_triples(user_ids, book_ids, ratings))
+    view = matrix.frozen()
+    assert matrix.frozen() is view and view.frozen() is view
+    expected = dense(view)
+    norms = view.norms.copy()
+    scores = score_books_batch(view, np.arange(view.n_users), 3)
+
+    matrix.set_rating(50, 1, 4)
+    matrix.set_rating(10, 6, 7)
+    matrix.remove_rating(20, 2)
+    assert matrix.frozen() is not view
+    assert view.n_users == 4 and view.n_books == 5 and view.user_index(50) is None
+    assert np.array_equal(dense(view), expected)
+    assert np.array_equal(view.norms, norms)
+    assert np.array_equal(score_books_batch(view, np.arange(view.n_users), 3), scores)
+    assert dense(matrix.frozen())[matrix.user_index(50), 0] == 4
+
+
+def test_recommend_many_reads_frozen_matrix(monkeypatch):
+    model = Recommender()
+    model.reset(RatingMatrix.from_triples(user_ids, book_ids, ratings))
+    model.stale = False
+    expected = model.recommend_batch([10, 20, 40], 10, "user")
+
+    started, released = threading.Event(), threading.Event()
+    exact = exact_neighbors
+
+    def paused_neighbors(*args):
+        started.set()
+        released.wait(5)
+        return exact(*args)
+
+    monkeypatch.setattr("app.recommender.similarity.exact_neighbors", paused_neighbors)
+
+    async def recommend_while_rating():
+        task = asyncio.create_task(model.recommend_many([10, 20, 40], 10, engine="user"))
+        await asyncio.to_thread(started.wait, 5)
+        model.set_rating(50, 1, 4)
+        model.set_rating(10, 4, 9)
+        model.remove_rating(30, 4)
+        released.set()
+        return await task
+
+    assert asyncio.run(recommend_while_rating()) == expected
+
+
+@pytest.mark.parametrize("recommender_engine", ["user", "item"])
+def test_recommend_many_survives_reset(recommender_engine, monkeypatch):
+    model = Recommender()
+    model.reset(RatingMatrix.from_triples(user_ids, book_ids, ratings))
+    model.item_neighbors = ItemNeighbors.build(model.matrix.to_matrix(), k=3)
+    model.stale = False
+    expected = model.recommend_batch([10, 20, 40], 10, recommender_engine)
+
+    started, released = threading.Event(), threading.Event()
+    size = batch_size
+
+    def paused_batch_size(*args):
+        started.set()
+        released.wait(5)
+        return size(*args)
+
+    monkeypatch.setattr("app.recommender.model.batch_size", paused_batch_size)
+
+    async def recommend_while_resetting():
+        task = asyncio.create_task(model.recommend_many([10, 20, 40], 10, engine=recommender_engine))
+        await asyncio.to_thread(started.wait, 5)
+        model.reset(RatingMatrix.from_triples(np.array([10, 20]), np.array([9, 8]), np.array([5, 5])))
+        model.item_neighbors = ItemNeighbors.build(model.matrix.to_matrix(), k=3)
+        released.set()
+        return await task
+
+    assert asyncio.run(recommend_while_resetting()) == expected
+
+
+def test_compact_dtypes():
+    rng = np.random.default_rng(6)
+    users, books = np.nonzero(rng.random((40, 30)) < 0.3)
+    matrix = RatingMatrix.from_triples(users + 1, books + 1, rng.integers(1, 10, len(users), endpoint=True))
+    patched = PatchedRatingMatrix(matrix)
+    for user_id, book_id in zip(rng.integers(1, 45, 50), rng.integers(1, 35, 50)):
+        patched.set_rating(int(user_id), int(book_id), int(rng.integers(1, 10, endpoint=True)))
+
+    assert matrix.data.dtype == matrix.col_data.dtype == np.int8
+    assert matrix.indices.dtype == matrix.col_indices.dtype == np.int32
+    assert matrix.norms.dtype == patched.norms.dtype == np.float32
+
+    for current in (matrix, patched):
+        reference = dense(current)
+        norms = np.linalg.norm(reference, axis=1)
+        assert current.norms == pytest.approx(norms, rel=1e-6)
+        similarities = reference @ reference.T / np.outer(norms, norms)
+        np.fill_diagonal(similarities, 0)
+        expected = np.maximum(similarities, 0) @ reference
+        expected[reference > 0] = 0
+
+        scores = score_books_batch(current, np.arange(current.n_users), current.n_users - 1)
+        assert scores.dtype == np.float32
+        np.testing.assert_allclose(scores, expected, rtol=1e-5, atol=1e-4)
+        for user_idx in range(current.n_users):
+            assert user_similarities(current, user_idx).dtype == np.float32
+            assert user_similarities(current, user_idx) == pytest.approx(similarities[user_idx], rel=1e-5)
+
+
+def test_item_neighbors():
+    matrix = RatingMatrix.from_triples(user_ids, book_ids, ratings)
+    expected_matrix = dense(matrix)
+    neighbors = ItemNeighbors.build(matrix, k=2)
+
+    for book_idx in range(matrix.n_books):
+        expected = np.array([cosine_similarity(column, expected_matrix[:, book_idx]) for column in expected_matrix.T])
+        expected[book_idx] = 0
+        found = neighbors.neighbors[book_idx][neighbors.neighbors[book_idx] >= 0]
+        assert set(found) == set(top_k_indices(expected, 2)[expected[top_k_indices(expected, 2)] > 0])
+        assert neighbors.similarities[book_idx, :len(found)] == pytest.approx(expected[found])
+
+    patched = PatchedRatingMatrix(matrix)
+    assert neighbors.recommend(patched, 20, k=10) == [1]
+    assert neighbors.recommend(patched, 40, k=10) == [4, 1]
+    patched.set_rating(40, 4, 7)
+    patched.set_rating(40, 6, 7)
+    assert neighbors.recommend(patched, 40, k=10) == [1]
+    assert neighbors.recommend(patched, 99, k=10) == []
+
+    for book_idx, book_id in enumerate(matrix.book_ids):
+        found = neighbors.neighbors[book_idx][neighbors.neighbors[book_idx] >= 0]
+        assert neighbors.similar(book_id, k=2) == matrix.book_ids[found].tolist()
+    assert neighbors.similar(1, k=1) == neighbors.similar(1, k=2)[:1]
+    assert neighbors.similar(99, k=2) == []
+
+
+def test_als_model(tmp_path):
+    rng = np.random.default_rng(1)
+    true_ratings = np.clip(np.round(rng.random((40, 2)) @ rng.random((2, 30)) * 5 + 1), 1, 10)
+    observed = rng.random(true_ratings.shape) < 0.6
+    users, books = np.nonzero(observed)
+    matrix = RatingMatrix.from_triples(users + 1, books + 1, true_ratings[observed])
+
+    model = ALSModel.train(matrix, factors=4, iterations=10, regularization=0.1)
+    assert model.user_factors.dtype == np.float32
+    assert model.rmse(matrix) < 0.5
+
+    model.save(tmp_path / "als")
+    loaded = ALSModel.open(tmp_path / "als")
+    assert np.array_equal(loaded.book_factors, model.book_factors)
+    assert loaded.regularization == model.regularization
+
+    patched = PatchedRatingMatrix(matrix)
+    rated, _ = matrix.row(0)
+    assert loaded.user_vectors(patched, np.arange(3)) == pytest.approx(model.user_factors[:3], abs=1e-3)
+
+    recommended = loaded.recommend(patched, 1, k=5)
+    assert len(recommended) == 5
+    assert not set(recommended) & set(matrix.book_ids[rated].tolist())
+    assert loaded.recommend(patched, 999, k=5) == []
+
+
+def test_recommend_books_batch():
+    rng = np.random.default_rng(2)
+    users, books = np.nonzero(rng.random((30, 20)) < 0.3)
+    matrix = RatingMatrix.from_triples(users + 1, books + 1, rng.integers(1, 10, len(users), endpoint=True))
+    neighbors = ItemNeighbors.build(matrix, k=5)
+    model = ALSModel.train(matrix, factors=3, iterations=3, regularization=0.1)
+
+    user_indices = np.arange(matrix.n_users)
+    batch = recommend_books_batch(matrix, user_indices, top_n_users=3, k=5)
+    item_batch = neighbors.recommend_batch(matrix, user_indices, k=5)
+    als_batch = model.recommend_batch(matrix, user_indices, k=5)
+    for user_idx, user_id in enumerate(matrix.user_ids):
+        assert batch[user_idx] == recommend_books(matrix, user_id, top_n_users=3, k=5)
+        assert item_batch[user_idx] == neighbors.recommend(matrix, user_id, k=5)
+        assert als_batch[user_idx] == model.recommend(matrix, user_id, k=5)
+
+
+def test_book_filter():
+    rng = np.random.default_rng(4)
+    users, books = np.nonzero(rng.random((30, 20)) < 0.3)
+    matrix = RatingMatrix.from_triples(users + 1, books + 1, rng.integers(1, 10, len(users), endpoint=True))
+    neighbors = ItemNeighbors.build(matrix, k=5)
+    model = ALSModel.train(matrix, factors=3, iterations=3, regularization=0.1)
+
+    catalog_ids = np.arange(1, 26, dtype=np.int32)
+    book_filter = BookFilter(catalog_ids, catalog_ids % 2 == 0, {})
+    allowed = book_filter.allowed(matrix.book_ids, "matrix", matrix)
+    assert allowed.tolist() == (matrix.book_ids % 2 == 0).tolist()
+    assert book_filter.alignments["matrix"][0] is matrix
+    assert book_filter.allowed(np.array([2, 3, 40])).tolist() == [True, False, False]
+
+    user_indices = np.arange(matrix.n_users)
+    for batch, unfiltered in [
+        (recommend_books_batch(matrix, user_indices, 3, 20, allowed=allowed),
+         recommend_books_batch(matrix, user_indices, 3, 20)),
+        (neighbors.recommend_batch(matrix, user_indices, 20, allowed),
+         neighbors.recommend_batch(matrix, user_indices, 20)),
+        (model.recommend_batch(matrix, user_indices, 20, allowed),
+         model.recommend_batch(matrix, user_indices, 20))
+    ]:
+        for filtered, full in zip(batch, unfiltered):
+            assert sorted(filtered) == sorted(book_id for book_id in full if book_id % 2 == 0)
+
+
+def test_engines():
+    rng = np.random.default_rng(5)
+    users, books = np.nonzero(rng.random((30, 20)) < 0.3)
+    model = Recommender()
+    model.reset(RatingMatrix.from_triples(users + 1, books + 1, rng.integers(1, 10, len(users), endpoint=True)))
+    model.stale = False
+    with pytest.raises(EngineUnavailable):
+        model.recommend_batch([1, 2], 5, "als")
+    model.als_model = ALSModel.train(model.matrix.to_matrix(), factors=3, iterations=3, regularization=0.1)
+
+    user_indices = np.arange(model.matrix.n_users)
+    for name in ("user", "item", "als", "popularity"):
+        engine = model.engines[name]
+        view = model.view()
+        if not engine.ready(view):
+            engine.build(view)
+            engine.install(view)
+        scores = engine.score(view, user_indices)
+        _, book_index, _ = engine.book_index(view)
+        assert scores.shape == (len(user_indices), len(book_index))
+        for row, book_ids in zip(scores, engine.top_k(view, user_indices, 5)):
+            positions = np.searchsorted(book_index, book_ids)
+            assert row[positions].tolist() == sorted(row[row > 0], reverse=True)[:len(book_ids)]
+    assert model.item_neighbors is not None
+    assert (model.engines["user"].top_k(model.view(), user_indices, 5)
+            == recommend_books_batch(model.matrix, user_indices, 5, 5))
+
+    class Incomplete(Engine):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete(model)
+    with pytest.raises(TypeError):
+        type("IncompleteRatings", (SparseRatings,), {"n_users": 0})()
+
+
+def test_popularity_engine():
+    model = Recommender()
+    model.reset(RatingMatrix.from_triples(user_ids, book_ids, ratings))
+    model.stale = False
+
+    assert model.recommend_batch([20, 10, 50], 3, "popularity") == [[5, 4, 1], [5, 4], []]
+    model.set_rating(40, 5, 2)
+    assert model.recommend_batch([20], 3, "popularity") == [[4, 5, 1]]
+
+
+def test_admission_gate():
+    async def scenario():
+        gate = AdmissionGate(limit=1, queue=1)
+        released = asyncio.Event()
+
+        async def hold():
+            async with gate.slot():
+                await released.wait()
+
+        holder = asyncio.create_task(hold())
+        queued = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        assert (gate.active, gate.waiting) == (1, 1)
+
+        with pytest.raises(Saturated) as error:
+            async with gate.slot():
+                pass
+        assert error.value.status_code == 503
+        assert error.value.headers["Retry-After"] == "2"
+
+        released.set()
+        await asyncio.gather(holder, queued)
+        return gate.metrics()
+
+    metrics = asyncio.run(scenario())
+    assert metrics["active"] == 0 and metrics["waiting"] == 0
+    assert (metrics["admitted"], metrics["rejected"]) == (2, 1)
+    assert metrics["max_wait_seconds"] > 0
+
+
+def test_top_k_indices():
+    values = np.array([0.5, 3.0, -1.0, 2.0, 1.0])
+    assert list(top_k_indices(values, 3)) == [1, 3, 4]
+    assert list(top_k_indices(values, 10)) == [1, 3, 4, 0, 2]
+    assert len(top_k_indices(values, 0)) == 0
+
+
+def test_rating_matrix_save_open(tmp_path):
+    matrix = RatingMatrix.from_triples(user_ids, book_ids, ratings)
+    matrix.save(tmp_path / "matrix")
+    opened = RatingMatrix.open(tmp_path / "matrix")
+
+    assert isinstance(opened.indices, np.memmap)
+    assert np.array_equal(dense(opened), dense(matrix))
+    assert np.array_equal(opened.norms, matrix.norms)
+    assert recommend_books(PatchedRatingMatrix(opened), 40, top_n_users=5, k=10) == [4, 1]
+
+
+@pytest.mark.parametrize("recommender_engine", ["user", "item"])
+def test_recommend_in_process(recommender_engine):
+    recommender = Recommender()
+    recommender.start_pool(1)
+    try:
+        recommender.reset(RatingMatrix.from_triples(user_ids, book_ids, ratings))
+        recommender.item_neighbors = ItemNeighbors.build(recommender.matrix.to_matrix(), k=3)
+        recommender.save_item_neighbors()
+
+        def score() -> list[list[int]]:
+            return recommender.pool.submit(
+                recommend_in_process, recommender.snapshot, tuple(recommender.journal),
+                recommender_engine, [10, 20, 40, 99], 10
+            ).result()
+
+        assert score() == recommender.recommend_batch([10, 20, 40, 99], 10, recommender_engine)
+        recommender.set_rating(20, 4, 9)
+        recommender.remove_rating(40, 5)
+        recommender.set_rating(50, 1, 7)
+        assert len(recommender.journal) == 3
+        assert score() == recommender.recommend_batch([10, 20, 40, 99], 10, recommender_engine)
+
+        recommender.compact()
+        assert recommender.journal == []
+        assert score() == recommender.recommend_batch([10, 20, 40, 99], 10, recommender_engine)
+    finally:
+        recommender.close()
+
+
+def test_build_item_engine_during_compaction(monkeypatch):
+    recommender = Recommender()
+    recommender.start_pool(1)
+    try:
+        recommender.reset(RatingMatrix.from_triples(user_ids, book_ids, ratings))
+        started, released = threading.Event(), threading.Event()
+        build = ItemNeighbors.build
+
+        def paused_build(*args):
+            started.set()
+            released.wait(5)
+            return build(*args)
+
+        monkeypatch.setattr("app.recommender.engines.ItemNeighbors.build", paused_build)
+        save_threads = []
+        save = recommender.save_item_neighbors
+
+        def recorded_save():
+            save_threads.append(threading.current_thread())
+            save()
+
+        monkeypatch.setattr(recommender, "save_item_neighbors", recorded_save)
+
+        async def build_while_compacting():
+            task = asyncio.create_task(recommender.build_engine("item"))
+            await asyncio.to_thread(started.wait, 5)
+            recommender.set_rating(50, 1, 7)
+            recommender.compact()
+            released.set()
+            await task
+
+        asyncio.run(build_while_compacting())
+        assert save_threads == [threading.main_thread()]
+        snapshot = recommender.snapshot
+        assert recommender.journal == []
+        assert RatingMatrix.open(snapshot.directory / "matrix").user_index(50) is not None
+        assert (snapshot.directory / snapshot.item_neighbors).is_dir()
+        assert (recommender.pool.submit(
+            recommend_in_process, snapshot, (), "item", [10, 20, 50], 10
+        ).result() == recommender.recommend_batch([10, 20, 50], 10, "item"))
+    finally:
+        recommender.close()
+
+
+def test_recommend_in_process_als(tmp_path, monkeypatch):
+    matrix = RatingMatrix.from_triples(user_ids, book_ids, ratings)
+    ALSModel.train(matrix, factors=3, iterations=3, regularization=0.1).save(tmp_path / "als")
+    monkeypatch.setattr("app.recommender.model.settings.ALS_MODEL_PATH", str(tmp_path / "als"))
+    recommender = Recommender()
+    recommender.start_pool(1)
+    try:
+        recommender.reset(matrix)
+
+        def score(engine: str) -> list[list[int]]:
+            return recommender.pool.submit(
+                recommend_in_process, recommender.snapshot, tuple(recommender.journal),
+                engine, [10, 20, 40], 10
+            ).result()
+
+        assert score("user") == recommender.recommend_batch([10, 20, 40], 10, "user")
+        recommender.load_als_model()
+        assert recommender.recommend_batch([10, 20, 40], 10, "als") != recommender.recommend_batch(
+            [10, 20, 40], 10, "user"
+        )
+        assert score("als") == recommender.recommend_batch([10, 20, 40], 10, "als")
+
+        recommender.compact()
+        assert recommender.snapshot.als_model is not None
+        assert score("als") == recommender.recommend_batch([10, 20, 40], 10, "als")
+    finally:
+        recommender.close()
+
+
+def test_artifact(tmp_path, monkeypatch):
+    monkeypatch.setattr("app.recommender.model.settings.RECOMMENDER_ARTIFACT_DIR", str(tmp_path))
+    assert Artifact.current(tmp_path) is None
+
+    source = Recommender()
+    source.reset(RatingMatrix.from_triples(user_ids, book_ids, ratings))
+    source.item_neighbors = ItemNeighbors.build(source.matrix.to_matrix(), k=3)
+    source.set_rating(20, 4, 9)
+    source.high_water_mark = datetime.now(timezone.utc)
+    published = source.publish_artifact()
+
+    artifact = Artifact.current(tmp_path)
+    assert artifact.version == published.version
+    assert artifact.manifest["ratings"] == source.matrix.nnz
+    assert artifact.high_water_mark == source.high_water_mark
+    assert artifact.open_als_model() is None
+
+    recommender = Recommender()
+    recommender.open_artifact(artifact)
+    assert isinstance(recommender.matrix.base.data, np.memmap)
+    assert isinstance(recommender.item_neighbors.neighbors, np.memmap)
+    for engine in ("user", "item"):
+        assert (recommender.recommend_batch([10, 20, 30, 40], 10, engine)
+                == source.recommend_batch([10, 20, 30, 40], 10, engine))
+
+    for _ in range(ARTIFACT_KEEP + 1):
+        latest = source.publish_artifact()
+    assert Artifact.current(tmp_path).version == latest.version
+    assert len([path for path in tmp_path.iterdir() if path.is_dir()]) == ARTIFACT_KEEP
+
+
+def test_publish_artifact_during_reset(tmp_path, monkeypatch):
+    monkeypatch.setattr("app.recommender.model.settings.RECOMMENDER_ARTIFACT_DIR", str(tmp_path))
+    source = Recommender()
+    source.reset(RatingMatrix.from_triples(user_ids, book_ids, ratings))
+    source.set_rating(20, 4, 9)
+    high_water_mark = source.high_water_mark = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    expected = source.recommend_batch([10, 20, 30, 40], 10, "user")
+
+    started, released = threading.Event(), threading.Event()
+    to_matrix = PatchedRatingMatrix.to_matrix
+
+    def paused_to_matrix(self):
+        started.set()
+        released.wait(5)
+        return to_matrix(self)
+
+    monkeypatch.setattr(PatchedRatingMatrix, "to_matrix", paused_to_matrix)
+
+    async def publish_while_resetting():
+        task = asyncio.create_task(source._publish_in_thread())
+        await asyncio.to_thread(started.wait, 5)
+        source.reset(RatingMatrix.from_triples(np.array([10]), np.array([9]), np.array([5])))
+        source.set_rating(10, 8, 3)
+        source.high_water_mark = datetime.now(timezone.utc)
+        released.set()
+        return await task
+
+    artifact = asyncio.run(publish_while_resetting())
+    assert artifact.high_water_mark == high_water_mark
+    opened = Recommender()
+    opened.open_artifact(artifact)
+    assert opened.recommend_batch([10, 20, 30, 40], 10, "user") == expected
+
+
+def test_reload_als_model(tmp_path, monkeypatch):
+    monkeypatch.setattr("app.recommender.model.settings.RECOMMENDER_ARTIFACT_DIR", str(tmp_path / "artifacts"))
+    monkeypatch.setattr("app.recommender.model.settings.ALS_MODEL_PATH", str(tmp_path / "als"))
+    matrix = RatingMatrix.from_triples(user_ids, book_ids, ratings)
+    ALSModel.train(matrix, factors=3, iterations=3, regularization=0.1).save(tmp_path / "als")
+
+    source = Recommender()
+    source.reset(matrix)
+    source.load_als_model()
+    assert not source.reload_als_model()
+    source.high_water_mark = datetime.now(timezone.utc)
+    artifact = source.publish_artifact()
+
+    recommender = Recommender()
+    recommender.open_artifact(artifact)
+    assert not recommender.reload_als_model()
+
+    retrained = ALSModel.train(matrix, factors=4, iterations=3, regularization=0.1)
+    retrained.save(tmp_path / "als")
+    version = recommender.version
+    assert recommender.reload_als_model()
+    assert recommender.version == version + 1
+    assert np.array_equal(recommender.als_model.book_factors, retrained.book_factors)
+    assert not recommender.reload_als_model()
+
+    recommender.high_water_mark = source.high_water_mark
+    assert Artifact.current(tmp_path / "artifacts").open_als_model().book_factors.shape[1] == 3
+    assert recommender.publish_artifact().open_als_model().book_factors.shape[1] == 4
+
+
+def test_artifact_pool_snapshot(tmp_path, monkeypatch):
+    monkeypatch.setattr("app.recommender.model.settings.RECOMMENDER_ARTIFACT_DIR", str(tmp_path))
+    source = Recommender()
+    source.reset(RatingMatrix.from_triples(user_ids, book_ids, ratings))
+    source.item_neighbors = ItemNeighbors.build(source.matrix.to_matrix(), k=3)
+    source.high_water_mark = datetime.now(timezone.utc)
+    artifact = source.publish_artifact()
+    published = {path: path.stat().st_mtime_ns for path in artifact.directory.rglob("*")}
+
+    recommender = Recommender()
+    recommender.start_pool(1)
+    try:
+        recommender.open_artifact(artifact)
+        snapshot = recommender.snapshot
+        assert snapshot.directory.parent == tmp_path and snapshot.directory != artifact.directory
+        recommender.item_neighbors = ItemNeighbors.build(recommender.matrix.to_matrix(), k=2)
+        recommender.save_item_neighbors()
+        assert {path: path.stat().st_mtime_ns for path in artifact.directory.rglob("*")} == published
+
+        for _ in range(ARTIFACT_KEEP):
+            source.publish_artifact()
+        assert not artifact.directory.exists()
+        for engine in ("user", "item"):
+            assert (recommender.pool.submit(
+                recommend_in_process, recommender.snapshot, (), engine, [10, 20, 30, 40], 10
+            ).result() == recommender.recommend_batch([10, 20, 30, 40], 10, engine))
+    finally:
+        recommender.close()
+    assert not snapshot.directory.exists()
+
+
+def test_binary_copy_parser():
+    records = np.zeros(len(ratings), dtype=[
+        ("fields", ">i2"), ("a", ">i4"), ("user_id", ">i4"), ("b", ">i4"), ("book_id", ">i4"), ("c", ">i4"), ("rating", ">i4")
+    ])
+    records["fields"] = 3
+    records["a"] = records["b"] = records["c"] = 4
+    records["user_id"], records["book_id"], records["rating"] = user_ids, book_ids, ratings
+    extension = b"ext"
+    stream = (COPY_SIGNATURE + (0).to_bytes(4, "big") + len(extension).to_bytes(4, "big") + extension
+              + records.tobytes() + COPY_TRAILER)
+
+    async def feed(chunk_size: int) -> RatingBuffer:
+        parser = BinaryCopyParser(RatingBuffer(2))
+        for start in range(0, len(stream), chunk_size):
+            await parser(stream[start:start + chunk_size])
+        parser.finish()
+        return parser.buffer
+
+    for chunk_size in (1, 7, 26, len(stream)):
+        buffer = asyncio.run(feed(chunk_size))
+        assert np.array_equal(buffer.user_ids[:buffer.size], user_ids)
+        assert np.array_equal(buffer.book_ids[:buffer.size], book_ids)
+        assert np.array_equal(buffer.ratings[:buffer.size], ratings)
+
+
+def test_export_recommendations(tmp_path):
+    recommender = Recommender()
+    recommender.reset(RatingMatrix.from_triples(user_ids, book_ids, ratings))
+
+    count = export_recommendations(recommender, tmp_path / "recommendations.npz", k=2, block_size=3)
+    exported = np.load(tmp_path / "recommendations.npz")
+
+    assert exported["user_id"].dtype == np.int32 and exported["book_id"].dtype == np.int32
+    assert len(exported["book_id"]) == count
+    expected = recommender.recommend_batch([10, 20, 30, 40], 2)
+    for user_id, books in zip([10, 20, 30, 40], expected):
+        mask = exported["user_id"] == user_id
+        assert exported["book_id"][mask].tolist() == books
+        assert exported["rank"][mask].tolist() == list(range(len(books)))
+    assert exported["rank"].dtype == np.int16
+
+    export_recommendations(recommender, tmp_path / "deep.npz", k=40000)
+    assert np.load(tmp_path / "deep.npz")["rank"].dtype == np.int32
+
+
+def test_user_lsh_single_bucket_is_exact():
+    matrix = RatingMatrix.from_triples(user_ids, book_ids, ratings)
+    index = UserLSH.build(matrix, tables=1, bits=0)
+    user_indices = np.arange(matrix.n_users)
+
+    rows, neighbors, similarities = index.neighbors(matrix, user_indices, 2, probes=0, candidates=10)
+    exact_rows, exact_neighbors_, exact_similarities = exact_neighbors(matrix, user_indices, 2)
+    assert rows.tolist() == exact_rows.tolist()
+    assert np.allclose(similarities, exact_similarities)
+    assert recommend_books_batch(matrix, user_indices, 2, 10, index, probes=0, candidates=10) == \
+        recommend_books_batch(matrix, user_indices, 2, 10)
+
+
+def test_user_lsh_recall():
+    rng = np.random.default_rng(0)
+    clusters = rng.integers(0, 20, 2000)
+    users = np.repeat(np.arange(2000), 10)
+    books = np.repeat(clusters, 10) * 20 + rng.integers(0, 20, 20000)
+    matrix = RatingMatrix.from_triples(users, books, rng.integers(1, 11, 20000))
+    index = UserLSH.build(matrix, tables=16, bits=8)
+    sample = rng.choice(matrix.n_users, 100, replace=False)
+
+    recalls = [neighbor_recall(matrix, index, sample, 5, probes, 10000)[0] for probes in (0, 2, 4)]
+    assert recalls == sorted(recalls)
+    assert recalls[-1] > 0.5
+
+
+def test_recommender_user_lsh(tmp_path, monkeypatch):
+    recommender = Recommender()
+    recommender.reset(RatingMatrix.from_triples(user_ids, book_ids, ratings))
+    expected = recommender.recommend_batch([10, 20, 30, 40], 10, "user")
+
+    monkeypatch.setattr("app.recommender.model.settings.USER_NEIGHBORS_INDEX", "lsh")
+    monkeypatch.setattr("app.recommender.model.settings.LSH_BITS", 0)
+    monkeypatch.setattr("app.recommender.model.settings.RECOMMENDER_ARTIFACT_DIR", str(tmp_path))
+    assert recommender.recommend_batch([10, 20, 30, 40], 10, "user") == expected
+    assert recommender.user_lsh is None
+    asyncio.run(recommender.build_engine("user"))
+    assert recommender.user_lsh is not None
+
+    recommender.reset(recommender.matrix.to_matrix())
+    assert recommender.user_lsh is None
+
+    recommender.set_rating(50, 1, 4)
+    recommender.compact()
+    assert recommender.engines["user"].ready(recommender.view())
+    assert sorted(set(recommender.user_lsh.members.tolist())) == list(range(recommender.matrix.n_users))
+
+    recommender.high_water_mark = datetime.now(timezone.utc)
+    opened = Recommender()
+    opened.open_artifact(recommender.publish_artifact())
+    assert opened.engines["user"].ready(opened.view())
+    assert (opened.recommend_batch([10, 20, 30, 40, 50], 10, "user")
+            == recommender.recommend_batch([10, 20, 30, 40, 50], 10, "user"))
+
+
+def test_recommend_from_neighbor_ratings():
+    matrix = RatingMatrix.from_triples(user_ids, book_ids, ratings)
+    user_indices = np.arange(matrix.n_users)
+    rows, neighbors, similarities = exact_neighbors(matrix, user_indices, 2)
+    expected = recommend_books_batch(matrix, user_indices, 2, 10)
+
+    for user_idx in user_indices:
+        selected = rows == user_idx
+        neighbor_ids = matrix.user_ids[neighbors[selected]]
+        loaded = np.isin(user_ids, [matrix.user_ids[user_idx], *neighbor_ids])
+        assert recommend_from_neighbor_ratings(
+            int(matrix.user_ids[user_idx]), neighbor_ids, similarities[selected],
+            user_ids[loaded], book_ids[loaded], ratings[loaded], 10
+        ) == expected[user_idx]